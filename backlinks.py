@@ -0,0 +1,147 @@
+"""
+Backlink verification - finds pages which can be translated from language A to language B, but the page in B has no
+translation back to A. Every page and langlink table is loaded once, titles are encoded into integer codes and all
+joins are done on integer arrays.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from common import STORE_DIR
+from store import read_frame, page_table, langlink_table, table_exists
+
+
+class PageCodes:
+    """Page table of one language with titles encoded into integer codes"""
+
+    def __init__(self, lang):
+        df = read_frame(page_table(lang))
+        order = np.argsort(df.index.values, kind='stable')
+        # Page IDs sorted for binary search, codes of their titles
+        self.ids = df.index.values[order].astype(np.int64)
+        codes, titles = pd.factorize(df[1].values[order])
+        self.codes = codes.astype(np.int64)
+        self.titles = pd.Index(titles)
+        # Page IDs grouped by title code - pages with title code c are page_ids[starts[c]:starts[c + 1]]
+        by_code = np.argsort(self.codes, kind='stable')
+        self.page_ids = self.ids[by_code]
+        self.starts = np.searchsorted(self.codes[by_code], np.arange(len(self.titles) + 1))
+
+    def title_codes(self, page_ids):
+        """Title codes of pages with given IDs, -1 where page is not in the table"""
+        if not len(self.ids):
+            return np.full(len(page_ids), -1, dtype=np.int64)
+        rows = np.searchsorted(self.ids, page_ids)
+        found = rows < len(self.ids)
+        found[found] = self.ids[rows[found]] == page_ids[found]
+        return np.where(found, self.codes[np.minimum(rows, len(self.ids) - 1)], -1)
+
+    def expand_titles(self, codes):
+        """
+        Finds pages of given title codes. Title can belong to more pages (different namespaces).
+        :return: Tuple (indices into `codes`, page IDs), one item per found page
+        """
+        counts = self.starts[codes + 1] - self.starts[codes]
+        positions = np.repeat(np.arange(len(codes)), counts)
+        # Offset of each page within its title group
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return positions, self.page_ids[self.starts[codes][positions] + offsets]
+
+
+def langlink_arrays(lang_from, lang_to):
+    """Page IDs (sorted) and translated titles of a langlinks table, titles with underscores instead of spaces"""
+    df = read_frame(langlink_table(lang_from, lang_to))
+    order = np.argsort(df.index.values, kind='stable')
+    return df.index.values[order].astype(np.int64), pd.Series(df[1].values[order]).str.replace(' ', '_').values
+
+
+def contains(sorted_values, values):
+    """Mask of `values` which are in sorted array"""
+    rows = np.searchsorted(sorted_values, values)
+    found = rows < len(sorted_values)
+    found[found] = sorted_values[rows[found]] == values[found]
+    return found
+
+
+def backlink_languages():
+    """Languages with both page and langlinks tables parsed - backlinks can be checked between any two of them"""
+    languages = set()
+    for directory in ('csv/page', f'{STORE_DIR}/page'):
+        if os.path.exists(directory):
+            languages.update(os.path.splitext(name)[0] for name in os.listdir(directory))
+    return sorted(lang for lang in languages
+                  if os.path.exists(f'csv/langlinks/{lang}') or os.path.exists(f'{STORE_DIR}/langlinks/{lang}'))
+
+
+def check_pair(pages_from: PageCodes, pages_to: PageCodes, forward, backward_ids):
+    """
+    Checks backlinks of one ordered pair of languages
+    :param pages_from: Pages of source language
+    :param pages_to: Pages of target language
+    :param forward: Page IDs and translated titles from source to target langlinks, see `langlink_arrays`
+    :param backward_ids: Sorted page IDs from target to source langlinks
+    :return: Dictionary with counts and list of titles with broken backlinks
+    """
+    ids_from, translated = forward
+    codes_from = pages_from.title_codes(ids_from)
+    # Translated titles encoded into codes of target language titles
+    codes_to = pages_to.titles.get_indexer(translated)
+    valid = (codes_from >= 0) & (codes_to >= 0)
+    codes_from, codes_to = codes_from[valid], codes_to[valid]
+
+    # One row per target page with translated title
+    positions, ids_to = pages_to.expand_titles(codes_to)
+    codes_from = codes_from[positions]
+    working = contains(backward_ids, ids_to)
+
+    working_titles = np.unique(codes_from[working])
+    broken = codes_from[~working]
+    # Broken backlinks where another page with the same title has working backlink
+    from_duplicates = contains(working_titles, broken)
+    dead = np.unique(broken[~from_duplicates])
+    return {'translations': int(len(ids_from)),
+            'checked': int(len(codes_from)),
+            'working_backlinks': int(working.sum()),
+            'broken_backlinks': int(len(dead)),
+            'broken_backlinks_from_duplicates': int(from_duplicates.sum()),
+            'broken_titles': [str(title) for title in pages_from.titles[dead]]}
+
+
+def check_all_backlinks(languages):
+    """
+    Checks backlinks between all ordered pairs of given languages
+    :param languages: Language codes, each of them needs page and langlinks tables
+    :return: List of results of `check_pair` with lang_from and lang_to keys
+    """
+    pages = {lang: PageCodes(lang) for lang in languages}
+    # Each langlinks table is loaded once and used in both directions
+    links = dict()
+    for lang_from in languages:
+        for lang_to in languages:
+            if lang_from != lang_to and table_exists(langlink_table(lang_from, lang_to)):
+                links[(lang_from, lang_to)] = langlink_arrays(lang_from, lang_to)
+
+    report = []
+    for lang_from in languages:
+        for lang_to in languages:
+            if lang_from == lang_to or (lang_from, lang_to) not in links:
+                continue
+            backward_ids = links[(lang_to, lang_from)][0] if (lang_to, lang_from) in links else np.array([], np.int64)
+            result = check_pair(pages[lang_from], pages[lang_to], links[(lang_from, lang_to)], backward_ids)
+            report.append(dict({'lang_from': lang_from, 'lang_to': lang_to}, **result))
+    return report
+
+
+def write_report(report, path):
+    """
+    Writes backlink report. JSON file contains all results, Parquet file (requires pyarrow) one row per
+    broken backlink with lang_from, lang_to and title columns.
+    """
+    if path.endswith('.parquet'):
+        pd.DataFrame([(r['lang_from'], r['lang_to'], title) for r in report for title in r['broken_titles']],
+                     columns=['lang_from', 'lang_to', 'title']).to_parquet(path, index=False)
+    else:
+        with open(path, 'w', encoding='utf8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,192 @@
+import argparse
+import datetime
+import json
+import sys
+
+import numpy as np
+from tqdm import tqdm
+
+from common import MAIN_LANGS, index_name
+from searcher import load_index, preprocess, search_page_id, strip_namespace
+from title_index import exact_pages
+from store import cached_table, read_frame, table_exists, langlink_table
+
+# Number of terms whose queries are sent to Elasticsearch in one _msearch request
+ES_BATCH_SIZE = 100
+
+
+def read_terms(file):
+    """Yields non-empty terms from a file with one term per line"""
+    for line in file:
+        term = line.strip()
+        if term:
+            yield term
+
+
+def chunked(iterable, size):
+    """Splits iterable into lists of at most `size` items"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def langlink_lookup(lang_from, lang_to):
+    """
+    Prepares a function translating many page IDs at once. Uses memory-mapped binary store table if it exists,
+    otherwise the whole .csv table is loaded once.
+    :param lang_from: Input language code
+    :param lang_to: Target language code
+    :return: Function taking a sequence of page IDs and returning a list of translated titles (None if missing)
+    """
+    table = cached_table(langlink_table(lang_from, lang_to))
+    if table is not None:
+        def lookup(page_ids):
+            # One binary search of all IDs, then only found titles are decoded
+            rows = table.find(page_ids)
+            return [table.title(row) if row >= 0 else None for row in rows]
+        return lookup
+
+    titles = read_frame(langlink_table(lang_from, lang_to))[1]
+    # Duplicate IDs would make reindexing ambiguous
+    titles = titles[~titles.index.duplicated()]
+
+    def lookup(page_ids):
+        translated = titles.reindex(np.asarray(page_ids, dtype=np.int64))
+        return [None if isinstance(t, float) else t for t in translated.values]
+    return lookup
+
+
+def translate_batch(terms, searcher, lookup, namespaces=False, lang=None):
+    """
+    Translates a batch of terms - finds pages of all terms first, then translates all page IDs at once
+    :param terms: List of terms
+    :param searcher: Whoosh searcher of the input language page index
+    :param lookup: Function translating page IDs, see `langlink_lookup`
+    :param namespaces: Leave translated pages with namespace prefixes in output
+    :param lang: Input language, exact titles are then looked up in its title hash index first
+    :return: Generator of (term, original title, translated title) tuples, titles are None if not found
+    """
+    # Repeated terms in the batch are searched only once
+    pages = dict()
+    for term in terms:
+        if term not in pages:
+            pages[term] = exact_pages(preprocess(term), lang) if lang else None
+            if pages[term]:
+                continue
+            try:
+                pages[term] = search_page_id(preprocess(term), searcher, suggest=False)
+            except ValueError:
+                pages[term] = []
+
+    page_ids = [page_id for found in pages.values() for page_id, _ in found]
+    translations = iter(lookup(page_ids))
+    translated_pages = dict()
+    for term, found in pages.items():
+        translated_pages[term] = [(title, next(translations)) for _, title in found]
+
+    for term in terms:
+        if not translated_pages[term]:
+            yield term, None, None
+        for original, translated in translated_pages[term]:
+            if translated is not None and not namespaces:
+                translated = strip_namespace(original, translated)
+            yield term, original, translated
+
+
+def translate_elastic_batch(terms, lang_from, lang_to, namespaces=False):
+    """
+    Translates a batch of terms using Elasticsearch index, forward and reverse queries of `ES_BATCH_SIZE` terms are
+    sent in one _msearch request
+    :param terms: List of terms
+    :param lang_from: Input language code
+    :param lang_to: Target language code
+    :param namespaces: Leave translated pages with namespace prefixes in output
+    :return: Generator of (term, original title, translated title) tuples, titles are None if not found
+    """
+    import elastic_searcher
+
+    for term, results in elastic_searcher.translate_many(terms, lang_from, lang_to, ES_BATCH_SIZE):
+        pairs = [] if results is None else \
+            list(results.dropna().itertuples(index=False, name=None))
+        if not pairs:
+            yield term, None, None
+        for original, translated in pairs:
+            if not namespaces:
+                translated = strip_namespace(original, translated)
+            yield term, original, translated
+
+
+def write_tsv(rows, output):
+    for term, original, translated in rows:
+        output.write(f'{term}\t{original or ""}\t{translated or ""}\n')
+
+
+def write_jsonl(rows, output):
+    for term, original, translated in rows:
+        output.write(json.dumps({'term': term, 'original': original, 'translated': translated},
+                                ensure_ascii=False) + '\n')
+
+
+WRITERS = {'tsv': write_tsv, 'jsonl': write_jsonl}
+
+
+def main(args):
+    if args.elastic:
+        if args.lang_from not in MAIN_LANGS and args.lang_to not in MAIN_LANGS:
+            exit(f'lang_from or lang_to should be one of {MAIN_LANGS}. They were: {args.lang_from}, {args.lang_to}')
+    elif args.lang_from not in MAIN_LANGS:
+        exit(f'lang_from should be one of {MAIN_LANGS}. It was: {args.lang_from}')
+    elif not table_exists(langlink_table(args.lang_from, args.lang_to)):
+        exit(f'Cannot translate from {args.lang_from} to {args.lang_to}. '
+             f'Check language codes and make sure parser has been run.')
+
+    input_file = open(args.input, encoding='utf8') if args.input != '-' else sys.stdin
+    output = open(args.output, 'w', encoding='utf8') if args.output != '-' else sys.stdout
+    write = WRITERS[args.format]
+    start = datetime.datetime.now()
+    total = 0
+    try:
+        with tqdm(desc=f'Translating {args.lang_from} -> {args.lang_to}', unit=' terms') as progress:
+            if args.elastic:
+                for terms in chunked(read_terms(input_file), args.batch_size):
+                    write(translate_elastic_batch(terms, args.lang_from, args.lang_to, args.namespaces), output)
+                    total += len(terms)
+                    progress.update(len(terms))
+            else:
+                lookup = langlink_lookup(args.lang_from, args.lang_to)
+                with load_index(index_name(args.lang_from)).searcher() as searcher:
+                    for terms in chunked(read_terms(input_file), args.batch_size):
+                        write(translate_batch(terms, searcher, lookup, args.namespaces, args.lang_from), output)
+                        total += len(terms)
+                        progress.update(len(terms))
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output is not sys.stdout:
+            output.close()
+    elapsed = datetime.datetime.now() - start
+    print(f'Translated {total} terms in {elapsed} ({total / max(elapsed.total_seconds(), 1e-9):.0f} terms/s)',
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Translate many terms at once')
+    arg_parser.add_argument('lang_from', help=f'Language code of the input terms. Should be one of {MAIN_LANGS} '
+                                              f'(with -e, either this or lang_to).')
+    arg_parser.add_argument('lang_to', help='Code of target language')
+    arg_parser.add_argument('-i', '--input', help='File with one term per line, "-" for stdin', default='-')
+    arg_parser.add_argument('-o', '--output', help='Output file, "-" for stdout', default='-')
+    arg_parser.add_argument('-f', '--format', help='Output format', choices=list(WRITERS), default='tsv')
+    arg_parser.add_argument('-b', '--batch_size', help='Number of terms translated at once', type=int, default=10000)
+    arg_parser.add_argument('-n', '--namespaces', help='Leave translated pages with namespace prefixes in output',
+                            action='store_true')
+    arg_parser.add_argument('-e', '--elastic', help='Use Elasticsearch index, queries of many terms are sent in one '
+                                                    'request', action='store_true')
+
+    args = arg_parser.parse_args()
+    main(args)
@@ -0,0 +1,596 @@
+"""
+Benchmark of the whole pipeline on synthetic Wikipedia dumps. Dumps are generated deterministically (same seed and
+scale give the same dumps), then parsing, building of binary store and indexes, translation latency and statistics
+are timed in a temporary working directory. Results are written as JSON, so that runs can be compared.
+"""
+import argparse
+import contextlib
+import datetime
+import http.server
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+# Same path as in parser.main
+DUMP_PATH = 'wikipedia_dumps\\'
+# Letters of generated titles - plain, accented, and characters which need care when parsing
+LETTERS = {
+    'cs': 'abcdeghijklmnoprstuvyzáčďéěíňóřšťúůýž',
+    'fi': 'adehijklmnoprstuvyäö',
+    'sk': 'abcdefhijklmnoprstuvyzáäčďéíĺľňóôŕšťúýž',
+}
+# Target languages of langlinks, more are generated if needed
+TARGET_LANGS = ['en', 'de', 'fr', 'pl', 'ru', 'it', 'es', 'hu', 'uk', 'ja', 'zh', 'nl', 'pt', 'sv', 'no', 'da']
+# Punctuation inserted into some titles, quote and backslash have to be escaped in SQL
+SPECIAL = ["'", '"', '\\', ',', '(', ')', "','", ':', '–']
+ROWS_PER_INSERT = 1000
+# Wall time of `searcher.py` translating one exact title, including interpreter startup
+STARTUP_BUDGET_MS = 500
+STARTUP_RUNS = 5
+# Maximum number of repetitions of the dump in `allocations`, the old path of the baseline is slow
+ALLOCATION_REPEATS = 4
+# Modules which a lookup of an exact title should not import
+HEAVY_MODULES = ('pandas', 'elasticsearch', 'whoosh.searching')
+
+
+def sql_string(value):
+    """Escapes a string as mysqldump does"""
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'").replace('"', '\\"') + "'"
+
+
+def generate_title(rng: random.Random, letters):
+    """Random title of 1-4 words, some with punctuation"""
+    words = []
+    for _ in range(rng.choice((1, 1, 2, 2, 3, 4))):
+        word = ''.join(rng.choice(letters) for _ in range(rng.randint(2, 9)))
+        words.append(word.capitalize() if rng.random() < 0.6 else word)
+    title = ' '.join(words)
+    if rng.random() < 0.1:
+        position = rng.randint(0, len(title))
+        title = title[:position] + rng.choice(SPECIAL) + title[position:]
+    if rng.random() < 0.05:
+        title += f' ({rng.randint(1900, 2020)})'
+    return title
+
+
+def write_inserts(f, table, rows):
+    """Writes rows as extended INSERT statements, like mysqldump"""
+    f.write(f'-- MySQL dump\n\nDROP TABLE IF EXISTS `{table}`;\nCREATE TABLE `{table}` (\n) ENGINE=InnoDB;\n\n'
+            f'LOCK TABLES `{table}` WRITE;\n')
+    for start in range(0, len(rows), ROWS_PER_INSERT):
+        f.write(f'INSERT INTO `{table}` VALUES ' + ','.join(rows[start:start + ROWS_PER_INSERT]) + ';\n')
+    f.write('UNLOCK TABLES;\n')
+
+
+def generate_dumps(directory, pages=20000, target_langs=30, seed=42):
+    """
+    Generates page and langlinks dumps of main languages. Pages of different languages describe common concepts,
+    most langlinks between main languages point to an existing page and most of them have a backlink.
+    :param directory: Working directory, dumps are written as `parser.main` expects them
+    :param pages: Number of pages per main language
+    :param target_langs: Number of target languages in langlinks
+    :param seed: Random seed
+    :return: Total size of dumps in bytes
+    """
+    rng = random.Random(seed)
+    main_langs = list(LETTERS)
+    targets = (TARGET_LANGS + [f'x{i:02d}' for i in range(target_langs)])[:target_langs]
+    concepts = int(pages * 1.2)
+    # Title of each concept in each main language, None if the language has no page about it
+    titles = dict()
+    for lang in main_langs:
+        lang_titles = [generate_title(rng, LETTERS[lang]) for _ in range(concepts)]
+        for i in rng.sample(range(concepts), concepts - pages):
+            lang_titles[i] = None
+        # Some titles are duplicated (the same title in different namespaces)
+        for i in rng.sample(range(concepts), concepts // 100):
+            if lang_titles[i] is not None:
+                lang_titles[i] = lang_titles[rng.randrange(concepts)] or lang_titles[i]
+        titles[lang] = lang_titles
+
+    size = 0
+    for lang in main_langs:
+        page_ids = dict()
+        page_rows = []
+        page_id = 0
+        for concept, title in enumerate(titles[lang]):
+            if title is None:
+                continue
+            # Page IDs are increasing, with gaps
+            page_id += rng.randint(1, 5)
+            page_ids[concept] = page_id
+            namespace = 14 if rng.random() < 0.05 else 0
+            page_rows.append(f"({page_id},{namespace},{sql_string(title.replace(' ', '_'))},'',0,0,"
+                             f"{rng.random():.6f},'20201101000000','20201101000000',{rng.randint(1, 10 ** 6)},"
+                             f"{rng.randint(1, 10 ** 5)},'wikitext',NULL)")
+
+        langlink_rows = []
+        for concept, page_id in page_ids.items():
+            for target in main_langs + targets:
+                if target == lang or rng.random() > 0.7:
+                    continue
+                if target in titles:
+                    # Link to a missing page now and then
+                    translated = titles[target][concept] or generate_title(rng, LETTERS[target])
+                else:
+                    translated = f'{target.upper()} ' + generate_title(rng, 'abcdefghijklmnopqrstuvwxyz')
+                if rng.random() < 0.02:
+                    translated = f'Category:{translated}'
+                langlink_rows.append(f'({page_id},{sql_string(target)},{sql_string(translated)})')
+
+        for table, rows in (('page', page_rows), ('langlinks', langlink_rows)):
+            path = os.path.join(directory, f'{DUMP_PATH}{lang}wiki-latest-{table}.sql')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf8') as f:
+                write_inserts(f, table, rows)
+            size += os.path.getsize(path)
+    return size
+
+
+class Benchmark:
+    """Collects timings of benchmark stages"""
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.stages = dict()
+
+    @contextlib.contextmanager
+    def stage(self, name, **info):
+        """Times a stage, output of the stage is hidden unless verbose"""
+        print(f'{name}...', file=sys.stderr)
+        output = contextlib.nullcontext() if self.verbose else contextlib.redirect_stdout(io.StringIO())
+        result = dict(info)
+        start = time.perf_counter()
+        with output:
+            yield result
+        result['seconds'] = time.perf_counter() - start
+        self.stages[name] = result
+        print(f'{name}: {result["seconds"]:.3f} s', file=sys.stderr)
+
+
+def parser_args(jobs):
+    return argparse.Namespace(pages_only=False, langlinks_only=False, time=False, one_index=False, incremental=False,
+                              yes=True, jobs=jobs, index_workers=4, bulk_size=5000, chunk_size=128)
+
+
+def query_terms(rng: random.Random, lang, count):
+    """Whole titles and single words of titles of a parsed language"""
+    from store import read_frame, page_table
+
+    titles = read_frame(page_table(lang))[1].tolist()
+    terms = []
+    for title in rng.sample(titles, min(count, len(titles))):
+        title = title.replace('_', ' ')
+        words = [word for word in title.split() if len(word) > 3 and word.isalpha()]
+        terms.append(rng.choice(words) if words and rng.random() < 0.3 else title)
+    return terms
+
+
+def searcher_startup(term, lang_from, lang_to, runs=STARTUP_RUNS):
+    """
+    Measures startup of searcher command line interface, run in the current working directory
+    :return: Dictionary with median wall time and heavy modules imported by the run
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'searcher.py')
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter_ns()
+        subprocess.run([sys.executable, script, term, lang_from, lang_to], check=True, stdout=subprocess.DEVNULL)
+        samples.append((time.perf_counter_ns() - start) / 1e6)
+    # Same run once more, reporting which heavy modules it imported
+    check = (f'import runpy, sys; sys.argv = {[script, term, lang_from, lang_to]!r}; '
+             f'sys.path.insert(0, {os.path.dirname(script)!r}); '
+             f'runpy.run_path({script!r}, run_name="__main__"); '
+             f'print("modules:" + ",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))')
+    output = subprocess.run([sys.executable, '-c', check], check=True, capture_output=True, text=True).stdout
+    modules = output.rsplit('modules:', 1)[-1].strip()
+    median = float(np.median(samples))
+    return {'median_ms': median,
+            'budget_ms': STARTUP_BUDGET_MS,
+            'within_budget': median <= STARTUP_BUDGET_MS,
+            'heavy_modules': modules.split(',') if modules else []}
+
+
+def write_langlink_results(lines, directory):
+    """
+    Writes langlinks from `parse.Result` objects of a template matcher, as parser did before the SQL tokenizer -
+    baseline of `allocations`. Titles containing `','` are split wrongly, which doesn't matter for allocations.
+    :return: Number of rows
+    """
+    from parse import compile
+    from table_writer import TableWriters, CHECK_ROWS
+
+    langlink_parser = compile("({page_id:d},{target_lang},'{target_title}')")
+    rows = 0
+    with TableWriters(directory) as writers:
+        buffers = dict()
+        for line in lines:
+            if not line.startswith('INSERT INTO'):
+                continue
+            for r in langlink_parser.findall(line[line.find('('):]):
+                target_lang = r['target_lang'].strip("'")
+                write = buffers.get(target_lang)
+                if write is None:
+                    write = buffers[target_lang] = writers.buffer(target_lang).write
+                write(f'{r["page_id"]}\t{r["target_title"]}\n')
+                rows += 1
+                if not rows % CHECK_ROWS:
+                    writers.check()
+    return rows
+
+
+def write_langlink_rows(lines, directory):
+    """
+    Writes langlinks row by row from row tuples of the SQL tokenizer, as parser did before record batches
+    :return: Number of rows
+    """
+    from sql_tokenizer import iter_rows
+    from table_writer import TableWriters, CHECK_ROWS
+
+    rows = 0
+    with TableWriters(directory) as writers:
+        buffers = dict()
+        for page_id, target_lang, target_title in iter_rows(lines):
+            write = buffers.get(target_lang)
+            if write is None:
+                write = buffers[target_lang] = writers.buffer(target_lang).write
+            write(f'{page_id}\t{target_title}\n')
+            rows += 1
+            if not rows % CHECK_ROWS:
+                writers.check()
+    return rows
+
+
+def write_langlink_batches(lines, directory):
+    """Writes langlinks from record batches, as parser does, see `write_langlink_rows`"""
+    import parser
+
+    rows = 0
+
+    def counted(batches):
+        nonlocal rows
+        for batch in batches:
+            rows += len(batch.page_ids)
+            yield batch
+
+    parser.write_langlinks(counted(parser.parse_batches(lines, 'langlinks')), directory, set())
+    return rows
+
+
+def traced_statements(lines, statements):
+    """
+    Yields lines of a dump, for each line (one INSERT statement) appends the most memory allocated over the traced
+    memory before the line, while the line is parsed and written. Memory kept from previous statements (buffered
+    rows of table writers) is not counted.
+    """
+    for line in lines:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        yield line
+        statements.append(tracemalloc.get_traced_memory()[1] - before)
+
+
+def allocation_profile(path, write, directory):
+    """
+    Memory allocated while a langlinks dump is parsed and written, traced by tracemalloc. The dump is repeated until
+    it is larger than twice the budget of table writers (at most `ALLOCATION_REPEATS` times), so that buffers are
+    flushed as in parsing of a real dump. Lines are read and all writing paths are imported before tracing starts.
+    :param path: Path to the dump
+    :param write: Function writing lines of the dump into a directory, returning number of rows
+    :param directory: Output directory, removed afterwards
+    :return: Dictionary with number of rows, memory allocated per statement and row, peak traced memory and time
+    """
+    from dump_reader import DumpReader
+    # Imported here so that import of the modules is not traced in the first profiled path
+    import parse
+    import parser
+    import sql_tokenizer
+    import table_writer
+
+    lines = list(DumpReader(path))
+    repeats = min(2 * table_writer.BUFFER_BUDGET // max(os.path.getsize(path), 1) + 1, ALLOCATION_REPEATS)
+    statements = []
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        rows = write(traced_statements(itertools.chain.from_iterable(itertools.repeat(lines, repeats)), statements),
+                     directory)
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+    allocated = sum(statements)
+    return {'rows': rows,
+            'repeats': repeats,
+            'statements': len(statements),
+            'median_statement_bytes': float(np.median(statements)) if statements else 0.0,
+            'allocated_bytes_per_row': allocated / max(rows, 1),
+            'peak_bytes': peak,
+            'traced_seconds': seconds}
+
+
+class StandInElasticsearch(http.server.ThreadingHTTPServer):
+    """
+    Local server answering _msearch requests like Elasticsearch would, from a list of translation documents.
+    A query matches documents with equal (case insensitive) queried title and equal languages.
+    """
+
+    def __init__(self, documents):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.documents = documents
+        self.requests = 0
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def search(self, query):
+        conditions = dict()
+        for condition in query['query']['bool']['must']:
+            (field, value), = condition['match'].items()
+            conditions[field] = value['query'].lower()
+        return [{'_source': document} for document in self.documents
+                if all(document[field].lower() == value for field, value in conditions.items())]
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        lines = self.rfile.read(int(self.headers['Content-Length'])).decode('utf8').splitlines()
+        self.server.requests += 1
+        # Header and body lines alternate
+        responses = [{'hits': {'hits': self.server.search(json.loads(line))}} for line in lines[1::2]]
+        body = json.dumps({'responses': responses}).encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def elastic_batch_check(titles, source, target):
+    """
+    Translates titles by batch_translate in Elasticsearch mode against a stand-in server. A third of titles has
+    only a forward translation, a third only a reverse one and a third both (forward one is expected), some terms
+    are unknown or repeated, so answers of _msearch must be matched to the right terms and directions.
+    :return: Dictionary with number of terms, requests and terms with unexpected translations
+    """
+    from elasticsearch import Elasticsearch
+    import elastic_searcher
+    from batch_translate import translate_elastic_batch, ES_BATCH_SIZE
+    from cache import query_cache, normalize_term
+
+    titles = list({normalize_term(title): title for title in titles}.values())
+    documents = []
+    expected = dict()
+    for i, title in enumerate(titles):
+        if i % 3 != 1:
+            documents.append({'original_title': title, 'translated': f'{title} (forward)',
+                              'source_lang': source, 'target_lang': target})
+            expected[title] = [(title, f'{title} (forward)')]
+        if i % 3 != 0:
+            documents.append({'original_title': f'{title} (reverse)', 'translated': title,
+                              'source_lang': target, 'target_lang': source})
+            expected.setdefault(title, [(title, f'{title} (reverse)')])
+    unknown = [f'{title} (unknown)' for title in titles[::10]]
+    expected.update((term, [(None, None)]) for term in unknown)
+    terms = titles + unknown + titles[::7]
+
+    server = StandInElasticsearch(documents)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    query_cache.clear()
+    elastic_searcher._client = Elasticsearch(server.url)
+    try:
+        translated = dict()
+        for term, original, translation in translate_elastic_batch(terms, source, target, namespaces=True):
+            translated.setdefault(term, []).append((original, translation))
+    finally:
+        elastic_searcher._client = None
+        query_cache.clear()
+        server.shutdown()
+        server.server_close()
+    # Repeated terms are answered once per occurrence
+    mismatched = [term for term in expected if translated.get(term) != expected[term] * terms.count(term)]
+    return {'terms': len(terms), 'requests': server.requests, 'batch_size': ES_BATCH_SIZE,
+            'mismatched': len(mismatched), 'matched': not mismatched}
+
+
+def misspell(rng: random.Random, term):
+    """Term with one character replaced by another letter"""
+    position = rng.randrange(len(term))
+    return term[:position] + rng.choice('abcdefghijklmnopqrstuvwxyz') + term[position + 1:]
+
+
+def latency_summary(samples):
+    """Percentiles and mean of latencies in nanoseconds, in milliseconds"""
+    samples = np.array(samples) / 1e6
+    return {'p50_ms': float(np.percentile(samples, 50)),
+            'p99_ms': float(np.percentile(samples, 99)),
+            'mean_ms': float(samples.mean())}
+
+
+def run(args):
+    bench = Benchmark(args.verbose)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='vinf_benchmark_')
+    os.makedirs(workdir, exist_ok=True)
+    cwd = os.getcwd()
+    output = os.path.abspath(args.output)
+    os.chdir(workdir)
+    try:
+        with bench.stage('generate', pages=args.pages, target_langs=args.target_langs, seed=args.seed) as result:
+            result['dump_bytes'] = generate_dumps('.', args.pages, args.target_langs, args.seed)
+        dump_mb = bench.stages['generate']['dump_bytes'] / 1024 / 1024
+
+        import parser
+        with bench.stage('parser_main', jobs=args.jobs) as result:
+            parser.main(parser_args(args.jobs))
+        bench.stages['parser_main']['mb_per_second'] = dump_mb / bench.stages['parser_main']['seconds']
+
+        # Stages run by parser.main, timed again separately
+        from common import MAIN_LANGS
+        tasks = [(f'{DUMP_PATH}{lang}wiki-latest-{table}.sql', lang, table)
+                 for lang in MAIN_LANGS for table in ('page', 'langlinks')]
+        if args.jobs > 1:
+            with bench.stage('parse_parallel', jobs=args.jobs):
+                parser.parse_parallel(tasks, args.jobs, 128 * 1024 * 1024)
+            bench.stages['parse_parallel']['mb_per_second'] = dump_mb / bench.stages['parse_parallel']['seconds']
+        if args.allocations:
+            # Memory of parse and write loops - template matcher of the original parser, row tuples of the tokenizer
+            # written one by one and record batches
+            with bench.stage('allocations', lang=MAIN_LANGS[0]) as result:
+                path = f'{DUMP_PATH}{MAIN_LANGS[0]}wiki-latest-langlinks.sql'
+                for name, write in (('results', write_langlink_results), ('rows', write_langlink_rows),
+                                    ('batches', write_langlink_batches)):
+                    result[name] = allocation_profile(path, write, 'allocations')
+                for name in ('results', 'rows'):
+                    result[f'allocated_ratio_{name}'] = (result['batches']['allocated_bytes_per_row']
+                                                         / max(result[name]['allocated_bytes_per_row'], 1))
+        tables = parser.parsed_tables(tasks)
+        with bench.stage('build_store', tables=len(tables)):
+            parser.build_store(tables, args.jobs)
+        from page_indexer import build_page_indexes
+        with bench.stage('page_indexes', jobs=args.jobs) as result:
+            result['languages'] = build_page_indexes(MAIN_LANGS, args.jobs)
+        with bench.stage('title_indexes'):
+            parser.build_title_indexes(MAIN_LANGS)
+        from translation_graph import build_translation_graph
+        with bench.stage('translation_graph') as result:
+            result.update(build_translation_graph())
+        result['bytes_per_edge'] = result['bytes'] / max(result['edges'], 1)
+
+        from build_one_index import build_one_index
+        secondary = MAIN_LANGS + TARGET_LANGS[:2]
+        with bench.stage('build_one_index', primary=MAIN_LANGS, secondary=secondary):
+            build_one_index(MAIN_LANGS, secondary, workers=args.jobs, restart=True)
+
+        import searcher
+        from cache import query_cache
+        from common import index_name
+        rng = random.Random(args.seed)
+        latencies = dict()
+        with bench.stage('translate', queries=args.queries) as result:
+            for lang_from in MAIN_LANGS:
+                page_index = searcher.load_index(index_name(lang_from))
+                lang_to = 'en'
+                samples = []
+                not_found = 0
+                for term in query_terms(rng, lang_from, args.queries):
+                    start = time.perf_counter_ns()
+                    try:
+                        searcher.translate(term, lang_from, lang_to, page_index)
+                    except SystemExit:
+                        # Term was not found (e.g. it contains query syntax), translate exits the program
+                        not_found += 1
+                    samples.append(time.perf_counter_ns() - start)
+                query_cache.clear()
+                latencies[f'{lang_from}->{lang_to}'] = dict(latency_summary(samples), not_found=not_found)
+            result['latency'] = latencies
+
+        # Page lookups by n-gram index - prefix of a title and a title with a typo
+        with bench.stage('approximate', queries=args.queries) as result:
+            for lang in MAIN_LANGS:
+                samples = {'prefix': [], 'fuzzy': []}
+                found = {'prefix': 0, 'fuzzy': 0}
+                for term in query_terms(rng, lang, args.queries):
+                    for match, query in (('prefix', term[:max(2, len(term) // 2)]), ('fuzzy', misspell(rng, term))):
+                        start = time.perf_counter_ns()
+                        try:
+                            pages = searcher.find_page_id(query, None, lang, match)
+                        except ValueError:
+                            pages = []
+                        samples[match].append(time.perf_counter_ns() - start)
+                        found[match] += any(title == term for _, title in pages)
+                result[lang] = {match: dict(latency_summary(samples[match]), found=found[match] / len(samples[match]))
+                                for match in samples}
+
+        # Translations between two target languages, through pages of main languages
+        from store import read_frame, page_table, langlink_table
+        from translation_graph import graph_translations
+        with bench.stage('graph_translate', queries=args.queries) as result:
+            lang_from, lang_to = TARGET_LANGS[:2]
+            titles = read_frame(langlink_table(MAIN_LANGS[0], lang_from))[1].tolist()
+            samples = []
+            found = 0
+            for title in rng.sample(titles, min(args.queries, len(titles))):
+                start = time.perf_counter_ns()
+                translations = graph_translations([title], lang_from, lang_to)
+                samples.append(time.perf_counter_ns() - start)
+                found += any(translated is not None for _, translated, _ in translations)
+            result[f'{lang_from}->{lang_to}'] = dict(latency_summary(samples), found=found / max(len(samples), 1))
+
+        # Batch translation by Elasticsearch, answered by a local stand-in server
+        with bench.stage('elastic_batch', queries=args.queries) as result:
+            titles = read_frame(page_table(MAIN_LANGS[0]))[1].tolist()
+            result.update(elastic_batch_check(rng.sample(titles, min(args.queries, len(titles))), MAIN_LANGS[0], 'en'))
+        if not result['matched']:
+            print(f'Elasticsearch batch translation returned wrong results for {result["mismatched"]} terms',
+                  file=sys.stderr)
+
+        title = read_frame(page_table(MAIN_LANGS[0]))[1].iloc[0].replace('_', ' ')
+        with bench.stage('searcher_startup', runs=STARTUP_RUNS) as result:
+            result.update(searcher_startup(title, MAIN_LANGS[0], 'en'))
+        if not result['within_budget']:
+            print(f'Searcher startup {result["median_ms"]:.0f} ms is over budget of {STARTUP_BUDGET_MS} ms',
+                  file=sys.stderr)
+
+        import stats
+        from backlinks import backlink_languages, check_all_backlinks
+        with bench.stage('stats_compute'):
+            stats.compute_stats(args.jobs)
+        with bench.stage('stats_backlinks'):
+            check_all_backlinks(backlink_languages())
+        with bench.stage('stats_terms'):
+            for _ in stats.multiple_occurrences(args.jobs):
+                pass
+    finally:
+        os.chdir(cwd)
+        if not args.workdir and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {'date': datetime.datetime.now().isoformat(),
+              'python': sys.version.split()[0],
+              'platform': platform.platform(),
+              'cpus': os.cpu_count(),
+              'stages': bench.stages}
+    with open(output, 'w', encoding='utf8') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {output}', file=sys.stderr)
+    return report
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Benchmark parsing, indexing, translation and statistics on '
+                                                     'synthetic dumps')
+    arg_parser.add_argument('-n', '--pages', help='Number of pages per main language', type=int, default=20000)
+    arg_parser.add_argument('-l', '--target_langs', help='Number of target languages in langlinks', type=int,
+                            default=30)
+    arg_parser.add_argument('-s', '--seed', help='Random seed of generated dumps', type=int, default=42)
+    arg_parser.add_argument('-j', '--jobs', help='Number of processes', type=int, default=1)
+    arg_parser.add_argument('-q', '--queries', help='Number of translated terms per language', type=int, default=500)
+    arg_parser.add_argument('-o', '--output', help='JSON file with results', default='benchmark.json')
+    arg_parser.add_argument('-w', '--workdir', help='Working directory (temporary directory by default)')
+    arg_parser.add_argument('-k', '--keep', help='Keep temporary working directory', action='store_true')
+    arg_parser.add_argument('-v', '--verbose', help='Show output of benchmarked stages', action='store_true')
+    arg_parser.add_argument('-a', '--allocations', help='Profile memory allocated by parse and write loops (slow)',
+                            action='store_true')
+
+    args = arg_parser.parse_args()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    run(args)
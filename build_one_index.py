@@ -1,66 +1,253 @@
+import argparse
+import collections
 import datetime
-from multiprocessing import Pool
+import json
+import os
+import queue
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+from json.encoder import encode_basestring
+from multiprocessing import Process, Queue
 from typing import Tuple
 
-import pandas as pd
-from elasticsearch import Elasticsearch
-from elasticsearch.helpers import parallel_bulk
+from elasticsearch import ApiError, Elasticsearch, TransportError
 from tqdm import tqdm
-from whoosh.index import create_in
+from whoosh.index import create_in, exists_in, open_dir
+from whoosh.query import And, Term
 
-from common import INDEX_DIR, one_index_schema
+import metrics
+from common import INDEX_DIR, ES_INDEX, ES_HOST, one_index_schema
+from metrics import timed
+from page_indexer import MIN_PARALLEL_DOCS
+from store import merge_join, page_table, langlink_table, table_exists, table_length
+
+
+# Action line preceding each document in bulk body
+BULK_ACTION = json.dumps({'index': {'_index': ES_INDEX}})
+BIG_INDEX = 'big_index'
+# Language combinations committed into Whoosh big index
+CHECKPOINT_FILE = f'{BIG_INDEX}_checkpoint.json'
+# Seconds between checks of worker processes while waiting for their output
+WORKER_POLL = 5
+# Translation pairs sent from a preparing process to the Whoosh writer at once
+PAIRS_CHUNK = 10000
+# Chunks of one language combination prepared ahead of the writer
+PREFETCH_CHUNKS = 4
 
 
 def combinations(primary, secondary):
     for p in primary:
         for s in secondary:
-            if p is not s:
+            if p != s:
                 yield p, s
 
 
-def process_lang_combination(languages: Tuple[str, str]):
-    if not languages:
-        return [], languages
+def translation_pairs(languages: Tuple[str, str]):
+    """
+    Joins pages of source language with their translations to target language. Tables are merged in the order of page
+    IDs, so memory does not grow with the size of the tables.
+    :param languages: Tuple (source language, target language)
+    :return: Generator of (original_title, translated) tuples, original title with spaces instead of underscores
+    :raises FileNotFoundError: If there are no translations between the languages
+    """
     lang_from, lang_to = languages
+    if not has_translations(languages):
+        raise FileNotFoundError(langlink_table(lang_from, lang_to))
+    return ((original.replace('_', ' '), translated)
+            for _, original, translated in merge_join(page_table(lang_from), langlink_table(lang_from, lang_to)))
+
+
+def has_translations(languages: Tuple[str, str]):
+    """Checks whether page table of source language and langlinks table of the combination exist"""
+    lang_from, lang_to = languages
+    return table_exists(langlink_table(lang_from, lang_to)) and table_exists(page_table(lang_from))
+
+
+def pairs_worker(languages: Tuple[str, str], chunks: Queue):
+    """
+    Process preparing translation pairs of one language combination for the Whoosh writer. Lists of `PAIRS_CHUNK`
+    pairs are put into `chunks`, None when all pairs are prepared, ('error', traceback) and None if preparing fails.
+    """
     try:
-        df_to = pd.read_csv(f'csv/langlinks/{lang_from}/to_{lang_to}.csv', sep='\t', header=None, index_col=0,
-                            na_filter=False)
-        df_from = pd.read_csv(f'csv/page/{lang_from}.csv', sep='\t', header=None, index_col=0)
-        df = df_from.join(df_to, how='inner', rsuffix='_to_')
-        df.columns = ['original_title', 'translated']
-        df['original_title'] = df['original_title'].apply(lambda x: str(x).replace('_', ' '))
-        df['source_lang'] = lang_from
-        df['target_lang'] = lang_to
-        return df.to_dict('records'), languages
-    except FileNotFoundError:
-        print(f'Translation not found: {languages}')
-        return [], languages
+        chunk = []
+        for pair in translation_pairs(languages):
+            chunk.append(pair)
+            if len(chunk) == PAIRS_CHUNK:
+                chunks.put(chunk)
+                chunk = []
+        if chunk:
+            chunks.put(chunk)
+    except BaseException:
+        chunks.put(('error', traceback.format_exc()))
+        raise
+    finally:
+        chunks.put(None)
+
+
+class PairsPrefetch:
+    """
+    Translation pairs of language combinations prepared by background processes while the writer adds documents of
+    the current combination. Each combination is streamed through its own bounded queue, so at most
+    `PREFETCH_CHUNKS` chunks of pairs per process wait in memory.
+    """
+
+    def __init__(self, combinations, processes):
+        """
+        :param combinations: Language combinations in the order in which they are written
+        :param processes: Number of combinations prepared at once, including the one being written
+        """
+        self._combinations = iter(combinations)
+        self._processes = max(processes, 1)
+        # (languages, process, queue) of started combinations in the order of writing
+        self._running = collections.deque()
 
+    def _start(self):
+        while len(self._running) < self._processes:
+            languages = next(self._combinations, None)
+            if languages is None:
+                return
+            chunks = Queue(maxsize=PREFETCH_CHUNKS)
+            process = Process(target=pairs_worker, args=(languages, chunks), daemon=True)
+            process.start()
+            self._running.append((languages, process, chunks))
 
-def build_one_index(primary_languages, secondary_languages):
-    i, j = 0, 0
+    def __iter__(self):
+        """Generator of (languages, generator of (original_title, translated) tuples), in the order of combinations"""
+        self._start()
+        while self._running:
+            languages, process, chunks = self._running[0]
+            yield languages, self._pairs(process, chunks)
+            self._running.popleft()
+            self._start()
+
+    @staticmethod
+    def _pairs(process, chunks):
+        while True:
+            try:
+                chunk = chunks.get(timeout=WORKER_POLL)
+            except queue.Empty:
+                # A process killed from outside (e.g. out of memory) doesn't put anything into the queue
+                if process.exitcode not in (None, 0):
+                    raise RuntimeError(f'Process preparing translation pairs exited with code {process.exitcode}')
+                continue
+            if chunk is None:
+                break
+            if isinstance(chunk, tuple):
+                raise RuntimeError(f'Preparing translation pairs failed:\n{chunk[1]}')
+            yield from chunk
+        process.join()
+
+    def close(self):
+        """Stops processes of combinations which were not written"""
+        for languages, process, chunks in self._running:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        self._running.clear()
+
+
+def read_checkpoint():
+    """Language combinations already indexed into Whoosh big index, saved by interrupted `build_one_index`"""
+    try:
+        with open(CHECKPOINT_FILE) as f:
+            return {tuple(languages) for languages in json.load(f)['done']}
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return set()
+
+
+def write_checkpoint(done):
+    with open(CHECKPOINT_FILE + '.tmp', 'w') as f:
+        json.dump({'done': sorted(done)}, f)
+    os.replace(CHECKPOINT_FILE + '.tmp', CHECKPOINT_FILE)
+
+
+@timed()
+def build_one_index(primary_languages, secondary_languages, workers=4, restart=False):
+    """
+    Indexes translations from all primary to all secondary languages into Whoosh big index. Translations of each
+    language combination are streamed from page and langlinks tables by a background process, which prepares them
+    while previous combinations are written. Each combination is added by its own writer, not by one writer for the
+    whole build - documents of a writer are saved only by its commit, so each finished combination is committed
+    (without merging segments) and saved into a checkpoint, and an interrupted build continues where it stopped.
+    Opening a writer costs little next to indexing a combination. Segments are merged once at the end.
+    :param primary_languages: Source languages
+    :param secondary_languages: Target languages
+    :param workers: Number of processes preparing language combinations (the one being written and the next ones),
+                    also the number of writer processes for large combinations
+    :param restart: Discard checkpoint and existing big index
+    """
     total_start = datetime.datetime.now()
-    index = create_in(INDEX_DIR, one_index_schema, indexname='big_index')
-    for records, langs in map(process_lang_combination, combinations(primary_languages, secondary_languages)):
-        writer = index.writer(limitmb=2048, procs=4)
-        i += 1
-        for r in tqdm(records, desc=f'{i} of {len(primary_languages) * len(secondary_languages)} - {langs}'):
-            writer.add_document(**r)
-
-        print(f'Committing writer: {langs}')
-        start = datetime.datetime.now()
-        writer.commit()
-        print(f'Writer committed ({datetime.datetime.now() - start})')
-        print(f'Time taken so far: {datetime.datetime.now() - total_start}')
-    print(i)
-
-
-def build_elastic_index(primary_languages, secondary_languages):
+    done = set() if restart else read_checkpoint()
+    if done and exists_in(INDEX_DIR, indexname=BIG_INDEX):
+        index = open_dir(INDEX_DIR, indexname=BIG_INDEX)
+        print(f'Resuming build of {BIG_INDEX}, {len(done)} combinations already indexed')
+    else:
+        done = set()
+        index = create_in(INDEX_DIR, one_index_schema, indexname=BIG_INDEX)
+        write_checkpoint(done)
+    all_combinations = list(combinations(primary_languages, secondary_languages))
+    pending = [languages for languages in all_combinations if languages not in done]
+
+    if done:
+        # A combination could have been committed just before the checkpoint was saved
+        writer = index.writer(limitmb=2048)
+        for lang_from, lang_to in pending:
+            writer.delete_by_query(And([Term('source_lang', lang_from), Term('target_lang', lang_to)]))
+        writer.commit(merge=False)
+    for languages in pending:
+        if not has_translations(languages):
+            print(f'Translation not found: {languages}')
+            done.add(languages)
+    prefetch = PairsPrefetch([languages for languages in pending if languages not in done], workers)
+    try:
+        for languages, pairs in prefetch:
+            lang_from, lang_to = languages
+            # Writer processes only pay off for large combinations, their segments are merged at the end anyway
+            if workers > 1 and table_length(langlink_table(lang_from, lang_to)) >= MIN_PARALLEL_DOCS:
+                writer = index.writer(procs=workers, limitmb=2048 // workers, multisegment=True)
+            else:
+                writer = index.writer(limitmb=2048)
+            docs = 0
+            with metrics.span('add_documents'):
+                for original_title, translated in tqdm(pairs, desc=f'{len(done) + 1} of {len(all_combinations)} - '
+                                                                   f'{languages}'):
+                    writer.add_document(original_title=original_title, translated=translated,
+                                        source_lang=lang_from, target_lang=lang_to)
+                    docs += 1
+                metrics.count('docs', docs)
+            # Only new segment is written, existing segments are merged at the end
+            with metrics.span('commit'):
+                writer.commit(merge=False)
+            done.add(languages)
+            write_checkpoint(done)
+            print(f'Time taken so far: {datetime.datetime.now() - total_start}')
+    finally:
+        prefetch.close()
+
+    print('Merging segments...')
+    start = datetime.datetime.now()
+    with metrics.span('merge'):
+        index.optimize()
+    print(f'Segments merged ({datetime.datetime.now() - start})')
+    os.remove(CHECKPOINT_FILE)
+    print(f'Indexed {len(done)} combinations in {datetime.datetime.now() - total_start}')
+
+
+@timed()
+def build_elastic_index(primary_languages, secondary_languages, workers=4, bulk_size=5000):
+    """
+    Creates Elasticsearch index and indexes translations from all primary to all secondary languages
+    :param primary_languages: Source languages
+    :param secondary_languages: Target languages
+    :param workers: Number of processes preparing documents
+    :param bulk_size: Number of documents in one bulk request
+    """
     secondary_languages.sort()
-    es = Elasticsearch(retry_on_timeout=True, timeout=120)
-    if es.indices.exists('vinf'):
-        es.indices.delete('vinf')
-    es.indices.create(index='vinf', body={
+    es = Elasticsearch(ES_HOST, request_timeout=120, retry_on_timeout=True)
+    if es.indices.exists(index=ES_INDEX):
+        es.indices.delete(index=ES_INDEX)
+    es.indices.create(index=ES_INDEX, body={
         "settings": {
             "number_of_shards": 3,
             "number_of_replicas": 0,
@@ -97,26 +284,188 @@ def build_elastic_index(primary_languages, secondary_languages):
         }
     })
 
-    def actions():
-        pool = Pool(4)
-        i = 0
-        for records, langs in pool.imap_unordered(process_lang_combination,
-                                                  combinations(primary_languages, secondary_languages)):
-            i += 1
-            for action in tqdm(map(lambda r: {"_index": "vinf", "_source": r}, records),
-                               desc=f'{i} of {len(primary_languages) * len(secondary_languages)} - {langs}'):
-                if action:
-                    yield action
+    try:
+        bulk_ingest(es, combinations(primary_languages, secondary_languages), workers, bulk_size)
+    finally:
+        es.indices.put_settings(body={"index": {"refresh_interval": None}}, index=ES_INDEX)
+
 
+def bulk_bodies(languages: Tuple[str, str], bulk_size):
+    """
+    Serializes documents of a language combination into NDJSON bodies for the Bulk API
+    :param languages: Tuple (source language, target language)
+    :param bulk_size: Number of documents in one body
+    :return: Generator of (number of documents, body) tuples
+    """
     try:
-        for success, result in parallel_bulk(client=es,
-                                             actions=actions(),
-                                             chunk_size=50000):
-            if not success:
-                print(result)
+        pairs = translation_pairs(languages)
+    except FileNotFoundError:
+        print(f'Translation not found: {languages}')
+        return
+    lang_from, lang_to = languages
+    # Language fields are the same for the whole combination, serialized once
+    suffix = json.dumps({'source_lang': lang_from, 'target_lang': lang_to})[1:]
+    # Only the titles are serialized per document, the same as json.dumps(..., ensure_ascii=False) without a dict
+    lines = []
+    for original_title, translated in pairs:
+        lines.append(f'{BULK_ACTION}\n{{"original_title": {encode_basestring(original_title)}, '
+                     f'"translated": {encode_basestring(translated)}, {suffix}\n')
+        if len(lines) == bulk_size:
+            yield len(lines), ''.join(lines).encode('utf8')
+            lines = []
+    if lines:
+        yield len(lines), ''.join(lines).encode('utf8')
+
+
+def bulk_worker(tasks: Queue, chunks: Queue, bulk_size):
+    """
+    Worker process preparing bulk bodies. Takes language combinations from `tasks` until it gets None and puts
+    serialized bodies into `chunks`. As `chunks` is bounded, the worker waits while the indexing falls behind.
+    After each combination, (languages, 0, None) is put into `chunks`, None is put when the worker is done,
+    also when it fails - ('error', traceback) is put before it then.
+    """
+    try:
+        while True:
+            languages = tasks.get()
+            if languages is None:
+                break
+            for count, body in bulk_bodies(languages, bulk_size):
+                chunks.put((languages, count, body))
+            chunks.put((languages, 0, None))
+    except BaseException:
+        chunks.put(('error', traceback.format_exc()))
+        raise
     finally:
-        es.indices.put_settings(body={"index": {"refresh_interval": None}}, index='vinf')
+        chunks.put(None)
+
+
+def send_bulk(es, body, retries=5):
+    """
+    Sends one bulk body. The whole body is sent again if the request fails and documents rejected
+    by Elasticsearch (HTTP 429 - too many requests) are sent again, with exponential backoff.
+    :return: Number of documents which failed to index
+    """
+    delay = 1
+    for attempt in range(retries + 1):
+        try:
+            response = es.bulk(body=body)
+        except (TransportError, ApiError) as e:
+            if attempt == retries:
+                raise
+            print(f'Bulk request failed ({e}), retrying in {delay} s')
+        else:
+            if not response['errors']:
+                return 0
+            lines = body.splitlines(keepends=True)
+            retry = []
+            failed = 0
+            for i, item in enumerate(response['items']):
+                result = item['index']
+                if result.get('status') == 429:
+                    retry.extend(lines[2 * i:2 * i + 2])
+                elif 'error' in result:
+                    failed += 1
+                    print(result['error'])
+            if not retry or attempt == retries:
+                return failed + len(retry) // 2
+            body = b''.join(retry)
+        time.sleep(delay)
+        delay *= 2
+
+
+@timed('bulk_ingest')
+def bulk_ingest(es, combinations, workers=4, bulk_size=5000, senders=4):
+    """
+    Indexes all language combinations into Elasticsearch. Worker processes prepare NDJSON bodies,
+    which are sent by a pool of threads.
+    :param es: Elasticsearch client
+    :param combinations: Iterable of (source language, target language) tuples
+    :param workers: Number of processes preparing bodies
+    :param bulk_size: Number of documents in one bulk request
+    :param senders: Number of concurrent bulk requests
+    """
+    combinations = list(combinations)
+    tasks = Queue()
+    for languages in combinations:
+        tasks.put(languages)
+    # Bounded queue - workers wait instead of piling serialized documents in memory
+    chunks = Queue(maxsize=2 * senders)
+    processes = [Process(target=bulk_worker, args=(tasks, chunks, bulk_size), daemon=True) for _ in range(workers)]
+    for process in processes:
+        tasks.put(None)
+        process.start()
+
+    start = datetime.datetime.now()
+    indexed, failed, done, running = 0, 0, 0, workers
+    in_flight = set()
+    try:
+        with ThreadPoolExecutor(senders) as executor, tqdm(unit=' docs', desc='Indexing') as progress:
+            def collect(block):
+                nonlocal indexed, failed
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED if block else ALL_COMPLETED)
+                for future in finished:
+                    count, failures = future.count, future.result()
+                    indexed += count - failures
+                    failed += failures
+                    progress.update(count)
+                in_flight.difference_update(finished)
+
+            while running:
+                try:
+                    chunk = chunks.get(timeout=WORKER_POLL)
+                except queue.Empty:
+                    # A worker killed from outside (e.g. out of memory) doesn't put anything into the queue
+                    dead = [process.exitcode for process in processes if process.exitcode not in (None, 0)]
+                    if dead:
+                        raise RuntimeError(f'Bulk worker exited with code {dead[0]}')
+                    continue
+                if chunk is None:
+                    running -= 1
+                    continue
+                if len(chunk) == 2:
+                    raise RuntimeError(f'Bulk worker failed:\n{chunk[1]}')
+                languages, count, body = chunk
+                if body is None:
+                    done += 1
+                    progress.set_description(f'{done} of {len(combinations)} - {languages}')
+                    continue
+                if len(in_flight) >= senders:
+                    collect(block=True)
+                future = executor.submit(send_bulk, es, body)
+                future.count = count
+                in_flight.add(future)
+            if in_flight:
+                collect(block=False)
+    finally:
+        # Workers are left waiting on the full queue if indexing failed
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+    metrics.count('docs', indexed)
+    metrics.count('failed_docs', failed)
+    elapsed = datetime.datetime.now() - start
+    print(f'Indexed {indexed} documents ({failed} failed) in {elapsed} '
+          f'({indexed / max(elapsed.total_seconds(), 1e-9):.0f} docs/s)')
 
 
 if __name__ == '__main__':
-    build_one_index(['sk'], ['fi'])
+    arg_parser = argparse.ArgumentParser(description='Build Whoosh index of translations')
+    arg_parser.add_argument('-p', '--primary', help='Source languages', nargs='+', default=['sk'])
+    arg_parser.add_argument('-s', '--secondary', help='Target languages', nargs='+', default=['fi'])
+    arg_parser.add_argument('-w', '--workers', help='Number of processes preparing language combinations in the '
+                                                    'background, also writer processes for large combinations',
+                            type=int, default=4)
+    arg_parser.add_argument('-r', '--restart', help='Discard checkpoint of interrupted build and start over',
+                            action='store_true')
+
+    arg_parser.add_argument('-t', '--time', help='Print timings of indexing stages', action='store_true')
+    metrics.add_arguments(arg_parser)
+
+    args = arg_parser.parse_args()
+    metrics.start(args)
+    try:
+        build_one_index(args.primary, args.secondary, args.workers, args.restart)
+    finally:
+        metrics.finish(args)
@@ -0,0 +1,171 @@
+"""
+Cache of query results. Bounded LRU in memory with optional expiration, optionally backed by an SQLite file
+which survives restarts. Both tiers are cleared whenever the parser is run again (`lastParse` in info.json changes).
+"""
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from whoosh.support.charset import accent_map
+
+INFO_FILE = 'info.json'
+CACHE_FILE = 'query_cache.sqlite'
+# Returned by `QueryCache.get` when the key is not cached, as None is a valid cached value
+MISSING = object()
+
+
+def normalize_term(term: str):
+    """
+    Normalizes a query term for use in cache keys - lowercases it, removes accents and collapses whitespace.
+    Both Whoosh and Elasticsearch analyzers ignore these differences, so the results are the same.
+    """
+    return ' '.join(term.lower().translate(accent_map).split())
+
+
+def parse_version():
+    """Timestamp of last parse from info.json, None if parser has not been run"""
+    try:
+        with open(INFO_FILE) as f:
+            return json.load(f).get('lastParse')
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return None
+
+
+def info_mtime():
+    """Modification time of info.json in nanoseconds, None if parser has not been run"""
+    try:
+        return os.stat(INFO_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class QueryCache:
+    """Thread-safe LRU cache with optional time to live and persistent SQLite tier"""
+
+    def __init__(self, maxsize=10000, ttl=None, path=None):
+        """
+        :param maxsize: Maximum number of entries kept in memory
+        :param ttl: Time to live of entries in seconds, entries don't expire if None
+        :param path: Path to SQLite file of the persistent tier, only memory is used if None
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.RLock()
+        self._db = None
+        self._version = None
+        self._info_mtime = None
+        if path:
+            self.open_disk(path)
+
+    def open_disk(self, path):
+        """Enables persistent tier stored in SQLite file at `path`"""
+        with self._lock:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, expires REAL, value BLOB)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+            self._db.commit()
+            self._info_mtime = None
+            self._check_version()
+
+    def _check_version(self):
+        """Clears the cache if parser has been run since the entries were cached"""
+        mtime = info_mtime()
+        if mtime == self._info_mtime:
+            # Cheap check - info.json was not touched
+            return
+        self._info_mtime = mtime
+        version = json.dumps(parse_version())
+        if self._db is not None:
+            row = self._db.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+            if row is None or row[0] != version:
+                self._db.execute('DELETE FROM cache')
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (version,))
+                self._db.commit()
+        if self._version is not None and self._version != version:
+            self._items.clear()
+        self._version = version
+
+    def _expires(self):
+        return time.time() + self.ttl if self.ttl else None
+
+    def _remember(self, key, expires, value):
+        self._items[key] = (expires, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def get(self, key):
+        """
+        Looks up a cached value, first in memory, then in persistent tier
+        :param key: Hashable key with stable `repr`
+        :return: Cached value or `MISSING`
+        """
+        with self._lock:
+            self._check_version()
+            now = time.time()
+            item = self._items.get(key)
+            if item is not None:
+                expires, value = item
+                if expires is None or expires > now:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._items[key]
+            if self._db is not None:
+                row = self._db.execute('SELECT expires, value FROM cache WHERE key = ?', (repr(key),)).fetchone()
+                if row is not None and (row[0] is None or row[0] > now):
+                    value = pickle.loads(row[1])
+                    self._remember(key, row[0], value)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return MISSING
+
+    def put(self, key, value):
+        """Stores a value in memory and in persistent tier"""
+        with self._lock:
+            self._check_version()
+            expires = self._expires()
+            self._remember(key, expires, value)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)',
+                                 (repr(key), expires, pickle.dumps(value)))
+                self._db.commit()
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns cached value or computes, caches and returns it. Exceptions raised by `compute` are not cached.
+        :param key: Hashable key with stable `repr`
+        :param compute: Function without arguments computing the value
+        """
+        value = self.get(key)
+        if value is MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM cache')
+                self._db.commit()
+
+    def stats(self):
+        """Dictionary with hit and miss counts, hit rate and number of entries in memory"""
+        total = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self._items)}
+
+
+# Shared cache of page ID lookups and translations
+query_cache = QueryCache()
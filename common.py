@@ -3,6 +3,10 @@ from whoosh.fields import *
 from whoosh.support.charset import accent_map
 
 INDEX_DIR = 'indexdir'
+STORE_DIR = 'store'
+ES_INDEX = 'vinf'
+# Elasticsearch node used by the big index
+ES_HOST = 'http://localhost:9200'
 PAGE_IDX_NAME = 'page_idx'
 MAIN_LANGS = ['cs', 'fi', 'sk']
 
@@ -17,24 +21,6 @@ one_index_schema = Schema(original_title=TEXT(stored=True, analyzer=analyzer, sp
                           translated=TEXT(stored=True))
 
 
-def measure_execution_time(enabled):
-    def execution_time(func):
-        def wrapper(*args, **kwargs):
-            start = None
-            if enabled:
-                start = datetime.datetime.now()
-            result = func(*args, **kwargs)
-            if start:
-                print(f'{func.__name__}() took {datetime.datetime.now() - start}')
-            return result
-
-        wrapper.__doc__ = func.__doc__
-        wrapper.__name__ = func.__name__
-        return wrapper
-
-    return execution_time
-
-
 def index_name(lang):
     """
     Builds index name string from language code
@@ -0,0 +1,96 @@
+import bz2
+import datetime
+import gzip
+import io
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Supported dump file extensions, in order of preference when the same dump is present in more formats
+DUMP_EXTENSIONS = ['.sql', '.sql.gz', '.sql.bz2', '.sql.zst']
+# Size of read buffers, dumps are read in large sequential chunks
+BUFFER_SIZE = 16 * 1024 * 1024
+
+
+def is_compressed(file):
+    """Checks whether the dump file is compressed, based on its extension"""
+    return not file.endswith('.sql')
+
+
+def open_dump(raw):
+    """
+    Wraps opened dump file in a decompressing stream based on its extension
+    :param raw: Dump file opened in binary mode
+    :return: Buffered binary stream of decompressed data
+    """
+    if raw.name.endswith('.gz'):
+        stream = gzip.GzipFile(fileobj=raw, mode='rb')
+    elif raw.name.endswith('.bz2'):
+        stream = bz2.BZ2File(raw, mode='rb')
+    elif raw.name.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError(f'Package zstandard is required to read {raw.name}. Install it with pip.')
+        stream = zstandard.ZstdDecompressor().stream_reader(raw, read_size=BUFFER_SIZE)
+    else:
+        return raw
+    return io.BufferedReader(stream, buffer_size=BUFFER_SIZE)
+
+
+class DumpReader:
+    """
+    Iterates over lines of a plain or compressed SQL dump, decompressing it as a stream.
+    Counts compressed (read from disk) and decompressed bytes to report throughput.
+    """
+
+    def __init__(self, file, start=0, end=None):
+        """
+        :param file: Path to the dump
+        :param start: Offset of the first line to read, only for uncompressed dumps
+        :param end: Offset after the last line to read, only for uncompressed dumps. Whole file is read if None.
+        """
+        if is_compressed(file) and (start or end is not None):
+            raise ValueError(f'Cannot read a byte range of compressed dump {file}')
+        self.file = file
+        self.start = start
+        self.end = end
+        self.compressed_bytes = 0
+        self.decompressed_bytes = 0
+        self.elapsed = datetime.timedelta()
+
+    def __iter__(self):
+        start_time = datetime.datetime.now()
+        with open(self.file, 'rb', buffering=BUFFER_SIZE) as raw:
+            raw.seek(self.start)
+            end = self.end if self.end is not None else os.path.getsize(self.file)
+            with open_dump(raw) as stream:
+                position = self.start
+                for line in stream:
+                    self.decompressed_bytes += len(line)
+                    yield line.decode('utf8', errors='ignore')
+                    if stream is raw:
+                        position += len(line)
+                        if position >= end:
+                            break
+                self.compressed_bytes = (raw.tell() if stream is not raw else position) - self.start
+        self.elapsed = datetime.datetime.now() - start_time
+
+    def report(self):
+        """Formats read statistics as a human readable string"""
+        return throughput_report(self.compressed_bytes, self.decompressed_bytes, self.elapsed)
+
+
+def throughput_report(compressed_bytes, decompressed_bytes, elapsed: datetime.timedelta):
+    """
+    Formats amount of read data and throughput as a human readable string
+    :param compressed_bytes: Bytes read from disk
+    :param decompressed_bytes: Bytes after decompression
+    :param elapsed: Time taken
+    """
+    seconds = max(elapsed.total_seconds(), 1e-9)
+    mb = 1024 * 1024
+    return (f'read {compressed_bytes / mb:.1f} MB ({compressed_bytes / mb / seconds:.1f} MB/s), '
+            f'decompressed {decompressed_bytes / mb:.1f} MB ({decompressed_bytes / mb / seconds:.1f} MB/s) '
+            f'in {elapsed}')
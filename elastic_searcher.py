@@ -1,9 +1,16 @@
 import argparse
+import threading
 
 import pandas as pd
 from elasticsearch import Elasticsearch
 
-from common import MAIN_LANGS
+from cache import query_cache, normalize_term, MISSING
+from common import MAIN_LANGS, ES_INDEX, ES_HOST
+
+# Maximum number of pooled connections to Elasticsearch
+CONNECTIONS = 25
+_client = None
+_client_lock = threading.Lock()
 
 
 def build_query(term, source, target, reverse=False):
@@ -43,34 +50,136 @@ def build_query(term, source, target, reverse=False):
     }
 
 
-def translate(term, source, target):
-    es = Elasticsearch(retry_on_timeout=True, timeout=120)
-    result_columns = [f'title_{source}', f'title_{target}']
+def get_client():
+    """
+    Elasticsearch client shared by all calls in the process. It keeps a pool of keep-alive connections,
+    so consecutive queries don't have to connect again.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = Elasticsearch(ES_HOST, connections_per_node=CONNECTIONS, request_timeout=120,
+                                    retry_on_timeout=True)
+        return _client
+
+
+def plan_queries(term, source, target):
+    """
+    Builds all queries which can find a translation of the term, in order of preference
+    :return: List of (query, result columns) tuples
+    """
     if source in MAIN_LANGS:
-        query = build_query(term, source, target)
+        # Forward query and a reverse one in case the translation exists only in the other direction
+        return [(build_query(term, source, target), [f'title_{source}', f'title_{target}']),
+                (build_query(term, source, target, reverse=True), [f'title_{target}', f'title_{source}'])]
     elif target in MAIN_LANGS:
-        query = build_query(term, source, target, reverse=True)
-        result_columns = [f'title_{target}', f'title_{source}']
-    else:
-        raise ValueError(f"Translation for {term} from {source} to {target} not found")
-
-    results = es.search(index='vinf', body=query)
-    results = list(map(lambda r: r['_source'], results['hits']['hits']))
-
-    if not results:
-        query = build_query(term, source, target, reverse=True)
-        results = es.search(index='vinf', body=query)
-        results = list(map(lambda r: r['_source'], results['hits']['hits']))
-        result_columns = [f'title_{target}', f'title_{source}']
-
-    if not results:
-        raise ValueError(f"Translation for {term} from {source} to {target} not found")
-    results = pd.DataFrame().from_records(results)
+        return [(build_query(term, source, target, reverse=True), [f'title_{target}', f'title_{source}'])]
+    raise ValueError(f"Translation for {term} from {source} to {target} not found")
+
+
+def results_frame(hits, result_columns, source, target):
+    """
+    Converts search hits into a DataFrame of translations
+    :return: pd.DataFrame with original titles and translations
+    """
+    results = pd.DataFrame().from_records([hit['_source'] for hit in hits])
     results = results.drop(columns=['source_lang', 'target_lang'])
     results.columns = result_columns
     return results.reindex(columns=[f'title_{source}', f'title_{target}'])
 
 
+def multi_search(queries):
+    """
+    Sends all queries to Elasticsearch in one _msearch request
+    :param queries: List of query bodies
+    :return: List of hit lists, in the order of queries
+    """
+    body = []
+    for query in queries:
+        body.append({'index': ES_INDEX})
+        body.append(query)
+    responses = get_client().msearch(body=body)['responses']
+    for response in responses:
+        if 'error' in response:
+            raise RuntimeError(f'Elasticsearch query failed: {response["error"]}')
+    return [response['hits']['hits'] for response in responses]
+
+
+def first_results(hit_lists, plan, term, source, target):
+    """Picks hits of the first query in the plan which found anything"""
+    for hits, (_, result_columns) in zip(hit_lists, plan):
+        if hits:
+            return results_frame(hits, result_columns, source, target)
+    raise ValueError(f"Translation for {term} from {source} to {target} not found")
+
+
+def translate(term, source, target):
+    """
+    Translates a term using Elasticsearch index. Results are cached in the query cache.
+    :param term: Title (or part of title) to translate
+    :param source: Language of input
+    :param target: Desired language
+    :return: pd.DataFrame with original titles and translations
+    """
+    key = 'elastic', source, target, normalize_term(term)
+    return query_cache.get_or_compute(key, lambda: search_translation(term, source, target)).copy()
+
+
+def search_translation(term, source, target):
+    """
+    Translates a term using Elasticsearch index. Forward and reverse queries are sent together.
+    :return: pd.DataFrame with original titles and translations
+    """
+    plan = plan_queries(term, source, target)
+    return first_results(multi_search([query for query, _ in plan]), plan, term, source, target)
+
+
+def translate_many(terms, source, target, batch_size=100):
+    """
+    Translates many terms using Elasticsearch index, queries of `batch_size` terms are sent in one _msearch request.
+    Cached terms are not sent at all.
+    :param terms: Iterable of terms
+    :param source: Language of input
+    :param target: Desired language
+    :param batch_size: Number of terms in one request
+    :return: Generator of (term, pd.DataFrame with translations or None if not found) tuples
+    """
+    batch = []
+    for term in terms:
+        batch.append(term)
+        if len(batch) == batch_size:
+            yield from _translate_batch(batch, source, target)
+            batch = []
+    if batch:
+        yield from _translate_batch(batch, source, target)
+
+
+def _translate_batch(terms, source, target):
+    results = dict()
+    plans = dict()
+    for term in terms:
+        key = 'elastic', source, target, normalize_term(term)
+        cached = query_cache.get(key)
+        if cached is not MISSING:
+            results[term] = cached
+        elif term not in plans:
+            plans[term] = plan_queries(term, source, target)
+
+    queries = [query for plan in plans.values() for query, _ in plan]
+    hit_lists = iter(multi_search(queries)) if queries else iter([])
+    for term, plan in plans.items():
+        hits = [next(hit_lists) for _ in plan]
+        try:
+            results[term] = first_results(hits, plan, term, source, target)
+            query_cache.put(('elastic', source, target, normalize_term(term)), results[term])
+        except ValueError:
+            results[term] = None
+
+    for term in terms:
+        result = results[term]
+        yield term, result.copy() if result is not None else None
+
+
 if __name__ == '__main__':
     arg_parser = argparse.ArgumentParser(description='Find a translation')
     arg_parser.add_argument('input', help='Input term to be translated')
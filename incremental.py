@@ -0,0 +1,119 @@
+"""
+Support for incremental parsing - detection of changed dumps and diffs of re-parsed tables against the previous
+version kept in binary store, which are then applied to Whoosh page indexes.
+"""
+import hashlib
+import os
+
+from store import open_table, csv_path, csv_rows, merge_groups, store_path
+
+# Size of chunks in which dumps are read when computing checksums
+CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def file_checksum(path):
+    """SHA-1 checksum of a file, read in large chunks"""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def same_stat(fingerprint, previous):
+    """Checks whether size and modification time of two fingerprints are equal"""
+    return bool(previous) and previous.get('size') == fingerprint['size'] and \
+        previous.get('mtime') == fingerprint['mtime']
+
+
+def dump_fingerprint(path, previous=None, checksum=True):
+    """
+    Computes size, modification time and checksum of a dump. If size and modification time equal `previous`
+    fingerprint, its checksum is taken over (if it has one), otherwise the dump is read only if `checksum` is set.
+    :param path: Path to the dump
+    :param previous: Fingerprint from last parse
+    :param checksum: Whether to compute checksum of a dump with different size or modification time
+    :return: Dictionary with size and mtime keys, and sha1 key if checksum is known
+    """
+    stat = os.stat(path)
+    fingerprint = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    if same_stat(fingerprint, previous):
+        if 'sha1' in previous:
+            fingerprint['sha1'] = previous['sha1']
+    elif checksum:
+        fingerprint['sha1'] = file_checksum(path)
+    return fingerprint
+
+
+def changed_dumps(tasks, previous: dict, checksum=True):
+    """
+    Filters dumps which changed since last parse. A dump with the same size and modification time is unchanged
+    without being read, otherwise checksums decide (e.g. when the same dump was downloaded again).
+    :param tasks: List of (file, lang, tablename) tuples
+    :param previous: Dictionary of fingerprints from last parse by file name
+    :param checksum: Whether to compute checksums of dumps with different size or modification time
+    :return: Tuple (list of changed tasks, dictionary of current fingerprints of all dumps by file name)
+    """
+    changed = []
+    fingerprints = dict()
+    for task in tasks:
+        name = os.path.basename(task[0])
+        fingerprint = fingerprints[name] = dump_fingerprint(task[0], previous.get(name), checksum)
+        if same_stat(fingerprint, previous.get(name)):
+            continue
+        if 'sha1' not in fingerprint or fingerprint['sha1'] != previous.get(name, {}).get('sha1'):
+            changed.append(task)
+    return changed, fingerprints
+
+
+def table_diff(name):
+    """
+    Compares re-parsed .csv table with its previous version in binary store. Both are sorted by page ID and read
+    side by side, only the differences are kept in memory.
+    :param name: Table name
+    :return: Tuple (list of deleted page IDs, list of inserted (page_id, title) tuples), page with changed title
+             is both deleted and inserted. None if there is no previous version.
+    """
+    table = open_table(name)
+    if table is None:
+        return None
+    new_rows = csv_rows(name) if os.path.exists(csv_path(name)) else ()
+    deleted, inserted = [], []
+    with table:
+        for page_id, old_titles, new_titles in merge_groups(table.rows(), new_rows, name, csv_path(name)):
+            if old_titles != new_titles:
+                if old_titles:
+                    deleted.append(page_id)
+                inserted.extend((page_id, title) for title in new_titles)
+    return deleted, inserted
+
+
+def apply_page_diff(page_index, deleted, inserted):
+    """
+    Applies diff of a page table to its Whoosh index
+    :param page_index: Whoosh page index
+    :param deleted: Page IDs to delete
+    :param inserted: (page_id, title) tuples to add
+    """
+    writer = page_index.writer(limitmb=1024)
+    # One searcher for all deletions, otherwise each of them opens its own
+    with writer.searcher() as searcher:
+        for page_id in deleted:
+            writer.delete_by_term('id', page_id, searcher=searcher)
+    for page_id, title in inserted:
+        writer.add_document(id=page_id, title=title.replace('_', ' '))
+    writer.commit()
+
+    # Deleted pages must be gone from the index, unless they were inserted again with a new title
+    inserted_ids = {page_id for page_id, _ in inserted}
+    with page_index.searcher() as searcher:
+        remaining = [page_id for page_id in deleted
+                     if page_id not in inserted_ids and searcher.document_number(id=page_id) is not None]
+    if remaining:
+        raise RuntimeError(f'{len(remaining)} deleted pages are still in index {page_index.indexname}, '
+                           f'e.g. {remaining[:5]}')
+
+
+def stale_tables(names):
+    """Tables which are still in binary store, but their .csv file is gone (target language was removed)"""
+    return [name for name in names if os.path.exists(store_path(name)) and not os.path.exists(csv_path(name))]
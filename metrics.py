@@ -0,0 +1,205 @@
+"""
+Instrumentation of parser, searcher, index builders and statistics. Spans measure time of nested stages
+(e.g. parse/page, page_index/commit), counters count rows and bytes processed within a span, so that their rate
+can be computed. Results can be printed, or exported as JSON or in Prometheus text format. cProfile can be enabled
+for the whole run.
+
+Everything is disabled by default - a disabled span or counter costs a single attribute check.
+"""
+import cProfile
+import functools
+import json
+import threading
+import time
+
+
+class _NullSpan:
+    """Span used when metrics are disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('metrics', 'name', 'path', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        stack = self.metrics._stack()
+        self.path = f'{stack[-1]}/{self.name}' if stack else self.name
+        stack.append(self.path)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        elapsed = time.perf_counter_ns() - self.start
+        self.metrics._stack().pop()
+        self.metrics._record(self.path, elapsed)
+
+
+class Metrics:
+    """Collected spans and counters"""
+
+    def __init__(self):
+        self.enabled = False
+        # Span path -> [calls, total ns, min ns, max ns]
+        self.spans = dict()
+        # (span path, counter name) -> value
+        self.counters = dict()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profiler = None
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def _record(self, path, elapsed):
+        with self._lock:
+            span = self.spans.get(path)
+            if span is None:
+                self.spans[path] = [1, elapsed, elapsed, elapsed]
+            else:
+                span[0] += 1
+                span[1] += elapsed
+                span[2] = min(span[2], elapsed)
+                span[3] = max(span[3], elapsed)
+
+    def record(self, path, elapsed):
+        """Records a span measured outside of `span`, e.g. before metrics were enabled"""
+        if self.enabled:
+            self._record(path, elapsed)
+
+    def span(self, name):
+        """
+        Context manager measuring a stage. Spans opened inside it (in the same thread) are its children.
+        :param name: Name of the stage, its path is joined with names of enclosing spans by /
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def count(self, name, value=1):
+        """Adds `value` to a counter of the current span"""
+        if not self.enabled:
+            return
+        stack = self._stack()
+        key = (stack[-1] if stack else '', name)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def start_profile(self):
+        """Starts cProfile for the whole process"""
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+
+    def stop_profile(self, path):
+        """Stops cProfile and saves statistics to `path` (readable by pstats or snakeviz)"""
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(path)
+            self._profiler = None
+
+    def to_dict(self):
+        """Spans and counters as JSON serializable dictionary, counters with rate per second of their span"""
+        spans = {path: {'calls': calls, 'seconds': total / 1e9, 'min_ms': low / 1e6, 'max_ms': high / 1e6}
+                 for path, (calls, total, low, high) in sorted(self.spans.items())}
+        counters = dict()
+        for (path, name), value in sorted(self.counters.items()):
+            seconds = spans[path]['seconds'] if path in spans else 0
+            counters.setdefault(path, dict())[name] = {'value': value,
+                                                       'per_second': value / seconds if seconds else None}
+        return {'spans': spans, 'counters': counters}
+
+    def to_prometheus(self, prefix='vinf'):
+        """Spans and counters in Prometheus text exposition format"""
+        lines = [f'# TYPE {prefix}_span_seconds_total counter',
+                 *(f'{prefix}_span_seconds_total{{span="{path}"}} {total / 1e9}'
+                   for path, (calls, total, low, high) in sorted(self.spans.items())),
+                 f'# TYPE {prefix}_span_calls_total counter',
+                 *(f'{prefix}_span_calls_total{{span="{path}"}} {calls}'
+                   for path, (calls, total, low, high) in sorted(self.spans.items())),
+                 f'# TYPE {prefix}_items_total counter',
+                 *(f'{prefix}_items_total{{span="{path}",name="{name}"}} {value}'
+                   for (path, name), value in sorted(self.counters.items()))]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Exports metrics to a file, in Prometheus format if it ends with .prom, as JSON otherwise"""
+        with open(path, 'w', encoding='utf8') as f:
+            if path.endswith('.prom'):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), f, indent=2)
+
+    def report(self):
+        """Human readable summary - spans as a tree with their counters"""
+        data = self.to_dict()
+        lines = []
+        for path, span in data['spans'].items():
+            indent = '  ' * path.count('/')
+            name = path.rsplit('/', 1)[-1]
+            calls = f' ({span["calls"]} calls)' if span['calls'] > 1 else ''
+            lines.append(f'{indent}{name} took {span["seconds"]:.3f} s{calls}')
+            for counter, value in data['counters'].get(path, dict()).items():
+                rate = f', {value["per_second"]:.0f}/s' if value['per_second'] else ''
+                lines.append(f'{indent}  {counter}: {value["value"]}{rate}')
+        return '\n'.join(lines)
+
+
+# Metrics of the running process
+metrics = Metrics()
+# Shortcuts, so that modules can use `metrics.span(...)` after `import metrics`
+span = metrics.span
+count = metrics.count
+record = metrics.record
+
+
+def timed(name=None):
+    """Decorator measuring every call of a function as a span, named by the function by default"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+            with metrics.span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_arguments(arg_parser):
+    """Adds --metrics and --profile command line arguments, -t/--time is expected to be added by the script"""
+    arg_parser.add_argument('--metrics', help='Save timings and counters to a file, .json or .prom (Prometheus)')
+    arg_parser.add_argument('--profile', help='Profile the run with cProfile and save statistics to a file')
+
+
+def start(args):
+    """Enables metrics and profiling according to command line arguments"""
+    metrics.enabled = bool(args.time or args.metrics)
+    if args.profile:
+        metrics.start_profile()
+
+
+def finish(args):
+    """Prints and saves metrics and profile according to command line arguments"""
+    if args.profile:
+        metrics.stop_profile(args.profile)
+    if args.time:
+        print(metrics.report())
+    if args.metrics:
+        metrics.write(args.metrics)
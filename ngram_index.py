@@ -0,0 +1,350 @@
+"""
+Trigram index of normalized page titles for prefix (autocomplete) and approximate (edit distance) title lookups.
+
+Titles are normalized as in `title_index`. Each distinct normalized title is stored once, in sorted order, so titles
+with a given prefix are a contiguous range found by binary search. Every title is also split into trigrams (padded
+at both ends) and the index keeps a sorted posting list of titles for every trigram. A title within edit distance k
+of the input contains all but at most 3k of distinct input trigrams, so candidates are taken only from posting lists
+of the 3k + 1 rarest input trigrams, filtered by length and number of shared trigrams and verified by computing
+the edit distance.
+
+The index of a language is a memory-mappable file `store/ngram/{lang}.idx` with layout:
+    magic (8 bytes) | counts (int64[5] - titles u, pages p, trigrams t, postings m, blob size) |
+    title offsets (int64[u + 1]) | title lengths (int32[u]) | page starts (int64[u + 1]) | page IDs (int32[p]) |
+    trigrams (int64[t], sorted) | posting starts (int64[t + 1]) | postings (int32[m]) | UTF-8 titles blob
+Every array starts at a multiple of 8 bytes.
+"""
+import mmap
+import os
+
+import numpy as np
+from whoosh.analysis import StandardAnalyzer, CharsetFilter
+from whoosh.support.charset import accent_map
+
+from common import STORE_DIR
+from store import cached_table, open_table, page_table
+from title_index import normalize_title
+
+MAGIC = b'VINFNGR1'
+HEADER_SIZE = 48
+# Padding of titles before splitting into trigrams, not a character of any normalized title
+PAD = '\x00'
+# Default maximal edit distance of approximate lookups
+MAX_DISTANCE = 2
+# Default number of returned titles
+DEFAULT_LIMIT = 10
+# Edit distance is computed for at most this many candidates (those sharing most trigrams), which bounds latency
+MAX_VERIFIED = 64
+# Analyzer of the last, possibly incomplete, word of a prefix - it must not be dropped as a stop word
+_word_analyzer = StandardAnalyzer(stoplist=None, minsize=1) | CharsetFilter(accent_map)
+
+
+def ngram_index_path(lang):
+    """Path to the n-gram index of a language"""
+    return f'{STORE_DIR}/ngram/{lang}.idx'
+
+
+def trigram_key(a, b, c):
+    """Trigram encoded into one integer, code points have at most 21 bits"""
+    return (a << 42) | (b << 21) | c
+
+
+def trigrams(normalized):
+    """Sorted array of distinct trigrams of a normalized title"""
+    codes = [ord(char) for char in PAD + PAD + normalized + PAD]
+    return np.array(sorted({trigram_key(*codes[i:i + 3]) for i in range(len(codes) - 2)}), dtype=np.int64)
+
+
+def normalize_prefix(prefix):
+    """Normalizes a prefix like a title, except that the last word is kept even if it is a stop word"""
+    head, _, last = prefix.replace('_', ' ').rstrip().rpartition(' ')
+    words = [normalize_title(head), ' '.join(token.text for token in _word_analyzer(last))]
+    return ' '.join(word for word in words if word)
+
+
+def edit_distance(a, b, limit):
+    """
+    Levenshtein distance of two strings, computed only in a band around the diagonal
+    :param limit: Maximal distance of interest
+    :return: Distance, or `limit + 1` if it is larger than `limit`
+    """
+    too_far = limit + 1
+    if abs(len(a) - len(b)) > limit:
+        return too_far
+    width = len(b) + 1
+    previous = [j if j <= limit else too_far for j in range(width)]
+    for i, char in enumerate(a, 1):
+        current = [too_far] * width
+        current[0] = row_min = i if i <= limit else too_far
+        left = current[0]
+        for j in range(max(1, i - limit), min(width - 1, i + limit) + 1):
+            # Minimum of substitution (or match), deletion and insertion
+            value = previous[j - 1] if char == b[j - 1] else previous[j - 1] + 1
+            if previous[j] < value:
+                value = previous[j] + 1 if previous[j] + 1 < value else value
+            if left + 1 < value:
+                value = left + 1
+            if value > too_far:
+                value = too_far
+            current[j] = left = value
+            if value < row_min:
+                row_min = value
+        if row_min > limit:
+            return too_far
+        previous = current
+    return previous[-1]
+
+
+def _aligned(array):
+    """Bytes of an array padded to a multiple of 8 bytes"""
+    data = array.tobytes()
+    return data + b'\0' * (-len(data) % 8)
+
+
+def build_ngram_index(lang):
+    """
+    Builds n-gram index of a language from its page table in binary store
+    :param lang: Language code
+    :return: Number of indexed distinct normalized titles
+    """
+    table = open_table(page_table(lang))
+    if table is None:
+        raise FileNotFoundError(f'Page table {lang} is not in binary store')
+    pages = dict()
+    with table:
+        for page_id, title in zip(table.ids.tolist(), table.titles()):
+            normalized = normalize_title(title)
+            # Titles consisting only of stop words can't be looked up
+            if normalized:
+                pages.setdefault(normalized, []).append(page_id)
+    titles = sorted(pages)
+    page_counts = np.array([len(pages[title]) for title in titles], dtype=np.int64)
+    page_ids = np.array([page_id for title in titles for page_id in pages[title]], dtype=np.int32)
+    lengths = np.array([len(title) for title in titles], dtype=np.int32)
+    blob = ''.join(title + '\n' for title in titles).encode('utf8')
+    offsets = np.zeros(len(titles) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(title.encode('utf8')) + 1 for title in titles])
+
+    # Trigrams of all titles at once - padded titles are concatenated and a trigram starts at every position
+    # except the last two of each title
+    codes = np.frombuffer(''.join(PAD + PAD + title + PAD for title in titles).encode('utf-32-le'),
+                          dtype=np.uint32).astype(np.int64)
+    keys = trigram_key(codes[:-2], codes[1:-1], codes[2:])
+    counts = lengths.astype(np.int64) + 1
+    title_starts = np.cumsum(counts + 2) - counts - 2
+    # Offset of each trigram within its title
+    offsets_in_title = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    keys = keys[np.repeat(title_starts, counts) + offsets_in_title]
+    ordinals = np.repeat(np.arange(len(titles), dtype=np.int32), counts)
+    # Posting lists sorted by title, each title at most once per trigram
+    order = np.lexsort((ordinals, keys))
+    keys, ordinals = keys[order], ordinals[order]
+    distinct = np.ones(len(keys), dtype=bool)
+    distinct[1:] = (keys[1:] != keys[:-1]) | (ordinals[1:] != ordinals[:-1])
+    keys, ordinals = keys[distinct], ordinals[distinct]
+    trigram_keys, posting_starts = np.unique(keys, return_index=True)
+    posting_starts = np.append(posting_starts, len(keys)).astype(np.int64)
+
+    path = ngram_index_path(lang)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.array([len(titles), len(page_ids), len(trigram_keys), len(ordinals), len(blob)],
+                         dtype=np.int64).tobytes())
+        for array in (offsets, lengths, np.append(0, np.cumsum(page_counts)), page_ids, trigram_keys, posting_starts,
+                      ordinals):
+            f.write(_aligned(array))
+        f.write(blob)
+    os.replace(path + '.tmp', path)
+    # Index opened in this process is outdated
+    _ngram_indexes.pop(lang, None)
+    return len(titles)
+
+
+class NgramIndex:
+    """Memory-mapped n-gram index of one language"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not an n-gram index file')
+        titles, pages, keys, postings, blob_size = np.frombuffer(self._mmap, dtype=np.int64, count=5,
+                                                                 offset=len(MAGIC)).tolist()
+        self._position = HEADER_SIZE
+        self.offsets = self._array(np.int64, titles + 1)
+        self.lengths = self._array(np.int32, titles)
+        self.page_starts = self._array(np.int64, titles + 1)
+        self.page_ids = self._array(np.int32, pages)
+        self.trigrams = self._array(np.int64, keys)
+        self.posting_starts = self._array(np.int64, keys + 1)
+        self.postings = self._array(np.int32, postings)
+        self._blob_start = self._position
+
+    def _array(self, dtype, count):
+        array = np.frombuffer(self._mmap, dtype=dtype, count=count, offset=self._position)
+        self._position += array.nbytes + (-array.nbytes % 8)
+        return array
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def title(self, i):
+        """Normalized title with ordinal i"""
+        start = self._blob_start + int(self.offsets[i])
+        end = self._blob_start + int(self.offsets[i + 1]) - 1
+        return self._mmap[start:end].decode('utf8')
+
+    def pages(self, i):
+        """Page IDs of normalized title with ordinal i"""
+        return self.page_ids[self.page_starts[i]:self.page_starts[i + 1]].tolist()
+
+    def prefix(self, normalized, limit=DEFAULT_LIMIT):
+        """Ordinals of (at most `limit`) titles starting with normalized prefix, in alphabetical order"""
+        # Binary search of the first title not smaller than the prefix
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self.title(middle) < normalized:
+                low = middle + 1
+            else:
+                high = middle
+        found = []
+        for i in range(low, min(low + limit, len(self))):
+            if not self.title(i).startswith(normalized):
+                break
+            found.append(i)
+        return found
+
+    def _posting(self, row):
+        return self.postings[self.posting_starts[row]:self.posting_starts[row + 1]]
+
+    def fuzzy(self, normalized, max_distance=MAX_DISTANCE, limit=DEFAULT_LIMIT):
+        """
+        Titles within edit distance from normalized title
+        :return: List of (distance, ordinal) tuples, closest first, at most `limit` of them
+        """
+        if not len(self.trigrams):
+            return []
+        query = trigrams(normalized)
+        rows = np.minimum(np.searchsorted(self.trigrams, query), len(self.trigrams) - 1)
+        present = self.trigrams[rows] == query
+        sizes = np.where(present, self.posting_starts[rows + 1] - self.posting_starts[rows], 0)
+        # Distinct trigrams a title within the distance has to share
+        needed = len(query) - 3 * max_distance
+        if needed > 0:
+            # Such title is in at least one of posting lists of the rarest trigrams (missing trigrams are the rarest)
+            rarest = np.argsort(sizes, kind='stable')[:len(query) - needed + 1]
+            rare = [self._posting(row) for row in rows[rarest][present[rarest]]]
+            if not rare:
+                return []
+            candidates = np.unique(np.concatenate(rare))
+        else:
+            # Very short input doesn't have to share any trigram, all titles of similar length are candidates
+            candidates = np.arange(len(self), dtype=np.int32)
+        candidates = candidates[np.abs(self.lengths[candidates] - len(normalized)) <= max_distance]
+        if needed > 0:
+            shared = np.zeros(len(candidates), dtype=np.int64)
+            for row in rows[present]:
+                posting = self._posting(row)
+                positions = np.minimum(np.searchsorted(posting, candidates), len(posting) - 1)
+                shared += posting[positions] == candidates
+        else:
+            # Short input has only a few trigrams, counting over all titles is faster than searching candidates
+            counts = np.zeros(len(self), dtype=np.int16)
+            for row in rows[present]:
+                counts[self._posting(row)] += 1
+            shared = counts[candidates]
+        # Closer titles are looked for first, with stricter filters, so that the verification limit is not spent
+        # on distant titles when a close one exists
+        verified = np.zeros(len(candidates), dtype=bool)
+        budget = MAX_VERIFIED
+        found = []
+        for distance in range(max_distance + 1):
+            level = ((shared >= len(query) - 3 * distance) & ~verified &
+                     (np.abs(self.lengths[candidates] - len(normalized)) <= distance))
+            # Candidates sharing most trigrams are verified first
+            order = np.flatnonzero(level)[np.argsort(-shared[level], kind='stable')][:budget]
+            verified[order] = True
+            budget -= len(order)
+            for i in candidates[order].tolist():
+                title_distance = edit_distance(normalized, self.title(i), max_distance)
+                if title_distance <= max_distance:
+                    found.append((title_distance, i))
+            if len(found) >= limit or not budget:
+                break
+        found.sort()
+        return found[:limit]
+
+
+# N-gram indexes opened by lookups, kept open for the lifetime of the process
+_ngram_indexes = dict()
+
+
+def has_ngram_index(lang):
+    """Checks whether n-gram index of a language is built"""
+    return lang in _ngram_indexes or os.path.exists(ngram_index_path(lang))
+
+
+def _pages(index, ordinals, lang):
+    """Pages of title ordinals as (page_id, page_title) tuples"""
+    table = cached_table(page_table(lang))
+    pages = []
+    for i in ordinals:
+        page_ids = index.pages(i)
+        for page_id, row in zip(page_ids, table.find(page_ids)):
+            if row >= 0:
+                pages.append((page_id, table.title(row).replace('_', ' ')))
+    return pages
+
+
+def _open(lang):
+    """Opens n-gram index of a language, None if it (or page table) is not built"""
+    index = _ngram_indexes.get(lang)
+    if index is None:
+        if not os.path.exists(ngram_index_path(lang)):
+            return None
+        index = _ngram_indexes[lang] = NgramIndex(ngram_index_path(lang))
+    return index if cached_table(page_table(lang)) is not None else None
+
+
+def drop_cached_indexes():
+    """Forgets n-gram indexes opened by lookups, so that indexes rebuilt since then are opened again"""
+    _ngram_indexes.clear()
+
+
+def prefix_pages(prefix, lang, limit=DEFAULT_LIMIT):
+    """
+    Finds pages whose normalized title starts with normalized input, for autocomplete
+    :param prefix: Beginning of a title, the last word can be incomplete
+    :param lang: Language code
+    :param limit: Maximal number of distinct normalized titles
+    :return: List of (page_id, page_title) tuples, empty if no title matches. None if the n-gram index or page
+             table is not built.
+    """
+    index = _open(lang)
+    if index is None:
+        return None
+    normalized = normalize_prefix(prefix)
+    if not normalized:
+        return []
+    return _pages(index, index.prefix(normalized, limit), lang)
+
+
+def fuzzy_pages(title, lang, max_distance=MAX_DISTANCE, limit=DEFAULT_LIMIT):
+    """
+    Finds pages whose normalized title is within edit distance from normalized input, closest first
+    :param title: Page title, possibly misspelled
+    :param lang: Language code
+    :param max_distance: Maximal edit distance (insertions, deletions and substitutions of characters)
+    :param limit: Maximal number of distinct normalized titles
+    :return: List of (page_id, page_title) tuples, empty if no title is close enough. None if the n-gram index or
+             page table is not built.
+    """
+    index = _open(lang)
+    if index is None:
+        return None
+    normalized = normalize_title(title)
+    if not normalized:
+        return []
+    return _pages(index, [i for _, i in index.fuzzy(normalized, max_distance, limit)], lang)
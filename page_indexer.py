@@ -0,0 +1,119 @@
+"""
+Builds Whoosh page indexes of main languages from page tables written by parser. Runs as a separate stage after
+parsing - documents are added by several writer processes, each producing its own segments, which are merged
+into one segment at the end.
+"""
+import argparse
+import datetime
+import os
+
+from whoosh.index import create_in
+
+import metrics
+from common import INDEX_DIR, MAIN_LANGS, page_schema, index_name
+from metrics import timed
+from term_stats import compute_term_stats
+from store import open_table, page_table, csv_path, table_exists, table_length
+
+# Below this number of pages, starting writer processes and merging their segments takes longer than indexing
+MIN_PARALLEL_DOCS = 100000
+
+
+def page_documents(lang):
+    """
+    Reads pages of a language from binary store, or from .csv file if the store was not built
+    :param lang: Language code
+    :return: Generator of (page_id, title) tuples
+    """
+    table = open_table(page_table(lang))
+    if table is not None:
+        with table:
+            yield from zip(table.ids.tolist(), table.titles())
+        return
+    with open(csv_path(page_table(lang)), encoding='utf8') as f:
+        for line in f:
+            page_id, page_title = line.rstrip('\n').split('\t', 1)
+            yield int(page_id), page_title
+
+
+def build_page_index(lang, procs=1, limitmb=1024):
+    """
+    Builds (or rebuilds) Whoosh page index of a language
+    :param lang: Language code
+    :param procs: Number of writer processes, each of them writes its own segment
+    :param limitmb: Memory limit of each writer process in MB
+    :return: Dictionary with number of documents, indexing and merge times and indexing speed
+    """
+    idx = create_in(INDEX_DIR, page_schema, indexname=index_name(lang))
+    if table_length(page_table(lang)) < MIN_PARALLEL_DOCS:
+        procs = 1
+    start = datetime.datetime.now()
+    if procs > 1:
+        # Segments of writer processes are only added to the index, they are merged below
+        writer = idx.writer(procs=procs, limitmb=limitmb, multisegment=True)
+    else:
+        writer = idx.writer(limitmb=limitmb)
+    docs = 0
+    with metrics.span('add_documents'):
+        for page_id, page_title in page_documents(lang):
+            writer.add_document(id=page_id, title=page_title.replace('_', ' '))
+            docs += 1
+        metrics.count('docs', docs)
+    with metrics.span('commit'):
+        writer.commit()
+    index_time = (datetime.datetime.now() - start).total_seconds()
+
+    start = datetime.datetime.now()
+    if procs > 1:
+        with metrics.span('merge'):
+            idx.optimize()
+    merge_time = (datetime.datetime.now() - start).total_seconds()
+    return {'docs': docs,
+            'index_seconds': index_time,
+            'merge_seconds': merge_time,
+            'docs_per_second': docs / max(index_time, 1e-9)}
+
+
+@timed('page_index')
+def build_page_indexes(languages, procs=1, limitmb=1024):
+    """
+    Builds page indexes of given languages one after another, each with `procs` writer processes
+    :param languages: Language codes
+    :param procs: Number of writer processes per language
+    :param limitmb: Memory limit of each writer process in MB
+    :return: Dictionary of statistics by language, see `build_page_index`
+    """
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    stats = dict()
+    for lang in languages:
+        if not table_exists(page_table(lang)):
+            print(f'Pages {lang} have not been parsed, skipping')
+            continue
+        print(f'Indexing pages {lang} with {procs} processes...')
+        with metrics.span(lang):
+            stats[lang] = build_page_index(lang, procs, limitmb)
+            print(f'Indexed {stats[lang]["docs"]} pages {lang} in {stats[lang]["index_seconds"]:.1f} s '
+                  f'({stats[lang]["docs_per_second"]:.0f} docs/s), merge took {stats[lang]["merge_seconds"]:.1f} s')
+            # Term statistics for stats.py are computed right away, while the index is in page cache
+            with metrics.span('term_stats'):
+                compute_term_stats(lang)
+    return stats
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Build Whoosh page indexes from parsed page tables')
+    arg_parser.add_argument('-l', '--languages', help='Languages to index', nargs='+', default=MAIN_LANGS,
+                            choices=MAIN_LANGS)
+    arg_parser.add_argument('-j', '--jobs', help='Number of writer processes per language', type=int,
+                            default=os.cpu_count())
+    arg_parser.add_argument('--limitmb', help='Memory limit of each writer process in MB', type=int, default=1024)
+
+    arg_parser.add_argument('-t', '--time', help='Print timings of indexing stages', action='store_true')
+    metrics.add_arguments(arg_parser)
+
+    args = arg_parser.parse_args()
+    metrics.start(args)
+    try:
+        build_page_indexes(args.languages, args.jobs, args.limitmb)
+    finally:
+        metrics.finish(args)
@@ -2,13 +2,30 @@ import argparse
 import glob
 import json
 import os
+import shutil
+import sys
+from array import array
+from collections import defaultdict
+from multiprocessing import Pool
+from typing import NamedTuple
 
 from parse import compile
 from whoosh.fields import *
-from whoosh.index import create_in
+from whoosh.index import exists_in, open_dir
 
+import metrics
 from build_one_index import build_elastic_index
-from common import INDEX_DIR, page_schema, MAIN_LANGS, index_name
+from common import INDEX_DIR, STORE_DIR, MAIN_LANGS, index_name
+from page_indexer import build_page_indexes
+from title_index import build_title_index
+from ngram_index import build_ngram_index
+from translation_graph import build_translation_graph, RAM_BUDGET
+from incremental import changed_dumps, table_diff, apply_page_diff, stale_tables
+from dump_reader import DUMP_EXTENSIONS, DumpReader, is_compressed, throughput_report
+from metrics import timed
+from sql_tokenizer import iter_batches
+from store import convert_csv, page_table, langlink_table, store_path, update_manifest
+from table_writer import TableWriters, CHECK_ROWS, TMP_SUFFIX
 
 
 def close_files(d: dict):
@@ -39,134 +56,467 @@ def get_filenames(path='', extension='.mp3'):
     return result
 
 
-def main(args, start_time):
-    if args.time:
-        start_time = datetime.datetime.now()
-    path = 'wikipedia_dumps\\'
+def get_dump_filenames(path):
+    """
+    Retrieves paths to all SQL dumps in the directory, plain or compressed. If the same dump is present
+    in more formats, only the first one from `DUMP_EXTENSIONS` is used.
+    :returns: A list of strings representing the file paths
+    """
+    result = dict()
+    for extension in DUMP_EXTENSIONS:
+        for filename in get_filenames(path, extension):
+            result.setdefault(filename[:-len(extension)], filename)
+    return sorted(result.values())
 
-    big_index = args.one_index
 
-    # Prepare parsers for SQL files
-    filename_parser = compile(path + '{lang}wiki-latest-{tablename}.sql')
-    page_parser = compile("({page_id:d},{namespace:d},'{page_title}',{rest})")
-    langlink_parser = compile("({page_id:d},{target_lang},'{target_title}')")
+# Positions of parsed values in inserted tuples - (page_id, namespace, page_title, ...) of page table
+# and (page_id, target_lang, target_title) of langlinks table
+PAGE_COLUMNS = (0, 2)
+LANGLINK_COLUMNS = (0, 1, 2)
+# Page IDs are kept in 64-bit integer arrays - 8 bytes per row instead of an int object and a list slot
+ID_COLUMNS = (0,)
 
-    # List all SQL files
-    files = get_filenames(path, '.sql')
-    os.makedirs(INDEX_DIR, exist_ok=True)
 
-    idx_page = dict()
-    page_writers = dict()
-    if not args.langlinks_only:
-        # Check if index has been built, so that we would not accidentally rewrite it
-        if os.path.exists(INDEX_DIR):
-            input('Index directory already exists. If you want to continue and discard existing index, press Enter.')
+class PageBatch(NamedTuple):
+    """Parsed page rows of one INSERT statement, by column"""
+    page_ids: array
+    titles: list
 
-        if not big_index:
-            for lang in MAIN_LANGS:
-                # Create index and index writer for each language
-                idx_page[lang] = create_in(INDEX_DIR, page_schema, indexname=index_name(lang))
-                page_writers[lang] = idx_page[lang].writer(limitmb=1024)
-    page_files = dict()
-    langlink_files = dict()
+
+class LanglinkBatch(NamedTuple):
+    """Parsed langlink rows of one INSERT statement, by column"""
+    page_ids: array
+    languages: list
+    titles: list
+
+
+def parse_batches(lines, tablename):
+    """
+    Parses lines of a dump into batches of rows, one batch per INSERT statement
+    :param lines: Iterable of SQL lines
+    :param tablename: page or langlinks
+    :return: Generator of `PageBatch` or `LanglinkBatch`
+    """
+    if tablename == 'page':
+        return iter_batches(lines, PAGE_COLUMNS, PageBatch, ID_COLUMNS)
+    return iter_batches(lines, LANGLINK_COLUMNS, LanglinkBatch, ID_COLUMNS)
+
+
+def write_pages(batches, target_file):
+    """
+    Writes parsed page rows into page .csv file
+    :param batches: Iterable of `PageBatch`
+    :param target_file: Opened page .csv file
+    """
+    for batch in batches:
+        # Page ID and title (tab-separated), the whole batch in one write
+        target_file.write(''.join([f'{page_id}\t{page_title}\n'
+                                   for page_id, page_title in zip(batch.page_ids, batch.titles)]))
+
+
+def write_langlinks(batches, directory, languages: set):
+    """
+    Writes parsed langlink rows into a separate .csv file for each target language
+    :param batches: Iterable of `LanglinkBatch`
+    :param directory: Directory for the `to_{target_lang}.csv` files
+    :param languages: Set of target languages, encountered languages are added into it
+    """
+    # Files appear under their names only when all rows are written
+    with TableWriters(directory) as writers:
+        # Write methods of buffers by target language
+        buffers = dict()
+        unchecked = 0
+        for batch in batches:
+            # Rows of the batch grouped by target language, each group goes into its buffer in one write
+            groups = defaultdict(list)
+            for page_id, target_lang, target_title in zip(batch.page_ids, batch.languages, batch.titles):
+                groups[target_lang].append(f'{page_id}\t{target_title}\n')
+            for target_lang, group in groups.items():
+                write = buffers.get(target_lang)
+                if write is None:
+                    write = buffers[target_lang] = writers.buffer(target_lang).write
+                write(''.join(group))
+            unchecked += len(batch.page_ids)
+            if unchecked >= CHECK_ROWS:
+                writers.check()
+                unchecked = 0
+    languages.update(writers.keys())
+    metrics.count('writes', writers.writes)
+
+
+def write_page_csv(batches, path):
+    """
+    Writes parsed page rows into page .csv file under temporary name, renamed when all rows are written
+    :param batches: Iterable of `PageBatch`
+    :param path: Path to the .csv file
+    """
+    try:
+        with open(path + TMP_SUFFIX, 'w', encoding='utf8', buffering=1024 * 1024) as target_file:
+            write_pages(batches, target_file)
+    except BaseException:
+        os.remove(path + TMP_SUFFIX)
+        raise
+    os.replace(path + TMP_SUFFIX, path)
+
+
+def split_file(file, chunk_size):
+    """
+    Splits a file into byte ranges of roughly `chunk_size` bytes. Every range starts at the beginning of a line,
+    so no INSERT statement is split between two ranges.
+    :param file: Path to the file
+    :param chunk_size: Desired size of a range in bytes
+    :return: List of (start, end) tuples. Compressed files can't be split - (0, None) is the only range.
+    """
+    if is_compressed(file):
+        return [(0, None)]
+    size = os.path.getsize(file)
+    boundaries = [0]
+    with open(file, 'rb') as f:
+        position = chunk_size
+        while position < size:
+            f.seek(position)
+            # Move to the start of next line
+            f.readline()
+            position = f.tell()
+            if position >= size:
+                break
+            boundaries.append(position)
+            position += chunk_size
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def shard_dir(lang, tablename, shard):
+    """Builds path of the directory for output of a single parsed shard"""
+    return f'csv/shards/{lang}_{tablename}_{shard:05d}'
+
+
+def parse_shard(task):
+    """
+    Parses a byte range of a dump into shard output files. Used as a worker in parallel parse.
+    :param task: Tuple (file, lang, tablename, shard number, start, end)
+    :return: Tuple (lang, tablename, shard number, set of target languages, DumpReader with read statistics)
+    """
+    file, lang, tablename, shard, start, end = task
+    directory = shard_dir(lang, tablename, shard)
+    os.makedirs(directory, exist_ok=True)
     languages = set()
+    lines = DumpReader(file, start, end)
+    if tablename == 'page':
+        write_page_csv(parse_batches(lines, tablename), f'{directory}/{lang}.csv')
+    else:
+        write_langlinks(parse_batches(lines, tablename), directory, languages)
+    return lang, tablename, shard, languages, lines
 
-    for file in files:
+
+@timed('merge')
+def merge_shards(lang, tablename, shards):
+    """
+    Concatenates shard outputs in shard order into the final .csv files and removes the shards
+    :param lang: Language of the parsed dump
+    :param tablename: Parsed table
+    :param shards: Number of shards of the dump
+    """
+    target_files = dict()
+    try:
+        for shard in range(shards):
+            directory = shard_dir(lang, tablename, shard)
+            for name in sorted(os.listdir(directory)):
+                target_file = target_files.get(name)
+                if not target_file:
+                    target_dir = f'csv/{tablename}' if tablename == 'page' else f'csv/{tablename}/{lang}'
+                    os.makedirs(target_dir, exist_ok=True)
+                    target_file = target_files[name] = open(f'{target_dir}/{name}{TMP_SUFFIX}', 'wb')
+                with open(f'{directory}/{name}', 'rb') as shard_file:
+                    shutil.copyfileobj(shard_file, target_file, 1024 * 1024)
+            shutil.rmtree(directory)
+    finally:
+        close_files(target_files)
+    # Merged files replace previous tables only when all shards are merged
+    for target_file in target_files.values():
+        os.replace(target_file.name, target_file.name[:-len(TMP_SUFFIX)])
+
+
+@timed('parse')
+def parse_sequential(tasks):
+    """
+    Parses dumps one after another in this process
+    :param tasks: List of (file, lang, tablename) tuples
+    :return: Set of all target languages
+    """
+    languages = set()
+    for file, lang, tablename in tasks:
         print(f'parsing {file}...')
+        with metrics.span(f'{lang}_{tablename}'):
+            # Lines of the dump, decompressed if needed
+            lines = DumpReader(file)
+            if tablename == 'page':
+                # Create page .csv file for current language
+                os.makedirs(f'csv/{tablename}', exist_ok=True)
+                # ID and title from each inserted tuple - (page_id, namespace, page_title, ...)
+                write_page_csv(parse_batches(lines, tablename), f'csv/{tablename}/{lang}.csv')
+            else:
+                # Each inserted tuple from INSERT statements - (page_id, target_lang, target_title)
+                write_langlinks(parse_batches(lines, tablename), f'csv/{tablename}/{lang}', languages)
+            metrics.count('bytes_read', lines.compressed_bytes)
+            metrics.count('bytes_decompressed', lines.decompressed_bytes)
+        print(f'{file}: {lines.report()}')
+    return languages
+
+
+@timed('parse')
+def parse_parallel(tasks, jobs, chunk_size):
+    """
+    Parses dumps with a pool of processes. Dumps are split into byte ranges, each parsed into a separate shard,
+    shards are merged when the whole dump is parsed.
+    :param tasks: List of (file, lang, tablename) tuples
+    :param jobs: Number of worker processes
+    :param chunk_size: Size of a byte range in bytes
+    :return: Set of all target languages
+    """
+    shard_tasks = []
+    shard_counts = dict()
+    for file, lang, tablename in tasks:
+        ranges = split_file(file, chunk_size)
+        shard_counts[(lang, tablename)] = len(ranges)
+        for shard, (start, end) in enumerate(ranges):
+            shard_tasks.append((file, lang, tablename, shard, start, end))
+    # Largest shards first, so that the pool is not left waiting for one big shard at the end
+    shard_tasks.sort(key=lambda t: (t[5] if t[5] is not None else os.path.getsize(t[0])) - t[4], reverse=True)
+    print(f'Parsing {len(tasks)} files in {len(shard_tasks)} shards with {jobs} processes...')
+
+    languages = set()
+    remaining = dict(shard_counts)
+    start_time = datetime.datetime.now()
+    compressed_bytes, decompressed_bytes = 0, 0
+    with Pool(jobs) as pool:
+        for lang, tablename, shard, shard_languages, reader in pool.imap_unordered(parse_shard, shard_tasks):
+            languages |= shard_languages
+            compressed_bytes += reader.compressed_bytes
+            decompressed_bytes += reader.decompressed_bytes
+            remaining[(lang, tablename)] -= 1
+            if not remaining[(lang, tablename)]:
+                print(f'Merging {lang} {tablename}...')
+                merge_shards(lang, tablename, shard_counts[(lang, tablename)])
+    shutil.rmtree('csv/shards', ignore_errors=True)
+    metrics.count('bytes_read', compressed_bytes)
+    metrics.count('bytes_decompressed', decompressed_bytes)
+    elapsed = datetime.datetime.now() - start_time
+    print(f'Parsed all dumps: {throughput_report(compressed_bytes, decompressed_bytes, elapsed)}')
+    return languages
+
+
+def parsed_tables(tasks):
+    """
+    Lists tables written by parsing given dumps
+    :param tasks: List of parsed (file, lang, tablename) tuples
+    :return: List of table names
+    """
+    tables = []
+    for file, lang, tablename in tasks:
+        if tablename == 'page':
+            tables.append(page_table(lang))
+        elif os.path.exists(f'csv/{tablename}/{lang}'):
+            tables.extend(langlink_table(lang, name[len('to_'):-len('.csv')])
+                          for name in sorted(os.listdir(f'csv/{tablename}/{lang}')) if name.endswith('.csv'))
+    return tables
+
+
+@timed('store')
+def build_store(tables, jobs):
+    """
+    Converts .csv tables into binary store
+    :param tables: List of table names
+    :param jobs: Number of processes
+    """
+    print(f'Building binary store of {len(tables)} tables...')
+    if jobs > 1:
+        with Pool(jobs) as pool:
+            stats = dict(pool.imap_unordered(convert_csv, tables, chunksize=8))
+    else:
+        stats = dict(map(convert_csv, tables))
+    # Row counts and duplicates for statistics, so that they don't have to be computed from the tables again
+    update_manifest(stats)
+    metrics.count('rows', sum(table_stats['rows'] for table_stats in stats.values()))
+
+
+def load_info():
+    """Loads metadata saved by previous parse from info.json"""
+    try:
+        with open('info.json') as info_file:
+            return json.load(info_file)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return {}
+
+
+def all_target_languages():
+    """Lists all target languages of parsed langlinks"""
+    languages = set()
+    if os.path.exists('csv/langlinks'):
+        for lang in os.listdir('csv/langlinks'):
+            languages.update(name[len('to_'):-len('.csv')] for name in os.listdir(f'csv/langlinks/{lang}')
+                             if name.endswith('.csv'))
+    return languages
+
+
+def remove_langlink_csvs(tasks):
+    """
+    Removes .csv files of langlinks which will be parsed again, so that files of target languages which are no
+    longer in the dump don't stay. Previous version of the tables is still kept in binary store.
+    """
+    for file, lang, tablename in tasks:
+        directory = f'csv/{tablename}/{lang}'
+        if tablename != 'page' and os.path.exists(directory):
+            for name in os.listdir(directory):
+                os.remove(f'{directory}/{name}')
+
+
+@timed('update')
+def update_changed_tables(tasks, big_index, jobs):
+    """
+    Compares re-parsed tables with their previous version in binary store. Only changed tables are converted into
+    binary store again and only changed pages are deleted from and added to Whoosh page indexes.
+    :param tasks: List of parsed (file, lang, tablename) tuples
+    :param big_index: Whether Whoosh page indexes are not used
+    :param jobs: Number of processes
+    """
+    changed_tables = []
+    for name in parsed_tables(tasks):
+        diff = table_diff(name)
+        lang = name.split('/')[1]
+        is_page_index = name == page_table(lang) and lang in MAIN_LANGS and not big_index
+        if diff is None:
+            # No previous version to compare with
+            changed_tables.append(name)
+            if is_page_index:
+                build_page_indexes([lang], jobs)
+            continue
+        deleted, inserted = diff
+        if not deleted and not inserted:
+            continue
+        print(f'{name}: {len(deleted)} rows deleted, {len(inserted)} rows inserted')
+        changed_tables.append(name)
+        if is_page_index:
+            if exists_in(INDEX_DIR, indexname=index_name(lang)):
+                apply_page_diff(open_dir(INDEX_DIR, indexname=index_name(lang)), deleted, inserted)
+            else:
+                build_page_indexes([lang], jobs)
+
+    # Tables of target languages which are no longer in re-parsed langlinks
+    for file, lang, tablename in tasks:
+        directory = f'{STORE_DIR}/{tablename}/{lang}'
+        if tablename != 'page' and os.path.exists(directory):
+            old_tables = [langlink_table(lang, name[len('to_'):-len('.tbl')]) for name in os.listdir(directory)]
+            for name in stale_tables(old_tables):
+                print(f'{name}: removed')
+                os.remove(store_path(name))
+                update_manifest({}, removed=[name])
+    build_store(changed_tables, jobs)
+    if not big_index:
+        build_title_indexes([name.split('/')[1] for name in changed_tables
+                             if name.startswith('page/') and name.split('/')[1] in MAIN_LANGS])
+    if changed_tables:
+        build_graph()
+
+
+@timed('title_index')
+def build_title_indexes(languages):
+    """Builds title hash indexes for exact title lookups and n-gram indexes for prefix and fuzzy lookups"""
+    for lang in languages:
+        print(f'Building title index {lang}...')
+        build_title_index(lang)
+        with metrics.span('ngram'):
+            build_ngram_index(lang)
+
+
+@timed('graph')
+def build_graph():
+    """Builds langlink graph for translations between languages without langlinks table between them"""
+    print('Building langlink graph...')
+    stats = build_translation_graph()
+    print(f'Langlink graph: {stats["nodes"]} titles in {stats["languages"]} languages, {stats["edges"]} edges, '
+          f'{stats["bytes"] / 1024 ** 2:.1f} MB')
+    if stats['bytes'] > RAM_BUDGET:
+        print(f'Warning: langlink graph is larger than {RAM_BUDGET / 1024 ** 3:.1f} GB budget')
+
+
+@timed('parser')
+def main(args):
+    path = 'wikipedia_dumps\\'
+
+    big_index = args.one_index
+    incremental = args.incremental
+    info = load_info()
+
+    # Prepare parser for SQL file names (compression extension after .sql is ignored by search)
+    filename_parser = compile(path + '{lang}wiki-latest-{tablename}.sql')
+
+    # List all SQL files, plain or compressed
+    files = get_dump_filenames(path)
+
+    tasks = []
+    for file in files:
         # Get language and table name from file name
         filename_result = filename_parser.search(file)
         lang = filename_result['lang']
         tablename = filename_result['tablename']
-        # Select a parser based on table name
+        # Skip tables which are not requested
         if tablename == 'page':
             if args.langlinks_only:
                 continue
-            parser = page_parser
         else:
             if args.pages_only:
                 continue
-            parser = langlink_parser
-        # Open the file
-        with open(file, 'r', encoding='utf8', errors='ignore') as f:
-            for line in f:
-                # Only work with INSERT statements
-                if line.startswith('INSERT INTO'):
-                    # Trim everything before first actual value
-                    start = line.find('(')
-                    line = line[start:]
-                    # Extract information from given line - finds all occurrences of the template given above
-                    result = parser.findall(line)
-                    if tablename == 'page':
-                        try:
-                            # Try to get page .csv file for current language opened before
-                            target_file = page_files[lang]
-                        except KeyError:
-                            # If it doesn't yet exist, create and open it
-                            os.makedirs(f'csv/{tablename}', exist_ok=True)
-                            target_file = open(f'csv/{tablename}/{lang}.csv', 'w', encoding='utf8')
-                            page_files[lang] = target_file
-
-                    # For each occurrence of template - each inserted tuple from INSERT statement
-                    for r in result:
-                        try:
-                            # Write page ID and title (tab-separated) into pages csv
-                            target_file.write(f'{r["page_id"]}\t{r["page_title"]}\n')
-                            # Add page ID and title to whoosh index for current language
-                            if not big_index:
-                                page_writers[lang].add_document(id=r['page_id'],
-                                                                title=r['page_title'].replace('_', ' '))
-                        except (KeyError, NameError):
-                            # Page_ID or page_title field is missing, which means we are processing a langlink file
-                            target_lang = r['target_lang'].strip("'")
-                            try:
-                                # Try to get previously opened file for combination of source and target language
-                                target_file = langlink_files[lang][target_lang]
-                                languages.add(target_lang)
-                            except KeyError:
-                                # If it doesn't exist, create and open it
-                                os.makedirs(f'csv/{tablename}/{lang}', exist_ok=True)
-                                target_file = open(f'csv/{tablename}/{lang}/to_{target_lang}.csv', 'w',
-                                                   encoding='utf8')
-                                # Then add it to the dictionary of opened langlink files
-                                try:
-                                    langlink_files[lang][target_lang] = target_file
-                                except KeyError:
-                                    langlink_files[lang] = dict()
-                                    langlink_files[lang][target_lang] = target_file
-                            target_title = r['target_title'].strip("'")
-                            # Write page title translation and page id into file
-                            target_file.write(f'{r["page_id"]}\t{target_title}\n')
-        close_files(page_files)
-        close_files(langlink_files)
-    for key, page_writer in page_writers.items():
-        # Build indices
-        print(f'Comitting writer {key}...')
-        page_writer.commit()
-        print(f'Writer {key} committed.')
-
-    # Save additional metadata (parse time and list of all target languages)
-    with open('info.json') as info_file:
-        try:
-            info = json.load(info_file)
-        except json.decoder.JSONDecodeError:
-            info = {}
+        tasks.append((file, lang, tablename))
+
+    # Fingerprints of dumps are saved, so that next incremental parse can skip unchanged ones. Dumps are read for
+    # checksums only by incremental parse, full parse saves just their size and modification time.
+    with metrics.span('fingerprint'):
+        changed_tasks, fingerprints = changed_dumps(tasks, info.get('dumps', {}), checksum=incremental)
+    if incremental:
+        print(f'{len(changed_tasks)} of {len(tasks)} dumps changed since last parse')
+        tasks = changed_tasks
+        remove_langlink_csvs(tasks)
+
+    if not args.langlinks_only and not incremental:
+        # Check if index has been built, so that we would not accidentally rewrite it
+        if os.path.exists(INDEX_DIR) and not args.yes:
+            if not sys.stdin.isatty():
+                raise SystemExit('Index directory already exists. Run with --yes to discard existing index.')
+            input('Index directory already exists. If you want to continue and discard existing index, press Enter.')
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    languages = set()
+
+    if args.jobs > 1:
+        languages = parse_parallel(tasks, args.jobs, int(args.chunk_size * 1024 * 1024))
+    else:
+        languages = parse_sequential(tasks)
+    if incremental:
+        update_changed_tables(tasks, big_index, args.jobs)
+        languages = all_target_languages()
+    else:
+        build_store(parsed_tables(tasks), args.jobs)
+        build_graph()
+        if not big_index:
+            # Build page indexes of parsed main languages from binary store
+            page_langs = [lang for file, lang, tablename in tasks if tablename == 'page' and lang in MAIN_LANGS]
+            build_page_indexes(page_langs, args.jobs)
+            build_title_indexes(page_langs)
 
+    # Save additional metadata (parse time, list of all target languages and fingerprints of dumps)
     with open('info.json', 'w') as info_file:
         info['lastParse'] = datetime.datetime.now().timestamp()
         if not args.pages_only:
             info['allLangs'] = list(languages)
+        info['dumps'] = dict(info.get('dumps', {}), **fingerprints)
         json.dump(info, info_file, indent=2)
 
     if big_index:
-        build_elastic_index(primary_languages=MAIN_LANGS, secondary_languages=info['allLangs'])
-
-    if start_time:
-        print(f'Parsing took {datetime.datetime.now() - start_time}')
+        build_elastic_index(primary_languages=MAIN_LANGS, secondary_languages=info['allLangs'],
+                            workers=args.index_workers, bulk_size=args.bulk_size)
 
 
 if __name__ == '__main__':
-    start_time = None
-
     # Process command line arguments
     arg_parser = argparse.ArgumentParser(description='Parse wikipedia SQL dumps')
     arg_parser.add_argument('-p', '--pages_only', help='Only parse pages', action='store_true')
@@ -174,6 +524,22 @@ if __name__ == '__main__':
     arg_parser.add_argument('-t', '--time', help='Whether to time the execution', action='store_true')
     arg_parser.add_argument('-o', '--one_index', help='Whether to index everything into one big index',
                             action='store_true')
+    arg_parser.add_argument('-i', '--incremental', help='Only parse dumps changed since last parse and update '
+                                                        'indexes with changed pages', action='store_true')
+    arg_parser.add_argument('-y', '--yes', help='Discard existing index without asking', action='store_true')
+    arg_parser.add_argument('-j', '--jobs', help='Number of processes for parallel parsing and indexing', type=int,
+                            default=1)
+    arg_parser.add_argument('--index_workers', help='Number of processes preparing documents for Elasticsearch',
+                            type=int, default=4)
+    arg_parser.add_argument('--bulk_size', help='Number of documents in one Elasticsearch bulk request', type=int,
+                            default=5000)
+    arg_parser.add_argument('--chunk_size', help='Size of dump chunks (in MB) parsed by one process in parallel '
+                                                 'parsing', type=float, default=128)
+    metrics.add_arguments(arg_parser)
 
     args = arg_parser.parse_args()
-    main(args, start_time)
+    metrics.start(args)
+    try:
+        main(args)
+    finally:
+        metrics.finish(args)
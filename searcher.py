@@ -1,66 +1,131 @@
+import time
+
+# Start of imports, for measuring startup time of the command line interface
+IMPORT_START = time.perf_counter_ns()
+
 import argparse
-import os
 
-import pandas as pd
-from whoosh import index
-from whoosh.qparser import QueryParser
+import metrics
+from cache import query_cache, normalize_term, CACHE_FILE
+from common import INDEX_DIR, page_schema, MAIN_LANGS, index_name
+from metrics import timed
+from ngram_index import MAX_DISTANCE, prefix_pages, fuzzy_pages, has_ngram_index
+from title_index import exact_pages
+from store import read_frame, table_exists, langlink_table, cached_table, lookup_titles
+from translation_graph import graph_translations
+
+# Heavy modules (pandas, elasticsearch client, Whoosh searching) are imported only in functions which need them,
+# so that a single lookup from command line doesn't wait for them.
 
-import elastic_searcher
-from common import measure_execution_time, INDEX_DIR, PAGE_IDX_NAME, page_schema, MAIN_LANGS, index_name
+# How input is matched with page titles - Whoosh search for pages containing all words of input,
+# titles starting with input (autocomplete) and titles within edit distance from input (misspelled input)
+MATCH_MODES = ['search', 'prefix', 'fuzzy']
 
-timer_enabled = False
 args = None
 if __name__ == '__main__':
     arg_parser = argparse.ArgumentParser(description='Find a translation')
     arg_parser.add_argument('input', help='Input term to be translated')
     arg_parser.add_argument('lang_from',
-                            help=f'Language code of the input. Should be one of {MAIN_LANGS} unless "-e" is also specified.')
+                            help=f'Language code of the input. Languages other than {MAIN_LANGS} are translated '
+                                 f'through langlink graph (exact titles only), or with "-e".')
     arg_parser.add_argument('lang_to', help='Code of target language')
     arg_parser.add_argument('-n', '--namespaces', help='Leave translated pages with namespace prefixes in output',
                             action='store_true')
     arg_parser.add_argument('-t', '--time', help='Whether to time the execution', action='store_true')
     arg_parser.add_argument('-e', '--elastic', help='Use Elasticsearch index', action='store_true')
+    arg_parser.add_argument('-c', '--cache', help=f'Cache results in {CACHE_FILE} for further runs',
+                            action='store_true')
     arg_parser.add_argument('--show_not_found', action='store_true', help='Show a list of pages that could not be '
                                                                           'translated')
+    arg_parser.add_argument('-m', '--match', help='How input is matched with page titles - search for all words, '
+                                                  'titles starting with input or titles within edit distance',
+                            choices=MATCH_MODES, default='search')
+    arg_parser.add_argument('-d', '--distance', help='Maximal edit distance for fuzzy match', type=int,
+                            default=MAX_DISTANCE)
+    metrics.add_arguments(arg_parser)
 
     args = arg_parser.parse_args()
-    timer_enabled = args.time
+    metrics.start(args)
+    metrics.record('startup', time.perf_counter_ns() - IMPORT_START)
 
 
-@measure_execution_time(timer_enabled)
+@timed()
 def load_index(name):
     """
     Loads the Whoosh index
 
     :param name: Name of the index to load
     """
+    from whoosh import index
+
     return index.open_dir(INDEX_DIR, name)
 
 
-@measure_execution_time(timer_enabled)
-def translate(input_title, lang_from, lang_to, page_index=None):
+@timed()
+def translate(input_title, lang_from, lang_to, page_index=None, match='search', max_distance=MAX_DISTANCE):
     """
     Finds the translated title of input page title. Input title doesn't have to be a whole title.
     :param input_title: Title to translate
     :param lang_from: Language of input
     :param lang_to: Desired language
-    :param page_index: Whoosh index to use
+    :param page_index: Whoosh index to use, loaded only if needed when not given
+    :param match: One of `MATCH_MODES`
+    :param max_distance: Maximal edit distance for fuzzy match
     :return: pd.DataFrame with original titles and translations
     """
-    if not page_index:
-        page_index = load_index(PAGE_IDX_NAME)
+    pages = find_pages(input_title, lang_from, lang_to, page_index, match, max_distance)
+    return find_translated_title(pages, lang_from, lang_to)
+
+
+@timed()
+def translate_pairs(input_title, lang_from, lang_to, page_index=None, match='search', max_distance=MAX_DISTANCE):
+    """
+    Same as `translate`, but without pandas
+    :return: List of (original title, translated title) tuples, translated title is None if there is no translation
+    """
+    pages = find_pages(input_title, lang_from, lang_to, page_index, match, max_distance)
+    return find_translation_pairs(pages, lang_from, lang_to)
+
+
+@timed()
+def translate_graph_pairs(input_title, lang_from, lang_to, page_index=None, match='search',
+                          max_distance=MAX_DISTANCE):
+    """
+    Same as `translate_pairs`, but between any two languages through langlink graph (see `translation_graph.py`),
+    used when there is no langlinks table from `lang_from` to `lang_to`. Pages of main languages are found as in
+    `translate`, titles of other languages have to match exactly (case and underscores don't matter).
+    Exits if the graph is not built or no title is found.
+    :return: List of (original title, translated title) tuples, translated title is None if there is no translation
+    """
+    if lang_from in MAIN_LANGS:
+        try:
+            titles = [page[1] for page in find_page_id(preprocess(input_title), page_index, lang_from, match,
+                                                       max_distance)]
+        except ValueError as e:
+            exit(f'Page {input_title} not found in {lang_from}wiki.\n{e}')
+    else:
+        titles = [input_title]
+    translations = graph_translations(titles, lang_from, lang_to)
+    if translations is None:
+        exit(f'Cannot translate from {lang_from} to {lang_to}, langlink graph is not built. Run parser.py first.')
+    if not translations:
+        exit(f'Page {input_title} not found in langlinks of {lang_from}wiki.')
+    return [(original, translated) for original, translated, pivot in translations]
+
+
+def find_pages(input_title, lang_from, lang_to, page_index=None, match='search', max_distance=MAX_DISTANCE):
+    """Finds pages to translate, exits if translation is not possible or no page is found"""
     check_target_lang(lang_from, lang_to)
     title = preprocess(input_title)
     pages = []
     try:
-        pages = find_page_id(title, page_index)
+        pages = find_page_id(title, page_index, lang_from, match, max_distance)
     except ValueError as e:
         exit(f'Page {input_title} not found in {lang_from}wiki.\n{e}')
-    translation = find_translated_title(pages, lang_from, lang_to)
-    return translation
+    return pages
 
 
-@measure_execution_time(timer_enabled)
+@timed()
 def check_target_lang(source, target):
     """
     Checks if translation from `source` to `target` is possible.
@@ -68,12 +133,12 @@ def check_target_lang(source, target):
     :param target: Desirted language
     :return: True if OK
     """
-    if os.path.exists(f'csv/langlinks/{source}/to_{target}.csv'):
+    if table_exists(langlink_table(source, target)):
         return True
     exit(f'Cannot translate from {source} to {target}. Check language codes and make sure parser has been run.')
 
 
-@measure_execution_time(timer_enabled)
+@timed()
 def preprocess(input_title: str):
     """
     Preprocesses user input by making it lowercase. Rest is done by Whoosh searcher.
@@ -83,29 +148,95 @@ def preprocess(input_title: str):
     return input_title.lower()
 
 
-@measure_execution_time(timer_enabled)
-def find_page_id(title, idx):
+@timed()
+def find_page_id(title, idx, lang=None, match='search', max_distance=MAX_DISTANCE):
     """
     Looks up page ID using Whoosh index. Title is lowercased, tokenized and accents are removed.
     Capable of finding pages which contain the input (doesn't have to be exact match)
+    If the language is given, title hash index is checked first, Whoosh index is searched only if no title
+    matches exactly. Prefix and fuzzy matches use n-gram index of the language instead of Whoosh.
 
     :param title: Page title (or part of title) to look up
-    :param idx: The Whoosh index to use
+    :param idx: The Whoosh index to use, page index of `lang` is loaded if it is None
+    :param lang: Language of the index
+    :param match: One of `MATCH_MODES`, prefix and fuzzy match need the language
+    :param max_distance: Maximal edit distance for fuzzy match
     :return: List of (page_id, page_title) tuples
     """
-    with idx.searcher() as searcher:
-        parser = QueryParser('title', schema=page_schema)
-        # Parse title into query using analyzer in index schema (tokenize, lowercase, remove accents)
-        # Tokens are joined with AND
-        results = searcher.search(parser.parse(title))
-        if not results:
-            # If no matches were found, throw error with correction suggestions
-            suggestion = searcher.correct_query(parser.parse(title), title)
-            raise ValueError(f"Did you mean: {suggestion.string}?")
-        return [tuple(r.values()) for r in results]
+    if match != 'search':
+        return find_similar_pages(title, lang, match, max_distance)
+    if lang:
+        pages = exact_pages(title, lang)
+        if pages:
+            return pages
+    if idx is None:
+        idx = load_index(index_name(lang))
+
+    # Correction is suggested from n-gram index if it is built, Whoosh spelling correction is slow
+    fuzzy_suggestion = lang is not None and has_ngram_index(lang)
+
+    def search():
+        with idx.searcher() as searcher:
+            return search_page_id(title, searcher, suggest=not fuzzy_suggestion)
+
+    try:
+        return list(query_cache.get_or_compute(page_id_key(idx.indexname, title), search))
+    except ValueError:
+        suggestions = fuzzy_pages(title, lang, limit=1) if fuzzy_suggestion else None
+        if suggestions:
+            raise ValueError(f'Did you mean: {suggestions[0][1]}?')
+        raise
+
+
+@timed()
+def find_similar_pages(title, lang, match, max_distance=MAX_DISTANCE):
+    """
+    Looks up pages using n-gram index, see `find_page_id`
+    :raises ValueError: If no page matches or the n-gram index is not built
+    """
+    if match == 'prefix':
+        pages = prefix_pages(title, lang)
+    elif match == 'fuzzy':
+        pages = fuzzy_pages(title, lang, max_distance)
+    else:
+        raise ValueError(f'Unknown match mode {match}, should be one of {MATCH_MODES}')
+    if pages is None:
+        raise ValueError(f'N-gram index of {lang} is not built, run parser.py first')
+    if not pages:
+        raise ValueError('No matching page found')
+    return pages
+
+
+def page_id_key(index, title):
+    """Key of page ID lookup in query cache"""
+    return 'page_id', index, normalize_term(title)
+
+
+def search_page_id(title, searcher, suggest=True):
+    """
+    Looks up page ID using an already opened Whoosh searcher. See `find_page_id`.
+
+    :param title: Page title (or part of title) to look up
+    :param searcher: Whoosh searcher of the page index
+    :param suggest: Whether to suggest a correction if nothing was found (it is slow on large indexes)
+    :return: List of (page_id, page_title) tuples
+    """
+    from whoosh.qparser import QueryParser
+
+    parser = QueryParser('title', schema=page_schema)
+    # Parse title into query using analyzer in index schema (tokenize, lowercase, remove accents)
+    # Tokens are joined with AND
+    results = searcher.search(parser.parse(title))
+    if not results:
+        if not suggest:
+            raise ValueError('No matching page found')
+        # If no matches were found, throw error with correction suggestions
+        suggestion = searcher.correct_query(parser.parse(title), title)
+        raise ValueError(f"Did you mean: {suggestion.string}?")
+    return [(r['id'], r['title']) for r in results]
 
 
-@measure_execution_time(timer_enabled)
+@timed()
 def find_translated_title(pages, lang_from, lang_to):
     """
     Find translated titles by page IDs
@@ -114,7 +245,18 @@ def find_translated_title(pages, lang_from, lang_to):
     :param lang_to: Target language code
     :return: pd.DataFrame containing original and translated titles
     """
-    df = pd.read_csv(f'csv/langlinks/{lang_from}/to_{lang_to}.csv', sep='\t', header=None, index_col=0)
+    import pandas as pd
+
+    table = cached_table(langlink_table(lang_from, lang_to))
+    if table is not None:
+        # Binary search in memory-mapped page IDs, only matching titles are read
+        page_ids = [page[0] for page in pages]
+        return pd.DataFrame({f'title_{lang_from}': [page[1] for page in pages],
+                             f'title_{lang_to}': lookup_titles(table, page_ids)},
+                            index=pd.Index(page_ids, name=0))
+
+    # Fall back to .csv table
+    df = read_frame(langlink_table(lang_from, lang_to))
     matches = pd.DataFrame.from_records(pages, index=0)
     df.columns = ['title']
     # Left join - leaves pages with no translation in, but sets None in target language column
@@ -123,48 +265,121 @@ def find_translated_title(pages, lang_from, lang_to):
     return result
 
 
-def discard_namespace(row):
+@timed()
+def find_translation_pairs(pages, lang_from, lang_to):
+    """
+    Find translated titles by page IDs, without pandas if binary store is built
+    :param pages:  List of (page_id, page_title) tuples
+    :param lang_from: Input language code
+    :param lang_to: Target language code
+    :return: List of (original title, translated title) tuples, translated title is None if there is no translation
+    """
+    table = cached_table(langlink_table(lang_from, lang_to))
+    if table is None:
+        return list(find_translated_title(pages, lang_from, lang_to).itertuples(index=False, name=None))
+    return list(zip([page[1] for page in pages], lookup_titles(table, [page[0] for page in pages])))
+
+
+def strip_namespace(original, translated):
     """
     Removes namespace (like Category: from page title). Based around position of colon (:) in the translated title.
     Namespaces are not present in titles from the `pages` table, but are present in `langlinks`.
     Therefore, a namespaced page translation should have more colons than the original title.
     If that is the case, anything before the first colon in the translated title is discarded.
 
+    :param original: Original title
+    :param translated: Translated title
+    :return: Translated title without namespace
+    """
+    if translated.count(':') > original.count(':'):
+        colon = translated.find(':')
+        if colon:
+            translated = translated[colon + 1:]
+    return translated
+
+
+def discard_namespace(row):
+    """
+    Removes namespace from translated title in a row of results. See `strip_namespace`.
+
     :param row: A row of pd.Dataframe with original title [0] and translated title [1]
     :return: Modified row
     """
-    if row.iloc[1].count(':') > row.iloc[0].count(':'):
-        colon = row.iloc[1].find(':')
-        if colon:
-            row.iloc[1] = row.iloc[1][colon + 1:]
+    row.iloc[1] = strip_namespace(row.iloc[0], row.iloc[1])
     return row
 
 
-if __name__ == '__main__':
-    results = None
-    if args.elastic:
-        try:
-            results = elastic_searcher.translate(args.input, args.lang_from, args.lang_to)
-        except ValueError as e:
-            exit(e)
-    else:
-        if args.lang_from not in MAIN_LANGS:
-            exit(f'lang_from should be one of {MAIN_LANGS} unless "-e" is also specified. It was: {args.lang_from}')
-        page_idx = load_index(index_name(args.lang_from))
-        results = translate(args.input, args.lang_from, args.lang_to, page_idx)
+def split_results(results, lang_from, lang_to, namespaces=False):
+    """
+    Splits translation results into translated pages and pages without translation
+
+    :param results: pd.DataFrame with original titles and translations
+    :param lang_from: Input language code
+    :param lang_to: Target language code
+    :param namespaces: Leave translated pages with namespace prefixes in output
+    :return: Tuple (pd.DataFrame of correctly translated entries, pd.Series of titles with no translation)
+    """
     # Save correctly translated entries
     good_matches = results.dropna()
-    if not args.namespaces:
+    if not namespaces:
         # noinspection PyTypeChecker
         good_matches = good_matches.apply(discard_namespace, axis=1)
         # Namespace removal can leave duplicate translations
         good_matches = good_matches.drop_duplicates()
-    results = results.drop_duplicates([f'title_{args.lang_from}'])
-    not_found = results[results[f'title_{args.lang_to}'].isna()][f'title_{args.lang_from}']
-    if len(good_matches) > 1:
-        print('Multiple translations found:')
-    for row in good_matches.values:
-        print(f'{row[0]} -> {row[1]}')
-
-    if (args.show_not_found or len(good_matches) == 0) and len(not_found) > 0:
-        print(f'Pages from {args.lang_from}wiki with no translation in {args.lang_to}wiki: {list(not_found)}')
+    results = results.drop_duplicates([f'title_{lang_from}'])
+    not_found = results[results[f'title_{lang_to}'].isna()][f'title_{lang_from}']
+    return good_matches, not_found
+
+
+def split_pairs(pairs, namespaces=False):
+    """
+    Same as `split_results`, for a list of (original title, translated title) tuples
+    :return: Tuple (list of translated (original, translated) tuples, list of titles with no translation)
+    """
+    good_matches = []
+    for original, translated in pairs:
+        if translated is not None:
+            if not namespaces:
+                translated = strip_namespace(original, translated)
+            if (original, translated) not in good_matches:
+                good_matches.append((original, translated))
+    # Only the first page with the same title is considered
+    first = dict()
+    for original, translated in pairs:
+        first.setdefault(original, translated)
+    not_found = [original for original, translated in first.items() if translated is None]
+    return good_matches, not_found
+
+
+if __name__ == '__main__':
+    try:
+        if args.cache:
+            query_cache.open_disk(CACHE_FILE)
+        if args.elastic:
+            import elastic_searcher
+
+            try:
+                results = elastic_searcher.translate(args.input, args.lang_from, args.lang_to)
+            except ValueError as e:
+                exit(e)
+            good_matches, not_found = split_results(results, args.lang_from, args.lang_to, args.namespaces)
+            good_matches = list(good_matches.itertuples(index=False, name=None))
+        else:
+            # Page index is loaded only if the input is not an exact title
+            if args.lang_from in MAIN_LANGS and table_exists(langlink_table(args.lang_from, args.lang_to)):
+                pairs = translate_pairs(args.input, args.lang_from, args.lang_to, match=args.match,
+                                        max_distance=args.distance)
+            else:
+                # No langlinks table between the languages, translated through pages of main languages
+                pairs = translate_graph_pairs(args.input, args.lang_from, args.lang_to, match=args.match,
+                                              max_distance=args.distance)
+            good_matches, not_found = split_pairs(pairs, args.namespaces)
+        if len(good_matches) > 1:
+            print('Multiple translations found:')
+        for original, translated in good_matches:
+            print(f'{original} -> {translated}')
+
+        if (args.show_not_found or len(good_matches) == 0) and len(not_found) > 0:
+            print(f'Pages from {args.lang_from}wiki with no translation in {args.lang_to}wiki: {list(not_found)}')
+    finally:
+        metrics.finish(args)
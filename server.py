@@ -0,0 +1,272 @@
+import argparse
+import json
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import elastic_searcher
+from common import MAIN_LANGS, index_name
+from cache import query_cache, info_mtime, parse_version
+from searcher import load_index, preprocess, search_page_id, find_translated_title, split_results, split_pairs, \
+    page_id_key
+import ngram_index
+import title_index
+from title_index import exact_pages
+from store import table_exists, langlink_table, drop_cached_tables
+from translation_graph import graph_translations, drop_cached_graphs
+
+
+class SearcherPool:
+    """
+    Pool of warm Whoosh searchers of one index. Searchers are not shared between threads,
+    each request borrows one and returns it when done. New searchers are opened only when all are in use.
+    """
+
+    def __init__(self, idx, size):
+        self.idx = idx
+        self.size = size
+        self._searchers = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        # Open one searcher right away, so that the first request doesn't have to
+        self._searchers.put(idx.searcher())
+        self._opened = 1
+
+    def acquire(self):
+        """Borrows a searcher, refreshed if the index has changed since it was opened (e.g. by incremental parse)"""
+        try:
+            searcher = self._searchers.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if self._opened < self.size:
+                    self._opened += 1
+                    return self.idx.searcher()
+            searcher = self._searchers.get()
+        if not searcher.up_to_date():
+            # Refreshed searcher reuses unchanged segments, the old one can't be used anymore
+            searcher = searcher.refresh()
+        return searcher
+
+    def release(self, searcher):
+        self._searchers.put(searcher)
+
+
+class TranslationService:
+    """Keeps page indexes and langlink tables open and translates terms"""
+
+    def __init__(self, searchers=4, elastic=False):
+        """
+        :param searchers: Maximum number of concurrently used searchers per language
+        :param elastic: Use Elasticsearch index instead of Whoosh indexes
+        """
+        self.elastic = elastic
+        self.pools = dict()
+        self._lock = threading.Lock()
+        self._info_mtime = info_mtime()
+        self._version = parse_version()
+        if not elastic:
+            for lang in MAIN_LANGS:
+                print(f'Loading index {index_name(lang)}...')
+                self.pools[lang] = SearcherPool(load_index(index_name(lang)), searchers)
+
+    def check_parse(self):
+        """
+        Drops tables, title and n-gram indexes and langlink graphs kept open by lookups if the parser has been run
+        since they were opened (`lastParse` in info.json changed), so that they are opened again from the new files.
+        Files are replaced, not rewritten, so lookups running meanwhile finish on the old maps.
+        """
+        mtime = info_mtime()
+        if mtime == self._info_mtime:
+            return
+        with self._lock:
+            if mtime == self._info_mtime:
+                return
+            self._info_mtime = mtime
+            version = parse_version()
+            if version != self._version:
+                self._version = version
+                drop_cached_tables()
+                title_index.drop_cached_indexes()
+                ngram_index.drop_cached_indexes()
+                drop_cached_graphs()
+
+    def translate(self, term, lang_from, lang_to, namespaces=False):
+        """
+        Translates a term
+        :param term: Title (or part of title) to translate
+        :param lang_from: Language of input
+        :param lang_to: Desired language
+        :param namespaces: Leave translated pages with namespace prefixes in output
+        :return: Tuple (HTTP status, JSON serializable response)
+        """
+        response = {'term': term, 'from': lang_from, 'to': lang_to}
+        self.check_parse()
+        if self.elastic:
+            try:
+                results = elastic_searcher.translate(term, lang_from, lang_to)
+            except ValueError as e:
+                return 404, dict(response, error=str(e))
+        else:
+            if lang_from not in self.pools or not table_exists(langlink_table(lang_from, lang_to)):
+                return self.translate_graph(response, term, lang_from, lang_to, namespaces)
+            pool = self.pools[lang_from]
+            title = preprocess(term)
+
+            def search():
+                searcher = pool.acquire()
+                try:
+                    return search_page_id(title, searcher)
+                finally:
+                    pool.release(searcher)
+
+            try:
+                # Exact title match is looked up in title hash index, Whoosh index is searched otherwise
+                pages = exact_pages(title, lang_from) or \
+                    query_cache.get_or_compute(page_id_key(index_name(lang_from), title), search)
+            except ValueError as e:
+                return 404, dict(response, error=f'Page {term} not found in {lang_from}wiki. {e}')
+            results = find_translated_title(pages, lang_from, lang_to)
+        good_matches, not_found = split_results(results, lang_from, lang_to, namespaces)
+        response['translations'] = [{'original': row[0], 'translated': row[1]} for row in good_matches.values]
+        response['not_found'] = list(not_found)
+        return 200, response
+
+    @staticmethod
+    def translate_graph(response, term, lang_from, lang_to, namespaces=False):
+        """Translates an exact title between languages without langlinks table through langlink graph"""
+        translations = graph_translations([term], lang_from, lang_to)
+        if translations is None:
+            return 404, dict(response, error=f'Cannot translate from {lang_from} to {lang_to}')
+        if not translations:
+            return 404, dict(response, error=f'Page {term} not found in langlinks of {lang_from}wiki')
+        good_matches, not_found = split_pairs([(original, translated) for original, translated, pivot in translations],
+                                              namespaces)
+        response['translations'] = [{'original': original, 'translated': translated}
+                                    for original, translated in good_matches]
+        response['not_found'] = not_found
+        return 200, response
+
+
+class TranslationHandler(BaseHTTPRequestHandler):
+    """
+    HTTP handler of the translation API:
+      GET /translate?term=...&from=...&to=...[&namespaces=1]
+      POST /translate with JSON body {"term": ..., "from": ..., "to": ..., "namespaces": false}
+      GET /health
+      GET /stats - query cache statistics
+    """
+    service: TranslationService = None
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_translate(self, params: dict):
+        try:
+            term, lang_from, lang_to = params['term'], params['from'], params['to']
+        except KeyError as e:
+            self.send_json(400, {'error': f'Missing parameter {e}'})
+            return
+        if not all(isinstance(value, str) for value in (term, lang_from, lang_to)):
+            self.send_json(400, {'error': 'Parameters term, from and to must be strings'})
+            return
+        namespaces = params.get('namespaces') in (True, '1', 'true')
+        self.send_json(*self.service.translate(term, lang_from, lang_to, namespaces))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/health':
+            self.send_json(200, {'status': 'ok', 'languages': MAIN_LANGS})
+        elif url.path == '/stats':
+            self.send_json(200, {'cache': query_cache.stats()})
+        elif url.path == '/translate':
+            self.handle_translate({k: v[0] for k, v in parse_qs(url.query).items()})
+        else:
+            self.send_json(404, {'error': f'Unknown path {url.path}'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/translate':
+            self.send_json(404, {'error': f'Unknown path {url.path}'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            # Size of the body is unknown, it can't be skipped to read next request on this connection
+            self.close_connection = True
+            self.send_json(400, {'error': f'Invalid Content-Length {self.headers.get("Content-Length")}'})
+            return
+        try:
+            params = json.loads(self.rfile.read(length))
+        except (json.decoder.JSONDecodeError, UnicodeDecodeError) as e:
+            self.send_json(400, {'error': f'Invalid JSON: {e}'})
+            return
+        if not isinstance(params, dict):
+            self.send_json(400, {'error': 'JSON body must be an object'})
+            return
+        self.handle_translate(params)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class TranslationServer(ThreadingHTTPServer):
+    # Many concurrent clients - default backlog of 5 connections would make clients retry
+    request_queue_size = 128
+    daemon_threads = True
+    quiet = False
+
+
+def serve(host, port, searchers=4, elastic=False, quiet=False, cache_size=10000, cache_ttl=None, cache_file=None):
+    """
+    Runs the translation server until interrupted
+    :param host: Address to listen on
+    :param port: Port to listen on
+    :param searchers: Maximum number of concurrently used searchers per language
+    :param elastic: Use Elasticsearch index instead of Whoosh indexes
+    :param quiet: Don't log requests
+    :param cache_size: Maximum number of cached queries in memory
+    :param cache_ttl: Time to live of cached queries in seconds
+    :param cache_file: SQLite file for persistent query cache
+    """
+    query_cache.maxsize = cache_size
+    query_cache.ttl = cache_ttl
+    if cache_file:
+        query_cache.open_disk(cache_file)
+    TranslationHandler.service = TranslationService(searchers, elastic)
+    server = TranslationServer((host, port), TranslationHandler)
+    server.quiet = quiet
+    print(f'Serving translations on http://{host}:{port}/translate')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Run translation server with HTTP/JSON API')
+    arg_parser.add_argument('--host', help='Address to listen on', default='127.0.0.1')
+    arg_parser.add_argument('-p', '--port', help='Port to listen on', type=int, default=8080)
+    arg_parser.add_argument('-s', '--searchers', help='Maximum number of concurrent searchers per language',
+                            type=int, default=4)
+    arg_parser.add_argument('-e', '--elastic', help='Use Elasticsearch index', action='store_true')
+    arg_parser.add_argument('-q', '--quiet', help='Don\'t log requests', action='store_true')
+    arg_parser.add_argument('--cache_size', help='Maximum number of cached queries in memory', type=int,
+                            default=10000)
+    arg_parser.add_argument('--cache_ttl', help='Time to live of cached queries in seconds', type=float)
+    arg_parser.add_argument('--cache_file', help='SQLite file for query cache which survives restarts')
+
+    args = arg_parser.parse_args()
+    serve(args.host, args.port, args.searchers, args.elastic, args.quiet, args.cache_size, args.cache_ttl,
+          args.cache_file)
@@ -0,0 +1,231 @@
+"""
+Streaming tokenizer for MySQL `INSERT INTO ... VALUES (...),(...);` statements as found in Wikipedia SQL dumps.
+
+Values are located with plain string splitting and slicing instead of a template matcher, so quoted strings
+containing commas, parentheses, `','` sequences or escaped quotes are split correctly.
+"""
+from array import array
+
+# MySQL escape sequences inside quoted strings
+_ESCAPES = {
+    '0': '\0',
+    'b': '\b',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+    'Z': '\x1a',
+    '\\': '\\',
+    "'": "'",
+    '"': '"',
+}
+# Placeholders for a string value in SQL structure, escaped quote and escaped backslash
+_STRING = '\x01'
+_QUOTE = '\x02'
+_BACKSLASH = '\x03'
+
+
+def unescape(value: str):
+    """
+    Resolves MySQL backslash escapes in a quoted string value
+    :param value: Raw string between the enclosing quotes
+    :return: Unescaped string
+    """
+    if '\\' not in value:
+        return value
+    parts = value.split('\\')
+    result = [parts[0]]
+    i = 1
+    while i < len(parts):
+        part = parts[i]
+        if not part:
+            # Two consecutive backslashes - escaped backslash, next part is taken literally
+            result.append('\\')
+            i += 1
+            if i < len(parts):
+                result.append(parts[i])
+        else:
+            escaped = _ESCAPES.get(part[0])
+            if escaped is None:
+                # Unknown escape (e.g. \% or \_) - MySQL keeps the backslash
+                result.append('\\' + part)
+            else:
+                result.append(escaped + part[1:])
+        i += 1
+    return ''.join(result)
+
+
+def convert(value: str):
+    """
+    Converts an unquoted SQL literal into a Python value
+    :param value: NULL or a numeric literal
+    :return: None, int or float
+    """
+    if value == 'NULL':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def convert_column(column: list):
+    """
+    Converts a column of unquoted SQL literals into Python values.
+    A column with at least one non-integer literal is a column of floats.
+    :param column: List of NULL or numeric literals
+    :return: List of None, int or float values
+    """
+    nulls = column.count('NULL')
+    if nulls == len(column):
+        return [None] * nulls
+    if not nulls:
+        # Fast path - conversion of whole column at once
+        try:
+            return list(map(int, column))
+        except ValueError:
+            return list(map(float, column))
+    return list(map(convert, column))
+
+
+def restore(value: str):
+    """
+    Restores escaped quotes and backslashes replaced by placeholders and resolves remaining escapes
+    :param value: String value with placeholders
+    :return: Unescaped string
+    """
+    if '\\' in value:
+        value = unescape(value)
+    return value.replace(_QUOTE, "'").replace(_BACKSLASH, '\\')
+
+
+def _split_quoted(body: str):
+    """
+    Splits INSERT statement body into unquoted SQL structure and quoted string values
+    :param body: Everything between the first opening and the last closing parenthesis
+    :return: Tuple (list of unquoted parts, list of string values), there is exactly one string between two parts
+    """
+    escaped = '\\' in body
+    if escaped:
+        # Hide escaped backslashes first, so that \\' is not mistaken for an escaped quote
+        body = body.replace('\\\\', _BACKSLASH).replace("\\'", _QUOTE)
+    parts = body.split("'")
+    if '' in parts[2:-1:2]:
+        # Empty structure between two strings means a doubled quote ('') inside of a string, merge the strings back
+        merged = [parts[0]]
+        i = 1
+        while i < len(parts):
+            value = parts[i]
+            while i + 2 < len(parts) and not parts[i + 1]:
+                i += 2
+                value = f"{value}'{parts[i]}"
+            merged.append(value)
+            if i + 1 < len(parts):
+                merged.append(parts[i + 1])
+            i += 2
+        parts = merged
+    if len(parts) % 2 == 0:
+        raise ValueError(f'Unterminated string: {parts[-1][:50]}')
+    strings = parts[1::2]
+    if escaped:
+        strings = [restore(value) for value in strings]
+    return parts[0::2], strings
+
+
+def statement_columns(line: str, columns=None, arrays=()):
+    """
+    Values of all tuples from a single INSERT statement, by column.
+
+    The statement body is split on quotes into SQL structure and string values. Every string in the structure is
+    replaced by a marker and the structure is split into a flat list of fields. As all tuples in one statement have
+    the same number of values, columns are then just slices of the flat list and are converted all at once.
+    Control characters \\x01 - \\x03 are used as markers and must not appear in the dump.
+    :param line: A line containing the whole INSERT statement
+    :param columns: Positions of values to keep, all values are kept if not given
+    :param arrays: Positions of integer columns returned as `array('q')` instead of lists, no int object is kept
+                   per value
+    :return: List of columns (lists of str, int, float or None values, all of the same length), None if the line
+             has no values
+    """
+    values = line.find(' VALUES ')
+    start = line.find('(', values + 1 if values >= 0 else 0)
+    if start == -1:
+        return None
+    # Strip the terminating ");" so that only "),(" separates tuples
+    end = len(line.rstrip())
+    if line[end - 1] == ';':
+        end -= 1
+    if line[end - 1] == ')':
+        end -= 1
+    structure, strings = _split_quoted(line[start + 1:end])
+    structure = _STRING.join(structure)
+
+    # Number of values in one tuple
+    first = structure.find('),(')
+    width = (structure.count(',', 0, first) if first >= 0 else structure.count(',')) + 1
+    fields = structure.replace('),(', ',').split(',')
+    if len(fields) % width:
+        raise ValueError(f'Tuples with different number of values: {line[:100]}')
+    if columns is None:
+        columns = range(width)
+
+    all_columns = [fields[c::width] for c in range(width)]
+    string_columns = [c for c, column in enumerate(all_columns) if column[0] == _STRING]
+    if all(all_columns[c].count(_STRING) == len(all_columns[c]) for c in string_columns) and \
+            len(strings) == len(string_columns) * len(all_columns[0]):
+        # Every tuple has strings at the same positions - strings of one column are a slice of all strings
+        selected = []
+        for c in columns:
+            if c in string_columns:
+                selected.append(strings[string_columns.index(c)::len(string_columns)])
+            elif c in arrays:
+                selected.append(array('q', map(int, all_columns[c])))
+            else:
+                selected.append(convert_column(all_columns[c]))
+    else:
+        # Strings mixed with NULLs or numbers in one column - convert value by value
+        next_string = iter(strings).__next__
+        fields = [next_string() if field == _STRING else convert(field) for field in fields]
+        selected = [array('q', fields[c::width]) if c in arrays else fields[c::width] for c in columns]
+    return selected
+
+
+def iter_tuples(line: str, columns=None):
+    """
+    Yields all value tuples from a single INSERT statement, see `statement_columns`
+    :param line: A line containing the whole INSERT statement
+    :param columns: Positions of values to keep in yielded tuples, all values are kept if not given
+    :return: Generator of tuples with str, int, float or None values
+    """
+    selected = statement_columns(line, columns)
+    if selected is not None:
+        yield from zip(*selected)
+
+
+def iter_rows(lines, columns=None):
+    """
+    Yields value tuples from all INSERT statements in an iterable of lines (e.g. an opened dump file)
+    :param lines: Iterable of SQL lines
+    :param columns: Positions of values to keep in yielded tuples, all values are kept if not given
+    :return: Generator of tuples
+    """
+    for line in lines:
+        # Only work with INSERT statements
+        if line.startswith('INSERT INTO'):
+            yield from iter_tuples(line, columns)
+
+
+def iter_batches(lines, columns=None, record=list, arrays=()):
+    """
+    Yields values of all INSERT statements in an iterable of lines by column, one batch per statement.
+    Unlike `iter_rows`, no tuple is built for a single row.
+    :param lines: Iterable of SQL lines
+    :param columns: Positions of values to keep, all values are kept if not given
+    :param record: Type of yielded batches, called with the columns as arguments (e.g. a NamedTuple)
+    :param arrays: Positions of integer columns kept as `array('q')`, see `statement_columns`
+    :return: Generator of batches
+    """
+    for line in lines:
+        if line.startswith('INSERT INTO'):
+            selected = statement_columns(line, columns, arrays)
+            if selected is not None:
+                yield record(*selected)
@@ -1,12 +1,16 @@
 import argparse
 import json
-from pprint import pprint
+from multiprocessing import Pool
 
 import pandas as pd
-import tqdm
-from whoosh import index
 
-from common import MAIN_LANGS, INDEX_DIR, index_name
+import metrics
+from common import MAIN_LANGS
+from backlinks import backlink_languages, check_all_backlinks, write_report
+from term_stats import load_term_stats, update_term_stats
+from store import read_frame, table_length, page_table, langlink_table, read_manifest, duplicate_stats
+
+BACKLINKS_FILE = 'backlinks.json'
 
 
 def available_langs():
@@ -19,60 +23,61 @@ def available_langs():
             return []
 
 
-def check_backlinks():
-    """Run backlinks check"""
-    for lang_from in MAIN_LANGS:
-        for lang_to in MAIN_LANGS:
-            # All combinations of translations between main languages
-            if lang_to == lang_from:
-                continue
-            print(f'Checking backlinks {lang_from} -> {lang_to}')
-            # Load titles in target language
-            df_from = pd.read_csv(f'csv/langlinks/{lang_from}/to_{lang_to}.csv', sep='\t', header=None, index_col=0,
-                                  na_filter=False)
-            # Join them with source language titles on page_id
-            df = df_from.join(pd.read_csv(f'csv/page/{lang_from}.csv',
-                                          sep='\t',
-                                          header=None,
-                                          na_filter=False,
-                                          index_col=0, ),
-                              rsuffix=lang_from, lsuffix=lang_to)
-            # Replace spaces with underscores in translated titles
-            df['1' + lang_to] = df['1' + lang_to].apply(lambda x: x.replace(' ', '_'))
-            # Load page IDs in target language
-            df_other = pd.read_csv(f'csv/page/{lang_to}.csv',
-                                   sep='\t',
-                                   header=None,
-                                   na_filter=False,
-                                   index_col=1)
-            # Join target language page IDs on page title
-            df = df.join(df_other, on='1' + lang_to)
-            df.columns = [f'title_{lang_to}', f'title_{lang_from}', f'id_{lang_to}']
-            # Remove rows without translation - no ID was found in target
-            df = df.dropna()
-            # Load backward links (target -> source)
-            df_other = pd.read_csv(f'csv/langlinks/{lang_to}/to_{lang_from}.csv', sep='\t', header=None, index_col=0,
-                                   na_filter=False)
-            # Join backwards translated titles on IDs from target langlinks
-            df = df.join(df_other, on=f'id_{lang_to}')
-            # Filter working langlinks
-            df_no_nans = df.dropna()
-            # Filter rows where no backwards translation was found
-            broken_links = df[df.isna().any(axis=1)]
-            # Mask rows where backward translation was not found but the same
-            # title with different ID has working backward translation
-            subset = broken_links[f'title_{lang_from}'].isin(df_no_nans[f'title_{lang_from}'])
-            # Actual titles that are translatable from source to target, but not backwards
-            dead_links = broken_links.loc[~subset].drop_duplicates(f'title_{lang_from}')
-            # Duplicate titles with at least one backlink working
-            duplicate_broken_links = broken_links.loc[subset]
-            print('Broken backlinks:')
-            pprint(dead_links[f'title_{lang_from}'].values)
-            print(f'Number of broken backlinks {lang_from} -> {lang_to} -> {lang_from}: {dead_links.shape[0]}')
-            print(f'Number of broken backlinks from duplicate sites: {duplicate_broken_links.shape[0]}')
-
-
-def compute_stats():
+def langlink_pairs(manifest):
+    """
+    Combinations of main and target languages with langlinks tables - from langlinks tables in manifest, or from
+    all target languages saved by parser into info.json if manifest has none
+    :return: List of (lang_from, lang_to) tuples
+    """
+    pairs = []
+    for name in sorted(manifest):
+        kind, lang_from, lang_to = (name.split('/') + [None, None])[:3]
+        if kind == 'langlinks' and lang_from in MAIN_LANGS:
+            pairs.append((lang_from, lang_to[len('to_'):]))
+    if pairs:
+        return pairs
+    languages = available_langs()
+    if not languages:
+        print('Warning: allLangs missing in info.json and manifest has no langlinks tables, '
+              'translation statistics are empty. Run parser without -p to save them.')
+    return [(lang_from, lang_to) for lang_from in MAIN_LANGS for lang_to in languages if lang_to != lang_from]
+
+
+def check_backlinks(languages=None, report_file=BACKLINKS_FILE):
+    """
+    Run backlinks check
+    :param languages: Languages to check, all languages with parsed page and langlinks tables by default
+    :param report_file: Path to .json or .parquet file with results
+    """
+    if not languages:
+        languages = backlink_languages()
+    print(f'Checking backlinks between {languages}')
+    report = check_all_backlinks(languages)
+    for result in report:
+        print(f'Number of broken backlinks {result["lang_from"]} -> {result["lang_to"]} -> {result["lang_from"]}: '
+              f'{result["broken_backlinks"]}, from duplicate sites: {result["broken_backlinks_from_duplicates"]}')
+    write_report(report, report_file)
+    print(f'Broken backlinks written to {report_file}')
+
+
+def optional_table_length(name):
+    """Number of rows of a table, None if it does not exist"""
+    try:
+        return table_length(name)
+    except FileNotFoundError:
+        return None
+
+
+def page_stats(lang, manifest):
+    """Number of pages and duplicate statistics of a language - from manifest, or computed from the page table"""
+    stats = manifest.get(page_table(lang))
+    if stats is None:
+        titles = read_frame(page_table(lang))[1].tolist()
+        stats = dict(rows=len(titles), **duplicate_stats(titles))
+    return stats
+
+
+def compute_stats(jobs=None):
     """
     Computes total number of pages, number of duplicate pages, page with most duplicates
     and number of duplicates for each main language.
@@ -81,36 +86,37 @@ def compute_stats():
     main languages and language with most translations, as well as number of different languages
     that main language pages are translated into and number of pages translated between main languages.
 
+    Row counts and duplicates are taken from manifest recorded by parser. Tables missing in manifest
+    are counted by a pool of processes. Target languages are taken from langlinks tables in manifest,
+    so they are known also when parser did not save allLangs into info.json (`-p`).
+
+    :param jobs: Number of processes counting rows of tables missing in manifest
     :returns: A DataFrame with statistics
     """
-    stats = pd.DataFrame(columns=MAIN_LANGS)
+    manifest = read_manifest()
+    stats = pd.DataFrame(columns=MAIN_LANGS, dtype='object')
     for lang in MAIN_LANGS:
-        df = pd.read_csv(f'csv/page/{lang}.csv',
-                         sep='\t',
-                         header=None,
-                         na_filter=False,
-                         index_col=0)
-        mode = df[1].mode()
-        stats.at['pages_total', lang] = len(df)
-        stats.at['duplicate_pages', lang] = len(df) - len(df.drop_duplicates())
-        stats.at['most_duplicated_page', lang] = list(mode.values)
-        stats.at['most_page_duplicates', lang] = df[df[1] == mode.values[0]].shape[0]
-
-    lang_stats = pd.DataFrame(columns=MAIN_LANGS, dtype='int')
-    for lang_from in MAIN_LANGS:
-        for lang_to in available_langs():
-            if lang_to == lang_from:
-                continue
-            try:
-                df = pd.read_csv(f'csv/langlinks/{lang_from}/to_{lang_to}.csv', sep='\t', header=None, index_col=0,
-                                 na_filter=False)
-                lang_stats.at[lang_to, lang_from] = int(len(df))
-            except FileNotFoundError:
-                lang_stats.at[lang_to, lang_from] = None
-
-    stats = stats.append(lang_stats.describe().loc[['count', 'mean', 'max'], :])
-    main_lang_matrix = lang_stats.loc[MAIN_LANGS, :]
-    stats = stats.append(main_lang_matrix)
+        lang_page_stats = page_stats(lang, manifest)
+        stats.at['pages_total', lang] = lang_page_stats['rows']
+        stats.at['duplicate_pages', lang] = lang_page_stats['duplicate_pages']
+        stats.at['most_duplicated_page', lang] = lang_page_stats['most_duplicated_page']
+        stats.at['most_page_duplicates', lang] = lang_page_stats['most_page_duplicates']
+
+    pairs = langlink_pairs(manifest)
+    counts = {pair: manifest[langlink_table(*pair)]['rows'] for pair in pairs if langlink_table(*pair) in manifest}
+    missing = [pair for pair in pairs if pair not in counts]
+    if missing:
+        # Only lines are counted, tables are not parsed
+        with Pool(jobs) as pool:
+            counts.update(zip(missing, pool.map(optional_table_length, [langlink_table(*pair) for pair in missing])))
+
+    lang_stats = pd.DataFrame(columns=MAIN_LANGS, dtype='float')
+    for (lang_from, lang_to), count in counts.items():
+        lang_stats.at[lang_to, lang_from] = count
+
+    stats = pd.concat([stats, lang_stats.describe().loc[['count', 'mean', 'max'], :]])
+    main_lang_matrix = lang_stats.reindex(MAIN_LANGS)
+    stats = pd.concat([stats, main_lang_matrix])
     renaming = {'count': 'translation_languages_count',
                 'mean': 'average_translations',
                 'max': 'most_translations'}
@@ -121,67 +127,73 @@ def compute_stats():
     return stats
 
 
-def load_index(name):
-    return index.open_dir(INDEX_DIR, name)
-
-
-def collection_frequency():
+def collection_frequency(jobs=None):
     """Get 10 most frequent terms in the title collection in Whoosh index for each main language"""
+    update_term_stats(MAIN_LANGS, jobs)
     for lang in MAIN_LANGS:
-        idx = load_index(index_name(lang))
-        with idx.reader() as reader:
-            yield lang, reader.most_frequent_terms('title', number=10)
+        terms = load_term_stats(lang).nlargest(10, 'collection_frequency')
+        yield lang, list(zip(terms['collection_frequency'], terms['term']))
 
 
-def multiple_occurrences():
+def multiple_occurrences(jobs=None):
     """
     Find terms that appear multiple times in a single document/page title,
     e. g. terms where document frequency != collection frequency
     """
+    update_term_stats(MAIN_LANGS, jobs)
     for lang in MAIN_LANGS:
-        idx = load_index(index_name(lang))
-        with idx.reader() as reader:
-            result = []
-            for term in tqdm.tqdm(iterable=reader.field_terms('title'), desc=f'Analyzing terms for {lang}...'):
-                doc_f = reader.doc_frequency('title', term)
-                col_f = reader.frequency('title', term)
-                if not doc_f == col_f:
-                    result.append({'term': term, 'collection_frequency': col_f, 'document_frequency': doc_f})
-
-            yield pd.DataFrame(data=result)
+        terms = load_term_stats(lang)
+        yield terms[terms['collection_frequency'] != terms['document_frequency']].reset_index(drop=True)
 
 
 if __name__ == '__main__':
     arg_parser = argparse.ArgumentParser(description='Get statistics')
     group = arg_parser.add_argument_group(title='Outputs', description='Specify desired outputs')
     group.add_argument('-b', '--backlinks', action='store_true', help='Check backlinks')
+    arg_parser.add_argument('-j', '--jobs', type=int, help='Number of processes counting rows of tables which are not '
+                                                           'in manifest and computing term statistics '
+                                                           '(default: number of CPUs)')
+    arg_parser.add_argument('--backlink_langs', nargs='+', help='Languages to check backlinks between (default: all '
+                                                                'languages with parsed page and langlinks tables)')
+    arg_parser.add_argument('--backlink_report', default=BACKLINKS_FILE,
+                            help='Backlinks report file, .json or .parquet')
     group.add_argument('-s', '--stats', action='store_true', help='Show statistics')
     group.add_argument('-t', '--term_frequency', action='store_true', help='Show statistics')
     group.add_argument('-m', '--multiple_occ', action='store_true',
                        help='Show terms that appear more than once in a title')
+    arg_parser.add_argument('--time', help='Print timings of computed outputs', action='store_true')
+    metrics.add_arguments(arg_parser)
 
     args = arg_parser.parse_args()
-
-    if not args.backlinks and not args.stats and not args.term_frequency and not args.multiple_occ:
-        print('No output selected. Computing everything.')
-        args.backlinks = True
-        args.stats = True
-        args.term_frequency = True
-        args.multiple_occ = True
-
-    if args.backlinks:
-        check_backlinks()
-
-    if args.stats:
-        pd.set_option('display.max_colwidth', 20)
-        print(compute_stats())
-
-    if args.term_frequency:
-        for lang, tf in collection_frequency():
-            print(f'10 Most frequent terms {lang}wiki pages')
-            df_tf = pd.DataFrame(data=tf, columns=['Collection frequency', 'Term'])
-            print(df_tf)
-
-    if args.multiple_occ:
-        for df in multiple_occurrences():
-            print(df)
+    metrics.start(args)
+
+    try:
+        if not args.backlinks and not args.stats and not args.term_frequency and not args.multiple_occ:
+            print('No output selected. Computing everything.')
+            args.backlinks = True
+            args.stats = True
+            args.term_frequency = True
+            args.multiple_occ = True
+
+        if args.backlinks:
+            with metrics.span('backlinks'):
+                check_backlinks(args.backlink_langs, args.backlink_report)
+
+        if args.stats:
+            pd.set_option('display.max_colwidth', 20)
+            with metrics.span('stats'):
+                print(compute_stats(args.jobs))
+
+        if args.term_frequency:
+            with metrics.span('term_frequency'):
+                for lang, tf in collection_frequency(args.jobs):
+                    print(f'10 Most frequent terms {lang}wiki pages')
+                    df_tf = pd.DataFrame(data=tf, columns=['Collection frequency', 'Term'])
+                    print(df_tf)
+
+        if args.multiple_occ:
+            with metrics.span('multiple_occurrences'):
+                for df in multiple_occurrences(args.jobs):
+                    print(df)
+    finally:
+        metrics.finish(args)
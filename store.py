@@ -0,0 +1,387 @@
+"""
+Compact binary store for page and langlink tables, an alternative to the tab-separated files in `csv/`.
+
+Each table is a single memory-mappable file `store/{table}.tbl` with layout:
+    magic (8 bytes) | number of rows n (int64) | blob size (int64) |
+    page IDs (int32[n], sorted) | padding to 8 bytes | title offsets (int64[n + 1]) | UTF-8 titles blob
+Every title in the blob is terminated by a newline, so the whole blob can be decoded at once
+and a single title is `blob[offsets[i]:offsets[i + 1] - 1]`.
+
+Table names mirror the csv directory: `page/{lang}` and `langlinks/{lang_from}/to_{lang_to}`.
+"""
+import itertools
+import json
+import mmap
+import os
+from collections import Counter
+
+import numpy as np
+
+from common import STORE_DIR
+
+MAGIC = b'VINFTBL1'
+HEADER_SIZE = 24
+# Row counts and duplicate statistics of tables, recorded when the tables are built
+MANIFEST_FILE = f'{STORE_DIR}/manifest.json'
+# Number of rows decoded at once when a table is read row by row
+CHUNK_ROWS = 65536
+
+
+def page_table(lang):
+    """Name of the page table for a language"""
+    return f'page/{lang}'
+
+
+def langlink_table(lang_from, lang_to):
+    """Name of the langlinks table for a combination of languages"""
+    return f'langlinks/{lang_from}/to_{lang_to}'
+
+
+def csv_path(name):
+    """Path to the .csv file of a table"""
+    return f'csv/{name}.csv'
+
+
+def store_path(name):
+    """Path to the binary store file of a table"""
+    return f'{STORE_DIR}/{name}.tbl'
+
+
+def table_exists(name):
+    """Checks whether table exists in binary store or as .csv file"""
+    return os.path.exists(store_path(name)) or os.path.exists(csv_path(name))
+
+
+def write_table(name, ids, titles):
+    """
+    Writes a table into binary store. Rows are sorted by page ID (stable, so order of duplicates is kept).
+    :param name: Table name
+    :param ids: Sequence of page IDs
+    :param titles: Sequence of titles
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(ids) and (ids.min() < np.iinfo(np.int32).min or ids.max() > np.iinfo(np.int32).max):
+        raise ValueError(f'Page IDs of table {name} do not fit into int32')
+    order = np.argsort(ids, kind='stable')
+    ids = ids[order].astype(np.int32)
+    blob = ''.join([titles[i] + '\n' for i in order]).encode('utf8')
+    # Title starts right after each newline
+    ends = np.flatnonzero(np.frombuffer(blob, dtype=np.uint8) == ord('\n')) + 1
+    offsets = np.concatenate([[0], ends]).astype(np.int64)
+    if len(offsets) != len(ids) + 1:
+        raise ValueError(f'Titles of table {name} must not contain newlines')
+
+    path = store_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.array([len(ids), len(blob)], dtype=np.int64).tobytes())
+        f.write(ids.tobytes())
+        f.write(b'\0' * (-ids.nbytes % 8))
+        f.write(offsets.tobytes())
+        f.write(blob)
+    os.replace(path + '.tmp', path)
+
+
+def duplicate_stats(titles):
+    """
+    Statistics of duplicate titles in a page table
+    :param titles: Sequence of titles
+    :return: Dictionary with number of duplicate pages, most duplicated titles and their number of pages
+    """
+    counts = Counter(titles)
+    most = max(counts.values(), default=0)
+    # Without duplicates every title would be the most duplicated one
+    most_duplicated = sorted(title for title, count in counts.items() if count == most) if most > 1 else []
+    return {'duplicate_pages': len(titles) - len(counts),
+            'most_duplicated_page': most_duplicated,
+            'most_page_duplicates': most}
+
+
+def table_stats(name, titles):
+    """Statistics of a table saved in manifest - number of rows, duplicate statistics of page tables"""
+    stats = {'rows': len(titles)}
+    if name.startswith('page/'):
+        stats.update(duplicate_stats(titles))
+    return stats
+
+
+def read_manifest():
+    """Statistics of tables by table name, see `table_stats`"""
+    try:
+        with open(MANIFEST_FILE, encoding='utf8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return {}
+
+
+def update_manifest(stats: dict, removed=()):
+    """
+    Saves statistics of built tables into manifest
+    :param stats: Statistics by table name
+    :param removed: Names of tables which were removed
+    """
+    manifest = read_manifest()
+    manifest.update(stats)
+    for name in removed:
+        manifest.pop(name, None)
+    os.makedirs(STORE_DIR, exist_ok=True)
+    with open(MANIFEST_FILE + '.tmp', 'w', encoding='utf8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(MANIFEST_FILE + '.tmp', MANIFEST_FILE)
+
+
+def convert_csv(name):
+    """
+    Converts a .csv table written by parser into binary store
+    :param name: Table name
+    :return: Tuple (table name, statistics of the table for manifest)
+    """
+    ids = []
+    titles = []
+    with open(csv_path(name), encoding='utf8') as f:
+        for line in f:
+            page_id, title = line.rstrip('\n').split('\t', 1)
+            ids.append(int(page_id))
+            titles.append(title)
+    write_table(name, ids, titles)
+    return name, table_stats(name, titles)
+
+
+class Table:
+    """Memory-mapped table from binary store"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a table file')
+        n, blob_size = np.frombuffer(self._mmap, dtype=np.int64, count=2, offset=len(MAGIC))
+        n, blob_size = int(n), int(blob_size)
+        position = HEADER_SIZE
+        self.ids = np.frombuffer(self._mmap, dtype=np.int32, count=n, offset=position)
+        position += self.ids.nbytes + (-self.ids.nbytes % 8)
+        self.offsets = np.frombuffer(self._mmap, dtype=np.int64, count=n + 1, offset=position)
+        self._blob_start = position + self.offsets.nbytes
+        self._blob_size = blob_size
+
+    def __len__(self):
+        return len(self.ids)
+
+    def title(self, i):
+        """Title in the i-th row"""
+        start = self._blob_start + int(self.offsets[i])
+        end = self._blob_start + int(self.offsets[i + 1]) - 1
+        return self._mmap[start:end].decode('utf8')
+
+    def titles(self):
+        """All titles as a list, in the order of rows"""
+        if not len(self):
+            return []
+        blob = self._mmap[self._blob_start:self._blob_start + self._blob_size]
+        return blob.decode('utf8')[:-1].split('\n')
+
+    def rows(self, chunk_rows=CHUNK_ROWS):
+        """Generator of (page_id, title) tuples sorted by page ID, titles are decoded `chunk_rows` at a time"""
+        for start in range(0, len(self), chunk_rows):
+            end = min(start + chunk_rows, len(self))
+            blob = self._mmap[self._blob_start + int(self.offsets[start]):self._blob_start + int(self.offsets[end])]
+            yield from zip(self.ids[start:end].tolist(), blob.decode('utf8')[:-1].split('\n'))
+
+    def find(self, page_ids):
+        """
+        Finds rows of given page IDs using binary search
+        :param page_ids: Array of page IDs
+        :return: Array of row indices, -1 where page ID is not in the table
+        """
+        page_ids = np.asarray(page_ids, dtype=np.int64)
+        # Query has to be int32 as well, otherwise numpy would convert the whole mapped array for the search
+        valid = (page_ids >= np.iinfo(np.int32).min) & (page_ids <= np.iinfo(np.int32).max)
+        query = np.where(valid, page_ids, 0).astype(np.int32)
+        rows = np.searchsorted(self.ids, query)
+        found = valid & (rows < len(self.ids))
+        found[found] = self.ids[rows[found]] == query[found]
+        return np.where(found, rows, -1)
+
+    def get(self, page_id, default=None):
+        """Title of the page with given ID, or `default` if it is not in the table"""
+        row = self.find([page_id])[0]
+        return self.title(row) if row >= 0 else default
+
+    def to_frame(self):
+        """DataFrame in the same shape as `pd.read_csv` of the .csv table - page IDs as index, titles in column 1"""
+        # pandas is imported only when needed, it slows down startup of searcher
+        import pandas as pd
+
+        return pd.DataFrame({1: self.titles()}, index=pd.Index(np.asarray(self.ids, dtype=np.int64), name=0))
+
+    def close(self):
+        # Arrays viewing the map must be released before it can be closed
+        self.ids = self.offsets = None
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def open_table(name):
+    """
+    Opens a table from binary store
+    :param name: Table name
+    :return: Table, or None if the table is not in binary store
+    """
+    path = store_path(name)
+    if not os.path.exists(path):
+        return None
+    return Table(path)
+
+
+# Tables opened by `cached_table`, kept open for the lifetime of the process
+_open_tables = dict()
+
+
+def cached_table(name):
+    """
+    Opens a table from binary store once and keeps it mapped for further lookups
+    :param name: Table name
+    :return: Table, or None if the table is not in binary store
+    """
+    try:
+        return _open_tables[name]
+    except KeyError:
+        table = open_table(name)
+        if table is not None:
+            _open_tables[name] = table
+        return table
+
+
+def drop_cached_tables():
+    """
+    Forgets tables opened by `cached_table`, so that tables replaced since then (e.g. by incremental parse) are opened
+    again. Maps of the old files are closed when they are no longer used.
+    """
+    _open_tables.clear()
+
+
+def lookup_titles(table: Table, page_ids):
+    """
+    Looks up titles of pages by their IDs without loading the whole table
+    :param table: Opened table
+    :param page_ids: Sequence of page IDs
+    :return: List of titles, None where page ID is not in the table
+    """
+    return [table.title(row) if row >= 0 else None for row in table.find(page_ids)]
+
+
+def read_frame(name):
+    """
+    Loads a table as DataFrame with page IDs as index and titles in column 1.
+    Uses binary store if it exists, .csv file otherwise.
+    :param name: Table name
+    :raises FileNotFoundError: If the table exists in neither format
+    """
+    table = open_table(name)
+    if table is not None:
+        with table:
+            return table.to_frame()
+    import pandas as pd
+
+    return pd.read_csv(csv_path(name), sep='\t', header=None, index_col=0, na_filter=False)
+
+
+def table_rows(name):
+    """
+    Reads a table row by row, in constant memory. Rows of binary store are sorted by page ID, rows of .csv file are in
+    the order of the dump, which is sorted by page ID as well.
+    :param name: Table name
+    :return: Generator of (page_id, title) tuples
+    :raises FileNotFoundError: If the table exists in neither format (when the generator is started)
+    """
+    table = open_table(name)
+    if table is not None:
+        with table:
+            yield from table.rows()
+        return
+    yield from csv_rows(name)
+
+
+def csv_rows(name):
+    """
+    Reads .csv file of a table row by row, in the order of the dump
+    :param name: Table name
+    :return: Generator of (page_id, title) tuples
+    """
+    with open(csv_path(name), encoding='utf8') as f:
+        for line in f:
+            page_id, title = line.rstrip('\n').split('\t', 1)
+            yield int(page_id), title
+
+
+def _sorted_groups(rows, name):
+    """Groups rows by page ID, checking that they are sorted"""
+    previous = None
+    for page_id, group in itertools.groupby(rows, key=lambda row: row[0]):
+        if previous is not None and page_id < previous:
+            raise ValueError(f'Table {name} is not sorted by page ID ({page_id} after {previous}), '
+                             f'build binary store with parser.py')
+        previous = page_id
+        yield page_id, [title for _, title in group]
+
+
+def merge_groups(left_rows, right_rows, left_name, right_name):
+    """
+    Full outer join of two streams of rows on page ID. Both are read at once in the order of page IDs, so only rows
+    with the current page ID are held in memory.
+    :param left_rows: Iterable of (page_id, title) tuples sorted by page ID
+    :param right_rows: Iterable of (page_id, title) tuples sorted by page ID
+    :param left_name: Table name of left rows, for errors
+    :param right_name: Table name of right rows, for errors
+    :return: Generator of (page_id, left titles, right titles) tuples, titles of a side without the page ID are empty
+    :raises ValueError: If rows are not sorted by page ID
+    """
+    left = _sorted_groups(left_rows, left_name)
+    right = _sorted_groups(right_rows, right_name)
+    left_id, left_titles = next(left, (None, None))
+    right_id, right_titles = next(right, (None, None))
+    while left_id is not None or right_id is not None:
+        if right_id is None or (left_id is not None and left_id < right_id):
+            yield left_id, left_titles, []
+            left_id, left_titles = next(left, (None, None))
+        elif left_id is None or right_id < left_id:
+            yield right_id, [], right_titles
+            right_id, right_titles = next(right, (None, None))
+        else:
+            yield left_id, left_titles, right_titles
+            left_id, left_titles = next(left, (None, None))
+            right_id, right_titles = next(right, (None, None))
+
+
+def merge_join(left_name, right_name):
+    """
+    Inner join of two tables on page ID, see `merge_groups`
+    :param left_name: Name of the first table, e.g. page table
+    :param right_name: Name of the second table, e.g. langlinks table
+    :return: Generator of (page_id, left title, right title) tuples, every combination of titles of the same page ID
+    :raises ValueError: If a table is not sorted by page ID
+    """
+    for page_id, left_titles, right_titles in merge_groups(table_rows(left_name), table_rows(right_name),
+                                                           left_name, right_name):
+        for left_title in left_titles:
+            for right_title in right_titles:
+                yield page_id, left_title, right_title
+
+
+def table_length(name):
+    """
+    Number of rows of a table, without loading titles
+    :raises FileNotFoundError: If the table exists in neither format
+    """
+    table = open_table(name)
+    if table is not None:
+        with table:
+            return len(table)
+    with open(csv_path(name), 'rb') as f:
+        return sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1024 * 1024), b''))
@@ -0,0 +1,116 @@
+"""
+Output of parsed langlinks - one .csv file per target language. Rows are buffered in memory per file and written
+in large sequential writes once the buffers together exceed a budget. Only a limited number of files is kept open,
+the least recently written one is closed when another is needed. Files are written under a temporary name and
+renamed when all rows are written, so a reader never sees a half-written table.
+"""
+import io
+import os
+from collections import OrderedDict
+
+# Buffered rows of all files together, in characters (roughly bytes, most titles are ASCII)
+BUFFER_BUDGET = 32 * 1024 * 1024
+# Open file descriptors
+MAX_OPEN_FILES = 64
+# Rows written between two checks of the budget
+CHECK_ROWS = 65536
+TMP_SUFFIX = '.tmp'
+
+
+class TableWriters:
+    """
+    Buffered writers of `{directory}/to_{key}.csv` files, used as context manager. Rows are written directly into
+    in-memory buffers returned by `buffer` (preferably many rows joined in one write, every written string is kept
+    until the buffer is flushed) and `check` is called every few thousand rows, so that writing costs as little as
+    writing into an opened file.
+    """
+
+    def __init__(self, directory, budget=BUFFER_BUDGET, max_open=MAX_OPEN_FILES):
+        """
+        :param directory: Directory of the .csv files, created when the first buffer is requested
+        :param budget: Size of all buffered rows in characters, largest buffers are written when it is exceeded
+        :param max_open: Maximum number of open files
+        """
+        self.directory = directory
+        self.budget = budget
+        self.max_open = max_open
+        # Key -> buffered rows
+        self._buffers = dict()
+        # Open files in the order of use, least recently used first
+        self._files = OrderedDict()
+        self.writes = 0
+
+    def path(self, key):
+        return f'{self.directory}/to_{key}.csv'
+
+    def keys(self):
+        """Keys of all files with at least one row"""
+        return self._buffers.keys()
+
+    def buffer(self, key):
+        """Buffer of the file of given key, rows are written into it by the caller"""
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            if not self._buffers:
+                os.makedirs(self.directory, exist_ok=True)
+            # Temporary file is created (and truncated) right away, later flushes append to it
+            open(self.path(key) + TMP_SUFFIX, 'wb').close()
+            buffer = self._buffers[key] = io.StringIO()
+        return buffer
+
+    def check(self):
+        """Writes the largest buffers if the budget is exceeded, until half of the budget is free"""
+        sizes = {key: buffer.tell() for key, buffer in self._buffers.items()}
+        buffered = sum(sizes.values())
+        if buffered > self.budget:
+            for key in sorted(sizes, key=sizes.get, reverse=True):
+                if buffered <= self.budget // 2:
+                    break
+                self._flush(key)
+                buffered -= sizes[key]
+
+    def _flush(self, key):
+        buffer = self._buffers[key]
+        if not buffer.tell():
+            return
+        f = self._files.pop(key, None)
+        if f is None:
+            if len(self._files) >= self.max_open:
+                self._files.popitem(last=False)[1].close()
+            f = open(self.path(key) + TMP_SUFFIX, 'ab')
+        self._files[key] = f
+        f.write(buffer.getvalue().encode('utf8'))
+        self.writes += 1
+        # Emptied in place, the caller keeps writing into the same buffer
+        buffer.seek(0)
+        buffer.truncate()
+
+    def close(self):
+        """Writes remaining rows, closes all files and renames them to their final names"""
+        for key in self._buffers:
+            self._flush(key)
+        self._close_files()
+        for key in self._buffers:
+            os.replace(self.path(key) + TMP_SUFFIX, self.path(key))
+
+    def abort(self):
+        """Closes all files and removes them, no final file is written"""
+        self._close_files()
+        for key in self._buffers:
+            try:
+                os.remove(self.path(key) + TMP_SUFFIX)
+            except FileNotFoundError:
+                pass
+
+    def _close_files(self):
+        while self._files:
+            self._files.popitem()[1].close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
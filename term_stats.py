@@ -0,0 +1,88 @@
+"""
+Term statistics of page indexes - collection and document frequency of every term in page titles. Statistics are read
+in one sequential sweep over the term dictionary of the index and saved into `store/terms/{lang}.tsv`, together with
+the index generation they were computed from, so that they are computed again only when the index changes.
+"""
+import argparse
+import os
+from multiprocessing import Pool
+
+import pandas as pd
+from whoosh import index
+
+from common import INDEX_DIR, STORE_DIR, MAIN_LANGS, index_name
+
+COLUMNS = ['term', 'collection_frequency', 'document_frequency']
+
+
+def term_stats_path(lang):
+    """Path to the term statistics table of a language"""
+    return f'{STORE_DIR}/terms/{lang}.tsv'
+
+
+def compute_term_stats(lang):
+    """
+    Reads statistics of all terms from page index of a language and saves them
+    :param lang: Language code
+    :return: Language code
+    """
+    idx = index.open_dir(INDEX_DIR, index_name(lang))
+    path = term_stats_path(lang)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with idx.reader() as reader, open(path + '.tmp', 'w', encoding='utf8') as f:
+        # First line is the index generation, terms follow
+        f.write(f'{idx.latest_generation()}\n')
+        f.write('\t'.join(COLUMNS) + '\n')
+        # Term info contains both frequencies, no need to look them up term by term
+        for term, info in reader.iter_field('title'):
+            f.write(f'{term.decode("utf8")}\t{int(info.weight())}\t{info.doc_frequency()}\n')
+    os.replace(path + '.tmp', path)
+    return lang
+
+
+def saved_generation(lang):
+    """Index generation of saved term statistics, None if they were not computed"""
+    try:
+        with open(term_stats_path(lang), encoding='utf8') as f:
+            return int(f.readline())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def is_current(lang):
+    """Checks whether saved term statistics were computed from current page index"""
+    return saved_generation(lang) == index.open_dir(INDEX_DIR, index_name(lang)).latest_generation()
+
+
+def update_term_stats(languages, jobs=None):
+    """
+    Computes term statistics of languages whose page index changed, in parallel
+    :param languages: Language codes
+    :param jobs: Number of processes
+    """
+    outdated = [lang for lang in languages if not is_current(lang)]
+    if outdated:
+        with Pool(min(len(outdated), jobs or os.cpu_count())) as pool:
+            for lang in pool.imap_unordered(compute_term_stats, outdated):
+                print(f'Term statistics {lang} computed')
+
+
+def load_term_stats(lang):
+    """
+    Loads term statistics of a language, computes them first if the index changed
+    :param lang: Language code
+    :return: pd.DataFrame with term, collection_frequency and document_frequency columns
+    """
+    if not is_current(lang):
+        compute_term_stats(lang)
+    return pd.read_csv(term_stats_path(lang), sep='\t', skiprows=1, na_filter=False, quoting=3,
+                       dtype={'term': str})
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Compute term statistics of page indexes')
+    arg_parser.add_argument('-l', '--languages', help='Languages', nargs='+', default=MAIN_LANGS, choices=MAIN_LANGS)
+    arg_parser.add_argument('-j', '--jobs', help='Number of processes', type=int)
+
+    args = arg_parser.parse_args()
+    update_term_stats(args.languages, args.jobs)
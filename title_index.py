@@ -0,0 +1,126 @@
+"""
+Hash index of normalized page titles for exact title lookups without searching the Whoosh index.
+
+Titles are normalized by the same analyzer as in the Whoosh page index (tokenized, lowercased, accents removed,
+underscores are spaces). The index of a language is a memory-mappable file `store/title/{lang}.idx` with layout:
+    magic (8 bytes) | number of rows n (int64) | hashes of normalized titles (int64[n], sorted) | page IDs (int32[n])
+Hashes can collide, so titles of found pages are normalized again and compared with the input.
+"""
+import hashlib
+import mmap
+import os
+
+import numpy as np
+
+from common import STORE_DIR, analyzer
+from store import cached_table, open_table, page_table
+
+MAGIC = b'VINFTTL1'
+HEADER_SIZE = 16
+
+
+def title_index_path(lang):
+    """Path to the title hash index of a language"""
+    return f'{STORE_DIR}/title/{lang}.idx'
+
+
+def normalize_title(title):
+    """Normalizes a title (or user input) with the page index analyzer, tokens are joined by a space"""
+    return ' '.join(token.text for token in analyzer(title.replace('_', ' ')))
+
+
+def title_hash(normalized):
+    """64-bit hash of a normalized title, stable across processes (unlike built-in `hash`)"""
+    return int.from_bytes(hashlib.blake2b(normalized.encode('utf8'), digest_size=8).digest(), 'little', signed=True)
+
+
+def build_title_index(lang):
+    """
+    Builds title hash index of a language from its page table in binary store
+    :param lang: Language code
+    :return: Number of indexed pages
+    """
+    table = open_table(page_table(lang))
+    if table is None:
+        raise FileNotFoundError(f'Page table {lang} is not in binary store')
+    hashes = []
+    page_ids = []
+    with table:
+        for page_id, title in zip(table.ids.tolist(), table.titles()):
+            normalized = normalize_title(title)
+            # Titles consisting only of stop words can't be looked up
+            if normalized:
+                hashes.append(title_hash(normalized))
+                page_ids.append(page_id)
+    hashes = np.array(hashes, dtype=np.int64)
+    order = np.argsort(hashes, kind='stable')
+
+    path = title_index_path(lang)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.array([len(hashes)], dtype=np.int64).tobytes())
+        f.write(hashes[order].tobytes())
+        f.write(np.array(page_ids, dtype=np.int32)[order].tobytes())
+    os.replace(path + '.tmp', path)
+    # Index opened in this process is outdated
+    _title_indexes.pop(lang, None)
+    return len(hashes)
+
+
+class TitleIndex:
+    """Memory-mapped title hash index of one language"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a title index file')
+        n = int(np.frombuffer(self._mmap, dtype=np.int64, count=1, offset=len(MAGIC))[0])
+        self.hashes = np.frombuffer(self._mmap, dtype=np.int64, count=n, offset=HEADER_SIZE)
+        self.page_ids = np.frombuffer(self._mmap, dtype=np.int32, count=n, offset=HEADER_SIZE + self.hashes.nbytes)
+
+    def candidates(self, normalized):
+        """Page IDs of titles with the same hash as normalized title"""
+        h = np.int64(title_hash(normalized))
+        start = np.searchsorted(self.hashes, h, side='left')
+        end = np.searchsorted(self.hashes, h, side='right')
+        return self.page_ids[start:end].tolist()
+
+
+# Title indexes opened by `exact_pages`, kept open for the lifetime of the process
+_title_indexes = dict()
+
+
+def exact_pages(title, lang):
+    """
+    Finds pages whose normalized title is equal to normalized input
+    :param title: Page title
+    :param lang: Language code
+    :return: List of (page_id, page_title) tuples in the same form as from Whoosh page index (spaces instead of
+             underscores), empty if no title matches exactly. None if the title index or page table is not built.
+    """
+    index = _title_indexes.get(lang)
+    if index is None:
+        if not os.path.exists(title_index_path(lang)):
+            return None
+        index = _title_indexes[lang] = TitleIndex(title_index_path(lang))
+    table = cached_table(page_table(lang))
+    if table is None:
+        return None
+    normalized = normalize_title(title)
+    if not normalized:
+        return []
+    candidates = index.candidates(normalized)
+    pages = []
+    for page_id, row in zip(candidates, table.find(candidates)):
+        if row >= 0:
+            page_title = table.title(row).replace('_', ' ')
+            if normalize_title(page_title) == normalized:
+                pages.append((page_id, page_title))
+    return pages
+
+
+def drop_cached_indexes():
+    """Forgets title indexes opened by `exact_pages`, so that indexes rebuilt since then are opened again"""
+    _title_indexes.clear()
@@ -0,0 +1,335 @@
+"""
+Langlink graph for translations between any two languages, not only from the main languages.
+
+Nodes are (language, title) pairs - pages of languages with parsed page and langlinks tables (pivot languages,
+cs, fi and sk) and titles of all languages their langlinks point to. A title linked from several pivot languages
+is a single node, so e.g. en:Prague connects cs, fi and sk pages about Prague, and a langlink between two pivot
+languages leads to the page node of the other language. Every langlink is an edge in both directions.
+
+A translation is a path of 1 hop (langlink from or to a pivot page) or 2 hops through a pivot node
+(any title -> cs/fi/sk page -> target title, or pivot page -> shared title -> page of another pivot language).
+
+Nodes are numbered language by language, so nodes of one language are a contiguous range of IDs. Adjacency is
+stored in CSR form - neighbours of node i are `indices[indptr[i]:indptr[i + 1]]`, sorted, so neighbours in one
+language are found by binary search. The graph is a memory-mappable file `store/graph.bin` with layout:
+    magic (8 bytes) | numbers of languages l, nodes n, edges e, titles blob size b (int64 each) |
+    first node of each language (int64[l + 1]) | indptr (int64[n + 1]) | indices (int32[e], padded to 8 bytes) |
+    hashes of lookup keys (int64[n], sorted) | nodes of hashes (int32[n], padded) | title offsets (int64[n + 1]) |
+    UTF-8 titles blob (b bytes) | language codes separated by newlines
+
+RAM budget: the file takes 28 bytes per node plus its title and 8 bytes per langlink (4 per direction).
+cs, fi and sk dumps have about 25 million langlinks to ~300 languages, pointing to about 8 million distinct
+titles, which is about 0.6 GB - `RAM_BUDGET` is 1 GB. The file is memory-mapped, so only pages touched by lookups
+are loaded, a lookup reads a few kilobytes.
+
+Building takes page IDs of binary store tables straight from their mapped columns, but it does not stream: titles
+of the language being numbered are decoded into Python strings (about 60 bytes each plus the title), nodes of all
+langlinks are kept until the end (16 bytes per langlink) and edges of both directions are sorted at once as int64
+keys (16 bytes per langlink). The peak is therefore the edges plus the titles of the largest language - on
+generated dumps with 33 languages about 1.6 times the file size, more with long titles.
+"""
+import mmap
+import os
+
+import numpy as np
+
+from common import STORE_DIR
+from store import langlink_table, open_table, page_table, table_rows
+from title_index import title_hash
+
+MAGIC = b'VINFGRP1'
+HEADER_SIZE = 40
+GRAPH_FILE = f'{STORE_DIR}/graph.bin'
+# Size of the graph file of cs, fi and sk with all target languages must stay under this
+RAM_BUDGET = 1024 ** 3
+
+
+def lookup_key(title):
+    """Key of a title in lookups - lowercased, underscores are spaces"""
+    return title.replace('_', ' ').strip().lower()
+
+
+def lookup_hash(title, lang):
+    """Hash of a title of a language in the lookup index"""
+    return title_hash(f'{lang}\t{lookup_key(title)}')
+
+
+def _table_names(directory, suffix):
+    return [name[:-len(suffix)] for name in os.listdir(directory) if name.endswith(suffix)] \
+        if os.path.isdir(directory) else []
+
+
+def pivot_languages():
+    """Languages with both page and langlinks tables parsed, their pages are pivot nodes of the graph"""
+    languages = set(_table_names('csv/page', '.csv')) | set(_table_names(f'{STORE_DIR}/page', '.tbl'))
+    return sorted(lang for lang in languages
+                  if os.path.isdir(f'csv/langlinks/{lang}') or os.path.isdir(f'{STORE_DIR}/langlinks/{lang}'))
+
+
+def link_targets(lang):
+    """Target languages of parsed langlinks of a language, from binary store and .csv files"""
+    names = set(_table_names(f'csv/langlinks/{lang}', '.csv')) | \
+        set(_table_names(f'{STORE_DIR}/langlinks/{lang}', '.tbl'))
+    return sorted(name[len('to_'):] for name in names if name.startswith('to_'))
+
+
+def _read_ids(name):
+    """Page IDs of a table, sorted"""
+    table = open_table(name)
+    if table is None:
+        return np.sort(np.fromiter((page_id for page_id, title in table_rows(name)), dtype=np.int64), kind='stable')
+    with table:
+        return np.array(table.ids, dtype=np.int64)
+
+
+def _read_table(name):
+    """
+    Page IDs and titles (with spaces) of a table, sorted by page ID. Columns of binary store are taken from the
+    mapped file as they are, only .csv tables are read row by row.
+    """
+    table = open_table(name)
+    if table is None:
+        rows = list(table_rows(name))
+        ids = np.array([page_id for page_id, title in rows], dtype=np.int64)
+        titles = np.array([title.replace('_', ' ') for page_id, title in rows], dtype=object)
+        order = np.argsort(ids, kind='stable')
+        return ids[order], titles[order]
+    with table:
+        ids = np.array(table.ids, dtype=np.int64)
+        titles = np.empty(len(ids), dtype=object)
+        titles[:] = [title.replace('_', ' ') for title in table.titles()]
+    return ids, titles
+
+
+def _aligned(array):
+    """Bytes of an array padded to a multiple of 8 bytes"""
+    data = array.tobytes()
+    return data + b'\0' * (-len(data) % 8)
+
+
+def build_translation_graph(path=GRAPH_FILE):
+    """
+    Builds langlink graph from page and langlinks tables of all pivot languages (binary store or .csv files)
+    :param path: Path of the graph file
+    :return: Dictionary with numbers of languages, nodes and edges and size of the file in bytes
+    """
+    # pandas is needed only for building, searcher imports this module as well
+    import pandas as pd
+
+    pivots = pivot_languages()
+    # Only page IDs of pivot languages are kept for the whole build, titles are read with their language
+    pages = {lang: _read_ids(page_table(lang)) for lang in pivots}
+    targets = {lang: link_targets(lang) for lang in pivots}
+    languages = sorted(set(pivots).union(*targets.values()))
+
+    lang_starts = [0]
+    blobs, offsets, hashes = [], [np.zeros(1, dtype=np.int64)], []
+    blob_size = 0
+    # Nodes of pages of pivot languages by row of their page table
+    page_nodes = dict()
+    # Langlinks as (pivot language, rows of linking pages, nodes of linked titles), resolved when all pages have nodes
+    links = []
+    for lang in languages:
+        parts = [_read_table(page_table(lang))[1]] if lang in pages else []
+        linking = []
+        for pivot in pivots:
+            if lang != pivot and lang in targets[pivot]:
+                ids, titles = _read_table(langlink_table(pivot, lang))
+                rows = np.searchsorted(pages[pivot], ids)
+                found = rows < len(pages[pivot])
+                found[found] = pages[pivot][rows[found]] == ids[found]
+                parts.append(titles[found])
+                linking.append((pivot, rows[found]))
+        codes, titles = pd.factorize(np.concatenate(parts))
+        nodes = codes.astype(np.int64) + lang_starts[-1]
+        position = 0
+        if lang in pages:
+            page_nodes[lang] = nodes[:len(pages[lang])]
+            position = len(pages[lang])
+        for pivot, rows in linking:
+            links.append((pivot, rows, nodes[position:position + len(rows)]))
+            position += len(rows)
+
+        titles = list(titles)
+        blob = ''.join(title + '\n' for title in titles).encode('utf8')
+        ends = np.flatnonzero(np.frombuffer(blob, dtype=np.uint8) == ord('\n')) + 1
+        offsets.append(ends.astype(np.int64) + blob_size)
+        blobs.append(blob)
+        blob_size += len(blob)
+        hashes.append(np.array([lookup_hash(title, lang) for title in titles], dtype=np.int64))
+        lang_starts.append(lang_starts[-1] + len(titles))
+    n = lang_starts[-1]
+
+    # Both directions of every langlink as one sorted array of (source * n + target) keys, duplicates removed.
+    # Sorted in place, np.unique would sort a copy of all keys.
+    keys = np.concatenate(
+        [page_nodes[pivot][rows] * n + nodes for pivot, rows, nodes in links] +
+        [nodes * n + page_nodes[pivot][rows] for pivot, rows, nodes in links] + [np.zeros(0, dtype=np.int64)])
+    del links
+    keys.sort()
+    if len(keys):
+        keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+    indptr = np.searchsorted(keys, np.arange(n + 1, dtype=np.int64) * n).astype(np.int64)
+    indices = (keys % max(n, 1)).astype(np.int32)
+    del keys
+    hashes = np.concatenate(hashes + [np.zeros(0, dtype=np.int64)])
+    order = np.argsort(hashes, kind='stable')
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.array([len(languages), n, len(indices), blob_size], dtype=np.int64).tobytes())
+        for array in (np.array(lang_starts, dtype=np.int64), indptr, indices, hashes[order],
+                      order.astype(np.int32), np.concatenate(offsets)):
+            f.write(_aligned(array))
+        for blob in blobs:
+            f.write(blob)
+        f.write('\n'.join(languages).encode('utf8'))
+    os.replace(path + '.tmp', path)
+    # Graph opened in this process is outdated
+    _graphs.pop(path, None)
+    return {'languages': len(languages), 'nodes': n, 'edges': len(indices), 'bytes': os.path.getsize(path)}
+
+
+class TranslationGraph:
+    """Memory-mapped langlink graph"""
+
+    def __init__(self, path=GRAPH_FILE):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a langlink graph file')
+        counts = np.frombuffer(self._mmap, dtype=np.int64, count=4, offset=len(MAGIC)).tolist()
+        languages, n, edges, blob_size = counts
+        position = HEADER_SIZE
+        arrays = []
+        for dtype, count in ((np.int64, languages + 1), (np.int64, n + 1), (np.int32, edges), (np.int64, n),
+                             (np.int32, n), (np.int64, n + 1)):
+            arrays.append(np.frombuffer(self._mmap, dtype=dtype, count=count, offset=position))
+            position += arrays[-1].nbytes + (-arrays[-1].nbytes % 8)
+        self.lang_starts, self.indptr, self.indices, self.hashes, self.hash_nodes, self.offsets = arrays
+        self._blob_start = position
+        self.languages = self._mmap[position + blob_size:].decode('utf8').split('\n') if languages else []
+        self._language_index = {lang: i for i, lang in enumerate(self.languages)}
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def language_range(self, lang):
+        """Range of nodes of a language as (first, end) tuple, empty if the language is not in the graph"""
+        i = self._language_index.get(lang)
+        if i is None:
+            return 0, 0
+        return int(self.lang_starts[i]), int(self.lang_starts[i + 1])
+
+    def language(self, node):
+        """Language of a node"""
+        return self.languages[int(np.searchsorted(self.lang_starts, node, side='right')) - 1]
+
+    def title(self, node):
+        """Title of a node, with spaces"""
+        start = self._blob_start + int(self.offsets[node])
+        end = self._blob_start + int(self.offsets[node + 1]) - 1
+        return self._mmap[start:end].decode('utf8')
+
+    def find(self, title, lang):
+        """Nodes of a language whose title is equal to input, ignoring case and underscores"""
+        first, end = self.language_range(lang)
+        h = np.int64(lookup_hash(title, lang))
+        start = np.searchsorted(self.hashes, h, side='left')
+        stop = np.searchsorted(self.hashes, h, side='right')
+        key = lookup_key(title)
+        # Hashes can collide
+        return [node for node in self.hash_nodes[start:stop].tolist()
+                if first <= node < end and lookup_key(self.title(node)) == key]
+
+    def neighbours(self, node, node_range=None):
+        """Neighbours of a node, only those in (first, end) range of nodes if it is given"""
+        neighbours = self.indices[self.indptr[node]:self.indptr[node + 1]]
+        if node_range is None:
+            return neighbours
+        # Query of the same type as the array, otherwise numpy would convert the slice
+        bounds = np.searchsorted(neighbours, np.array(node_range, dtype=np.int32))
+        return neighbours[bounds[0]:bounds[1]]
+
+    def translations(self, node, lang):
+        """
+        Translations of a node into a language by the shortest paths - direct langlinks, or paths of 2 hops
+        :param node: Node to translate
+        :param lang: Target language code
+        :return: List of (translated node, pivot node or None for a direct langlink) tuples. Translations of 2 hops
+                 are sorted by number of pivots leading to them, most supported first.
+        """
+        target = self.language_range(lang)
+        direct = self.neighbours(node, target)
+        if len(direct):
+            return [(translated, None) for translated in direct.tolist()]
+        pivots = dict()
+        for pivot in self.neighbours(node).tolist():
+            for translated in self.neighbours(pivot, target).tolist():
+                if translated != node:
+                    pivots.setdefault(translated, []).append(pivot)
+        return [(translated, pivots[translated][0])
+                for translated in sorted(pivots, key=lambda translated: -len(pivots[translated]))]
+
+    def close(self):
+        # Arrays viewing the map must be released before it can be closed
+        self.lang_starts = self.indptr = self.indices = self.hashes = self.hash_nodes = self.offsets = None
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+# Graphs opened by `graph_translations`, kept open for the lifetime of the process
+_graphs = dict()
+
+
+def has_translation_graph(path=GRAPH_FILE):
+    """Checks whether langlink graph is built"""
+    return path in _graphs or os.path.exists(path)
+
+
+def open_graph(path=GRAPH_FILE):
+    """Opens langlink graph once and keeps it mapped, None if it is not built"""
+    graph = _graphs.get(path)
+    if graph is None:
+        if not os.path.exists(path):
+            return None
+        graph = _graphs[path] = TranslationGraph(path)
+    return graph
+
+
+def drop_cached_graphs():
+    """Forgets graphs opened by `open_graph`, so that a graph rebuilt since then is opened again"""
+    _graphs.clear()
+
+
+def graph_translations(titles, lang_from, lang_to, path=GRAPH_FILE):
+    """
+    Translates exact titles between any two languages through langlink graph
+    :param titles: Titles in `lang_from`, matched ignoring case and underscores
+    :param lang_from: Input language code
+    :param lang_to: Target language code
+    :param path: Path of the graph file
+    :return: List of (original title, translated title, pivot language) tuples, pivot language is None for a direct
+             langlink, translated title is None if a title is in the graph but has no translation.
+             Titles which are not in the graph are left out. None if the graph is not built.
+    """
+    graph = open_graph(path)
+    if graph is None:
+        return None
+    results = []
+    for title in titles:
+        for node in graph.find(title, lang_from):
+            original = graph.title(node)
+            translations = graph.translations(node, lang_to)
+            if not translations:
+                results.append((original, None, None))
+            for translated, pivot in translations:
+                pivot_lang = graph.language(pivot) if pivot is not None else None
+                results.append((original, graph.title(translated), pivot_lang))
+    return results